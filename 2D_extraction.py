@@ -4,6 +4,17 @@ import os
 import sys
 import bpy
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import projection
+from projection import project_points
+import camera_arrays
+import projection_view
+from projection_view import load_camera_projection
+from frame_selection import parse_frame_args, load_frames, save_frames
+from profiler import PROFILER, parse_profile_args
+from stage_cache import StageCache
+from dataset_store import STORE_EXT, open_output, output_digests, save_output
+
 # Function to compute 2D positions
 def compute_2d_positions(motion, K, RT):
     # Convert 3D motion to homogeneous coordinates (4xN)
@@ -23,49 +34,87 @@ def main():
     argv = sys.argv
     argv = argv[argv.index("--") + 1:]  # Get arguments after '--'
 
+    # --start/--end/--stride/--random/--seed: subset of the 3D frames to project
+    selection, argv = parse_frame_args(argv)
+    # --profile [trace.json|trace.csv]: per-phase timing summary (and trace file) at the end of the run
+    argv = parse_profile_args(argv)
+    # Recompute even if the output is up to date
+    force = "--force" in argv
+    argv = [arg for arg in argv if arg != "--force"]
+    # Output format: npz (default), store (memory-mappable directory) or both
+    fmt = 'npz'
+    if "--format" in argv:
+        pos = argv.index("--format")
+        fmt = argv[pos + 1]
+        del argv[pos:pos + 2]
+
     if len(argv) < 2:
-        print("Usage: blender --background H3.6M.blend --python 2D_extraction.py -- S1 action_name")
+        print("Usage: blender --background H3.6M.blend --python 2D_extraction.py -- S1 action_name [--force] [--format npz|store|both] [--start N] [--end N] [--stride N] [--random N --seed N]")
         sys.exit(1)
 
     subject = argv[0]
     action_name = argv[1]
 
+    # Get the absolute path of the script location
+    script_path = bpy.path.abspath("//")
+    save_path = os.path.join(script_path, f"../../BlendMimic3D/{subject}/D2_Positions/{action_name}")
+    out_file = os.path.join(save_path, "2D_positions.npz")
     
-    # Load motion data from NPZ file
+    # 3D positions of the action (.npz or store directory, whichever the 3D stage wrote)
     motion_file = f"../../BlendMimic3D/{subject}/D3_Positions/{action_name}/{action_name}.npz"
-    motion_data = np.load(motion_file, allow_pickle=True)
-    motion = motion_data['positions_3d']
-
-    # Load camera parameters from NPZ file
     cam_params_file = f"../../BlendMimic3D/{subject}/Cameras/matrices_{subject}.npz"
-    cam_params = np.load(cam_params_file, allow_pickle=True)
+    
+    # Skip the action if neither its 3D positions nor the cameras changed since the last run
+    cache = StageCache(os.path.join(script_path, f"../../BlendMimic3D/{subject}/D2_Positions/.manifest_2d.json"), '2D', force=force)
+    clip_key = cache.key(motion=output_digests(cache, motion_file), cameras=cache.file_digest(cam_params_file),
+                         script=cache.code_digest(__file__, projection.__file__, camera_arrays.__file__,
+                                                  projection_view.__file__), fmt=fmt,
+                         frames=selection.key())
+    if cache.is_current(action_name, clip_key):
+        print("Up to date:", action_name)
+        cache.summary()
+        PROFILER.finish()
+        return
+    PROFILER.set_clip(action_name)
+    
+    with PROFILER.phase('load') as phase:
+        motion = open_output(motion_file)['positions_3d']
+        motion_store = os.path.splitext(motion_file)[0] + STORE_EXT
+        phase.add_files([motion_store if os.path.isdir(motion_store) else motion_file, cam_params_file])
+    
+    # Scene frame of every 3D row (frames.npy from the 3D stage, else 1..N as fbx2jointDict walks them)
+    frames = load_frames(os.path.dirname(motion_file))
+    if frames is None:
+        frames = np.arange(1, len(motion) + 1)
+    frames, index = selection.select(frames)
+    motion = motion[index]
 
-    # Assuming cam_params is a dictionary with 'K' (intrinsic matrix) and 'RT' (extrinsic matrix)
-    K_list = cam_params['K']
-    RT_list = cam_params['RT']
+    # Camera matrices (plain float arrays written by camParams.py, no pickling)
+    # Moving cameras (camParams.py --animated) use the per-frame P of the selected frames, decoded per chunk
+    P, track_rows = load_camera_projection(cam_params_file, frames)
     
+    # Project every frame for every camera in one batched pass -> (C, N, J, 2)
+    with PROFILER.phase('project') as phase:
+        positions_2d = project_points(motion, P, track_rows=track_rows)
+        phase.add_items(positions_2d.shape[0] * positions_2d.shape[1] * positions_2d.shape[2])
+
     # Create a dictionary to hold 2D positions for each camera
     positions_2d_dict = {}
-    for cam_idx, (K, RT) in enumerate(zip(K_list, RT_list)):
-        # Compute 2D positions for each frame
-        positions_2d_frames = []
-        for motion_frame in motion:
-            proj_2d = compute_2d_positions(motion_frame.T, K, RT)
-            positions_2d_frames.append(proj_2d.T)
-           
-        # Convert the list of 2D positions to a NumPy array of shape (N, 17, 2)
-        positions_2d_array = np.stack(positions_2d_frames, axis=0)
+    for cam_idx in range(positions_2d.shape[0]):
         # Store the 2D positions in the dictionary with camera name as the key
-        positions_2d_dict[f'Camera_{cam_idx}'] = positions_2d_array 
+        positions_2d_dict[f'Cam_{cam_idx}'] = positions_2d[cam_idx]
         
        
     # Save 2D positions to another NPZ file
-    # Get the absolute path of the script location
-    script_path = bpy.path.abspath("//")
     # Create the directory to save the NPZ file if it does not exist
-    save_path = os.path.join(script_path, f"../../BlendMimic3D/{subject}/D2_Positions/{action_name}")
     os.makedirs(save_path, exist_ok=True)
-    np.savez_compressed(os.path.join(save_path, "2D_positions.npz"), Cam_0=positions_2d_dict['Camera_0'], Cam_1=positions_2d_dict['Camera_1'], Cam_2=positions_2d_dict['Camera_2'], Cam_3=positions_2d_dict['Camera_3'])
+    with PROFILER.phase('save') as phase:
+        written = save_output(out_file, fmt, **positions_2d_dict)
+        written.append(save_frames(save_path, frames))
+        phase.add_files(written)
+    cache.record(action_name, clip_key, written)
+    cache.summary()
+    PROFILER.finish()
     #np.savez_compressed(os.path.join(save_path, "2D_positions.npz"), Cam_0=positions_2d_dict['Camera_0'])
     
 
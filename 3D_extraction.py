@@ -1,19 +1,26 @@
 import bpy
 import os
 import sys
-import json
-from mathutils import Vector
+import time
+from functools import partial
 import numpy as np 
 
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from joint_writer import JointArrayWriter, save_positions_3d
+from jointdict_loader import load_joint_dict
+import bone_sampler
+from bone_sampler import BlenderArmatureAdapter, BoneSampler
+from stage_cache import StageCache
+from frame_checkpoint import FrameCheckpoint, DEFAULT_CHECKPOINT_FRAMES
+from frame_selection import FrameSelection, parse_frame_args, save_frames, load_frames
+from profiler import PROFILER, parse_profile_args, resident_memory_mb
+from skeletons import DEFAULT_SKELETON, Skeleton, get_skeleton, save_skeleton
+from output_writer import OutputWriter, DEFAULT_WRITE_WORKERS, DEFAULT_WRITE_QUEUE, parse_writer_args
+
 HOME_FILE_PATH = os.path.abspath('homefile.blend')
 
 RESOLUTION = (1000, 1002)
 
-#Crucial joints sufficient for visualisation #FIX ME - Add more joints if desirable for MixamRig
-BASE_JOINT_NAMES = ['Hips', 'LeftUpLeg', 'LeftLeg', 'LeftFoot', 'RightUpLeg', 'RightLeg', 'RightFoot', 
-                    'Spine1', 'Neck','Head', 'HeadTop_End', 'RightArm', 'RightForeArm', 'RightHand', 
-                    'LeftArm', 'LeftForeArm', 'LeftHand',
-                    ]
 #Source directory where .fbx exist
 SRC_DATA_DIR ='regular'
 
@@ -23,8 +30,96 @@ OUT_DATA_DIR ='fbx2json'
 #Final directory where NPY files will ve stored
 #FINAL_DIR_PATH ='json2npy'
 
+#Clips imported between two full reloads of HOME_FILE_PATH (1 reloads before every clip, 0 never)
+DEFAULT_RELOAD_EVERY = 25
+
+#Datablock types an .fbx import can add; whatever a clip added is removed after it
+IMPORTED_DATABLOCKS = ('objects', 'meshes', 'armatures', 'actions', 'materials', 'textures', 'images',
+                       'cameras', 'lights', 'collections')
+
+
+# Puts the scene back in its home-file state between clips
+#
+# Each .fbx is imported into a fresh collection; after the clip, every datablock
+# that appeared since begin() is removed (by identity, so an import that reuses a
+# name such as 'Armature' is removed too), and the next import finds the same names
+# ('Armature', the first action) as after a reload. The full
+# read_homefile is only done every `reload_every` clips, or as soon as resident
+# memory passes `reload_memory_mb`, to drop anything the purge can't reach.
+class SceneReset:
+
+    def __init__(self, home_file, reload_every=DEFAULT_RELOAD_EVERY, reload_memory_mb=None):
+        self.home_file = home_file
+        self.reload_every = reload_every
+        self.reload_memory_mb = reload_memory_mb
+        #The scene was just saved as the home file
+        self.clips_since_reload = 0
+        self.reloads = 0
+        self.before = None
+        self.baseline_mb = None
+
+    def _reload_due(self):
+        if self.reload_every > 0 and self.clips_since_reload >= self.reload_every:
+            return True
+        if self.reload_memory_mb is not None:
+            rss = resident_memory_mb()
+            return rss is not None and rss > self.reload_memory_mb
+        return False
+
+    # Before importing a clip: reload if due, then snapshot the datablocks and
+    # make a new collection the import target
+    def begin(self, clip_name):
+        if self._reload_due():
+            with PROFILER.phase('read_homefile'):
+                bpy.ops.wm.read_homefile(filepath=self.home_file)
+            self.clips_since_reload = 0
+            self.reloads += 1
+        with PROFILER.phase('reset_scene'):
+            self.before = {kind: {block.as_pointer() for block in getattr(bpy.data, kind)}
+                           for kind in IMPORTED_DATABLOCKS if hasattr(bpy.data, kind)}
+            collection = bpy.data.collections.new('import_' + clip_name)
+            bpy.context.scene.collection.children.link(collection)
+            view_layer = bpy.context.view_layer
+            view_layer.active_layer_collection = view_layer.layer_collection.children[collection.name]
+
+    # After a clip: remove every datablock it added
+    def end(self):
+        with PROFILER.phase('purge_clip') as phase:
+            added = []
+            for kind, pointers in self.before.items():
+                added += [block for block in getattr(bpy.data, kind) if block.as_pointer() not in pointers]
+            bpy.data.batch_remove(added)
+            phase.add_items(len(added))
+        self.clips_since_reload += 1
+        rss = resident_memory_mb()
+        if rss is not None:
+            if self.baseline_mb is None:
+                self.baseline_mb = rss
+            print("Resident memory: %.0f MB (%+.0f MB since the first clip)" % (rss, rss - self.baseline_mb))
+
 
-def fbx2jointDict(joint_names, armature_name):
+# Extract joint positions for every .fbx in SRC_DATA_DIR and write D3_Positions/<anim>/<anim>.npz
+#
+# Positions go straight into a preallocated (F, J, 3) array (or an on-disk memmap
+# with `stream=True`); the per-frame JointDict JSON files are only written when
+# `dump_json=True`, as a debug output. `anim_files` restricts the run to a subset
+# of SRC_DATA_DIR and `npz_dir` overrides the D3_Positions output directory
+# (both used by batch_extraction.py to give each worker its own shard).
+# Clips whose .fbx, joint list, armature and script are unchanged since their
+# last export are skipped unless `force=True`. Finished chunks of
+# `checkpoint_frames` frames are kept on disk, so a clip interrupted by a crash
+# resumes after its last chunk (0 disables the checkpoint). `selection` picks
+# the frames (1..frame_end by default) that are evaluated and saved.
+# `joint_names` are full rig bone names, or None to export every pose bone of
+# the armature; `skeleton` is recorded in each clip's skeleton.json.
+# Between clips the imported datablocks are purged (see SceneReset); the home
+# file is reloaded every `reload_every` clips or past `reload_memory_mb`.
+# Outputs are compressed and written by `write_workers` background threads
+# (see OutputWriter) while the next clip is imported and stepped.
+def fbx2jointDict(joint_names, armature_name, subject, dump_json=False, stream=False, anim_files=None, npz_dir=None,
+                  force=False, fmt='npz', checkpoint_frames=DEFAULT_CHECKPOINT_FRAMES, selection=None, skeleton=None,
+                  reload_every=DEFAULT_RELOAD_EVERY, reload_memory_mb=None, write_workers=DEFAULT_WRITE_WORKERS,
+                  write_queue=DEFAULT_WRITE_QUEUE):
     
     
     #Remove 'Cube' object if exists in the scene
@@ -44,54 +139,138 @@ def fbx2jointDict(joint_names, armature_name):
     
     #Base file for blender
     bpy.ops.wm.save_as_mainfile(filepath=HOME_FILE_PATH)
+    scene_reset = SceneReset(HOME_FILE_PATH, reload_every, reload_memory_mb)
     
     #Get animation(.fbx) file paths
-    anims_path = os.listdir(SRC_DATA_DIR)
+    anims_path = os.listdir(SRC_DATA_DIR) if anim_files is None else anim_files
   
     #Make OUT_DATA_DIR
     if not os.path.exists(OUT_DATA_DIR):
         os.makedirs(OUT_DATA_DIR)    
     
+    if npz_dir is None:
+        npz_dir = f"../../BlendMimic3D/{subject}/D3_Positions"
+    
+    if selection is None:
+        selection = FrameSelection()
+    
+    if skeleton is None:
+        skeleton = get_skeleton('all') if joint_names is None else Skeleton('custom', joint_names)
+    
+    cache = StageCache(os.path.join(npz_dir, '.manifest_3d.json'), '3D', force=force)
+    script_digest = cache.code_digest(__file__, bone_sampler.__file__)
+    output_writer = OutputWriter(write_workers, write_queue)
+    
     for anim_name in anims_path:
         
         anim_file_path = os.path.join(SRC_DATA_DIR,anim_name)
-        save_dir = os.path.join(OUT_DATA_DIR,anim_name.split('.')[0],'JointDict')
+        clip_name = anim_name.split('.')[0]
+        save_dir = os.path.join(OUT_DATA_DIR,clip_name,'JointDict')
+        PROFILER.set_clip(clip_name)
         
-        #Make save_dir
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
+        clip_key = cache.key(fbx=cache.file_digest(anim_file_path), joints=joint_names,
+                             armature=armature_name, script=script_digest, fmt=fmt, frames=selection.key(),
+                             skeleton=skeleton.name)
+        if cache.is_current(clip_name, clip_key):
+            print("Up to date:", clip_name)
+            continue
         
-        #Load HOME_FILE and .fbx file
-        bpy.ops.wm.read_homefile(filepath=HOME_FILE_PATH)
-        bpy.ops.import_scene.fbx(filepath=anim_file_path)
+        #Reset the scene (full HOME_FILE reload only when due) and import the .fbx file
+        setup_start = time.perf_counter()
+        scene_reset.begin(clip_name)
+        #A clip that fails is still purged before the error propagates
+        try:
+            with PROFILER.phase('import_fbx') as phase:
+                bpy.ops.import_scene.fbx(filepath=anim_file_path)
+                phase.add_files([anim_file_path])
        
-        #End Frame Index for .fbx file
-        frame_end = bpy.data.actions[0].frame_range[1]
-        print(bpy.data.actions[0])
-        #print(bpy.data.actions[1])
-        print("Frames:")
-        print(frame_end)
+            #End Frame Index for .fbx file
+            frame_end = bpy.data.actions[0].frame_range[1]
+            print(bpy.data.actions[0])
+            #print(bpy.data.actions[1])
+            print("Frames:")
+            print(frame_end)
+            print("Setup: %.2fs" % (time.perf_counter() - setup_start))
         
+            #Scene frames to evaluate (the .fbx animation starts at frame 1)
+            frames = selection.frames(1, int(frame_end))
+            if len(frames) == 0:
+                print("No frames selected, skipping", clip_name)
+                continue
         
-        for i in range(int(frame_end)):
+            #Resolve the armature and its pose bones once per clip (a dense skeleton takes all of them)
+            adapter = BlenderArmatureAdapter(bpy.data.objects[armature_name])
+            clip_joints = adapter.bone_names() if joint_names is None else joint_names
+            sampler = BoneSampler(adapter, clip_joints)
+        
+            spill_path = os.path.join(OUT_DATA_DIR, clip_name + '_positions.npy') if stream else None
+            writer = JointArrayWriter(len(frames), len(clip_joints), spill_path=spill_path,
+                                      json_dir=save_dir if dump_json else None)
+            if dump_json:
+                #JSON file i holds frame i of the selection; its scene frames go next to JointDict
+                save_frames(os.path.join(OUT_DATA_DIR, clip_name), frames)
+            checkpoint = None
+            if checkpoint_frames > 0:
+                checkpoint = FrameCheckpoint(os.path.join(OUT_DATA_DIR, clip_name + '.partial'), len(frames), clip_key,
+                                             checkpoint_frames)
+            first_frame = checkpoint.resume_frame if checkpoint is not None else 0
+            if 0 < first_frame < len(frames):
+                print("Resuming at frame %d" % frames[first_frame])
+            if first_frame > 0:
+                #Frames already in the checkpoint go straight into the writer's buffer (the memmap with --stream)
+                checkpoint.read_into('positions_3d', writer.positions)
+        
+            for i in range(first_frame, len(frames)):
            
-            bpy.context.scene.frame_set(i+1)
+                with PROFILER.phase('frame_set'):
+                    bpy.context.scene.frame_set(int(frames[i]))
             
-            bone_struct = bpy.data.objects[armature_name].pose.bones
-            armature = bpy.data.objects[armature_name]
-
-            out_dict = {'pose_keypoints_3d': []}
+                with PROFILER.phase('sample_bones') as phase:
+                    joints = sampler.sample()
+                    phase.add_items(len(clip_joints))
+                with PROFILER.phase('write_json' if dump_json else 'write_frame'):
+                    writer.set_frame(i, joints)
+                if checkpoint is not None:
+                    with PROFILER.phase('checkpoint'):
+                        checkpoint.set_frame(i, positions_3d=writer.positions[i])
         
-            for name in joint_names:
-                global_location = armature.matrix_world @ bone_struct[name].matrix @ Vector((0, 0, 0))
-                l = [global_location[0], global_location[1], global_location[2]]
-                out_dict['pose_keypoints_3d'].extend(l)
-            
-            save_path = os.path.join(save_dir,'%04d_keypoints.json'%i)
-            with open(save_path,'w') as f:
-                json.dump(out_dict, f)
+            #Queued for the writer threads; the clip is recorded in the cache once its files are on disk
+            with PROFILER.phase('save'):
+                positions = writer.finalize()
+                output_writer.submit(clip_name, save_clip_3d, npz_dir, clip_name, positions, frames, fmt=fmt,
+                                     skeleton=skeleton, bone_names=clip_joints,
+                                     on_done=partial(clip_saved, cache, clip_name, clip_key, [writer, checkpoint]))
+        finally:
+            scene_reset.end()
+    
+    output_writer.close()
+    print("Home file reloads: %d" % scene_reset.reloads)
+    cache.summary()
+
+# Writer callback: record the saved clip in the cache, then drop its spill file and checkpoint
+def clip_saved(cache, clip_name, clip_key, scratch, written):
+    cache.record(clip_name, clip_key, written)
+    for item in scratch:
+        if item is not None:
+            item.remove()
 
-def jointDict2npy(subject):
+# Writer job: one clip's D3_Positions outputs (positions, data3D.txt, frames.npy and skeleton.json if given)
+def save_clip_3d(npz_dir, clip_name, positions, frames, fmt='npz', skeleton=None, bone_names=None):
+    written = save_positions_3d(npz_dir, clip_name, positions, fmt=fmt)
+    written.append(os.path.join(npz_dir, clip_name, 'data3D.txt'))
+    written.append(save_frames(os.path.join(npz_dir, clip_name), frames))
+    if skeleton is not None:
+        written.append(save_skeleton(os.path.join(npz_dir, clip_name), skeleton, bone_names))
+    return written
+
+# Re-export existing fbx2json/<anim>/JointDict directories to D3_Positions NPZ files
+#
+# JSON file i holds scene frame frames[i] from the frames.npy next to JointDict
+# (i + 1 for directories without one); `selection` keeps a subset of them.
+# `n_joints` keeps the first joints of each frame (all of them by default).
+# Each action is written in the background while the next one is loaded.
+def jointDict2npy(subject, workers=None, fmt='npz', selection=None, n_joints=None, write_workers=DEFAULT_WRITE_WORKERS,
+                  write_queue=DEFAULT_WRITE_QUEUE):
     
     json_dir = OUT_DATA_DIR
     npz_dir = f"../../BlendMimic3D/{subject}/D3_Positions"
@@ -99,39 +278,30 @@ def jointDict2npy(subject):
     if not os.path.exists(npz_dir):
         os.makedirs(npz_dir)
         
-    anim_names = os.listdir(json_dir)
+    anim_names = sorted(os.listdir(json_dir))
+    output_writer = OutputWriter(write_workers, write_queue)
    
     for anim_name in anim_names:
-        files_path = os.path.join(json_dir,anim_name,'jointDict')
-        frame_files = os.listdir(files_path)
-        
-        motion = []
-        
-        for frame_file in frame_files:
-            file_path = os.path.join(files_path,frame_file)
-            
-            with open(file_path) as f:
-                info = json.load(f)
-                joint = np.array(info['pose_keypoints_3d']).reshape((-1, 3))
-            motion.append(joint[:17,:])
-            
-            
-        motion = np.stack(motion,axis=2)
+        files_path = os.path.join(json_dir,anim_name,'JointDict')
+        if not os.path.isdir(files_path):
+            continue
+        PROFILER.set_clip(anim_name)
         
-        save_path = os.path.join(npz_dir,anim_name)
-        if not os.path.exists(save_path):
-            os.makedirs(save_path)
-
-        print('Saving...')
-        positions = motion.transpose(2, 0, 1)
-        np.savez_compressed(os.path.join(save_path, anim_name + ".npz"), positions_3d=positions)
+        #Frames ordered by their parsed index (not listdir order), loaded in parallel
+        with PROFILER.phase('load_json') as phase:
+            positions = load_joint_dict(files_path, n_joints=n_joints, workers=workers)
+            phase.add_items(len(positions))
+        frames = load_frames(os.path.join(json_dir, anim_name))
+        if frames is None:
+            frames = np.arange(1, len(positions) + 1)
+        elif len(frames) != len(positions):
+            raise ValueError('%s: %d JSON frames but %d in frames.npy' % (anim_name, len(positions), len(frames)))
+        if selection is not None:
+            frames, index = selection.select(frames)
+            positions = positions[index]
         
-        print('Done.')
-
-        data = motion
-        print(data.shape)
-        reshaped_data = np.reshape(data, (data.shape[0], -1))
-        np.savetxt(save_path+'/'+'data3D.txt', reshaped_data, delimiter=' ') 
+        with PROFILER.phase('save'):
+            output_writer.submit(anim_name, save_clip_3d, npz_dir, anim_name, positions, frames, fmt=fmt)
         
         ''' 
         cdf_data = data.transpose(2, 0, 1)
@@ -158,32 +328,110 @@ def jointDict2npy(subject):
         cdffile.close()
         '''
     
+    output_writer.close()
+    
         
 
         
 if __name__ == '__main__':
     
     argv = sys.argv[sys.argv.index("--") + 1:]  # Get arguments after "--"
+    #--start/--end/--stride/--random/--seed: frames to extract
+    selection, argv = parse_frame_args(argv)
+    #--profile [trace.json|trace.csv]: per-phase timing summary (and trace file) at the end of the run
+    argv = parse_profile_args(argv)
+    #--write-workers N (0: write on the main thread) and --write-queue N: background output writing
+    write_workers, write_queue, argv = parse_writer_args(argv)
+    dump_json = False
+    stream = False
+    from_json = False
+    workers = None
+    anim_files = None
+    npz_dir = None
+    force = False
+    fmt = 'npz'
+    checkpoint_frames = DEFAULT_CHECKPOINT_FRAMES
+    skeleton = None
+    reload_every = DEFAULT_RELOAD_EVERY
+    reload_memory_mb = None
     # Parse the command-line arguments
-    if argv:
-        for i in range(0, len(argv), 2):
-            if argv[i] == "--joint-id":
-                joint_id = argv[i + 1]
-            elif argv[i] == "--armature-name":
-                armature_name = argv[i + 1]
-            elif argv[i] == "--subject":
-                subject = argv[i + 1]
+    i = 0
+    while i < len(argv):
+        if argv[i] == "--joint-id":
+            joint_id = argv[i + 1]
+        elif argv[i] == "--armature-name":
+            armature_name = argv[i + 1]
+        elif argv[i] == "--subject":
+            subject = argv[i + 1]
+        elif argv[i] == "--dump-json":
+            #Also write the per-frame JointDict JSON files (debug only)
+            dump_json = True
+            i += 1
+            continue
+        elif argv[i] == "--stream":
+            #Buffer positions in an on-disk memmap instead of RAM
+            stream = True
+            i += 1
+            continue
+        elif argv[i] == "--force":
+            #Recompute every clip, even if its outputs are up to date
+            force = True
+            i += 1
+            continue
+        elif argv[i] == "--from-json":
+            #Only re-export existing JointDict directories
+            from_json = True
+            i += 1
+            continue
+        elif argv[i] == "--workers":
+            workers = int(argv[i + 1])
+        elif argv[i] == "--file-list":
+            #Text file with one .fbx name (relative to SRC_DATA_DIR) per line
+            with open(argv[i + 1]) as f:
+                anim_files = [line.strip() for line in f if line.strip()]
+        elif argv[i] == "--work-dir":
+            #Private directory for the home file and JSON output of this process
+            OUT_DATA_DIR = os.path.join(argv[i + 1], 'fbx2json')
+            HOME_FILE_PATH = os.path.abspath(os.path.join(argv[i + 1], 'homefile.blend'))
+        elif argv[i] == "--npz-dir":
+            npz_dir = argv[i + 1]
+        elif argv[i] == "--format":
+            #npz (default), store (memory-mappable directory) or both
+            fmt = argv[i + 1]
+        elif argv[i] == "--src-dir":
+            SRC_DATA_DIR = argv[i + 1]
+        elif argv[i] == "--checkpoint-frames":
+            #Frames per crash-safe on-disk chunk (0 disables resuming)
+            checkpoint_frames = int(argv[i + 1])
+        elif argv[i] == "--skeleton":
+            #Registered skeleton (mixamo17, h36m32, smpl24, all) or a .json/.yaml joint map
+            skeleton = get_skeleton(argv[i + 1])
+        elif argv[i] == "--reload-every":
+            #Clips between full home-file reloads (1: before every clip, as before; 0: never)
+            reload_every = int(argv[i + 1])
+        elif argv[i] == "--reload-memory":
+            #Also reload once resident memory passes this many MB
+            reload_memory_mb = float(argv[i + 1])
+        i += 2
                
 
-    #Number of joints to be used from MixamoRig
-    joint_names = ['mixamorig'+ joint_id +':' + x for x in BASE_JOINT_NAMES]
-   
-    #Convert .fbx files to JSON dict
-    fbx2jointDict(joint_names, armature_name)
-    
-    #Convert JSON dict to NPY 
-    jointDict2npy(subject)   
+    if from_json:
+        #Convert existing JSON dicts to NPZ
+        #Without --skeleton every joint of the JSON dicts is kept
+        n_joints = None if skeleton is None or skeleton.dense else len(skeleton)
+        jointDict2npy(subject, workers=workers, fmt=fmt, selection=selection, n_joints=n_joints,
+                      write_workers=write_workers, write_queue=write_queue)
+    else:
+        #Rig bones to sample (None: every pose bone, for a dense skeleton)
+        skeleton = skeleton or get_skeleton(DEFAULT_SKELETON)
+        joint_names = None if skeleton.dense else skeleton.bone_names(joint_id)
+       
+        #Convert .fbx files straight to NPZ (JSON dict only with --dump-json)
+        fbx2jointDict(joint_names, armature_name, subject, dump_json=dump_json, stream=stream,
+                      anim_files=anim_files, npz_dir=npz_dir, force=force, fmt=fmt,
+                      checkpoint_frames=checkpoint_frames, selection=selection, skeleton=skeleton,
+                      reload_every=reload_every, reload_memory_mb=reload_memory_mb,
+                      write_workers=write_workers, write_queue=write_queue)
+    PROFILER.finish()
 
          
-
-
@@ -0,0 +1,187 @@
+# Run 3D_extraction.py on the .fbx files of SRC_DATA_DIR with several Blender processes in parallel
+#
+# Usage (plain Python, not inside Blender):
+#   python batch_extraction.py --workers 8 --joint-id 8 --armature-name Armature --subject S1
+#
+# The file list is split into balanced shards (by file size), each worker gets its
+# own work directory and D3_Positions output directory, and the per-clip outputs are
+# moved into ../../BlendMimic3D/<subject>/D3_Positions once the workers are done,
+# together with their entries of the workers' .manifest_3d.json.
+# `--worker-cmd` replaces the Blender command line (e.g. with a stub for testing); it
+# may use the placeholders {file_list}, {work_dir}, {npz_dir}, {src_dir} and {worker}.
+import os
+import sys
+import time
+import shlex
+import shutil
+import argparse
+import subprocess
+
+from stage_cache import StageCache
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#Stage cache manifest 3D_extraction.py keeps in its --npz-dir
+MANIFEST_NAME = '.manifest_3d.json'
+
+
+# Split `files` into `n_shards` lists with roughly equal total size (largest files first)
+def shard_files(files, n_shards, sizes=None):
+    n_shards = max(1, min(n_shards, len(files)))
+    shards = [[] for _ in range(n_shards)]
+    loads = [0] * n_shards
+    if sizes is None:
+        sizes = [1] * len(files)
+    for size, name in sorted(zip(sizes, files), key=lambda item: (-item[0], item[1])):
+        target = loads.index(min(loads))
+        shards[target].append(name)
+        loads[target] += size
+    return [sorted(shard) for shard in shards]
+
+
+def default_worker_cmd(blender, joint_id, armature_name, subject, frame_args=()):
+    return [blender, '--background', '-P', os.path.join(SCRIPT_DIR, '3D_extraction.py'), '--',
+            '--joint-id', joint_id, '--armature-name', armature_name, '--subject', subject,
+            '--src-dir', '{src_dir}', '--file-list', '{file_list}', '--work-dir', '{work_dir}', '--npz-dir', '{npz_dir}'] + list(frame_args)
+
+
+# Clip names a worker has finished (one <clip>/<clip>.npz per clip)
+def finished_clips(npz_dir):
+    if not os.path.isdir(npz_dir):
+        return []
+    return sorted(name for name in os.listdir(npz_dir)
+                  if os.path.exists(os.path.join(npz_dir, name, name + '.npz')))
+
+
+# Launch one process per shard and wait for all of them, printing progress every `poll` seconds
+#
+# Returns one report dict per worker: assigned/finished/failed clips, exit code and log path.
+def run_shards(shards, cmd_template, work_root, src_dir, poll=5.0):
+    workers = []
+    for idx, shard in enumerate(shards):
+        work_dir = os.path.abspath(os.path.join(work_root, 'worker_%02d' % idx))
+        npz_dir = os.path.join(work_dir, 'D3_Positions')
+        os.makedirs(npz_dir, exist_ok=True)
+        file_list = os.path.join(work_dir, 'files.txt')
+        with open(file_list, 'w') as f:
+            f.write('\n'.join(shard) + '\n')
+
+        fields = {'file_list': file_list, 'work_dir': work_dir, 'npz_dir': npz_dir,
+                  'src_dir': os.path.abspath(src_dir), 'worker': idx}
+        cmd = [token.format(**fields) for token in cmd_template]
+        log_path = os.path.join(work_dir, 'worker.log')
+        log = open(log_path, 'w')
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=SCRIPT_DIR)
+        workers.append({'worker': idx, 'proc': proc, 'log': log, 'log_path': log_path,
+                        'npz_dir': npz_dir, 'assigned': shard, 'start': time.time()})
+
+    total = sum(len(shard) for shard in shards)
+    while True:
+        running = [w for w in workers if w['proc'].poll() is None]
+        done = sum(len(finished_clips(w['npz_dir'])) for w in workers)
+        status = ' '.join('w%d:%d/%d' % (w['worker'], len(finished_clips(w['npz_dir'])), len(w['assigned']))
+                          for w in workers)
+        print('[%d/%d clips, %d workers running] %s' % (done, total, len(running), status))
+        if not running:
+            break
+        time.sleep(poll)
+
+    reports = []
+    for w in workers:
+        w['log'].close()
+        expected = set(name.split('.')[0] for name in w['assigned'])
+        finished = [name for name in finished_clips(w['npz_dir']) if name in expected]
+        reports.append({
+            'worker': w['worker'],
+            'returncode': w['proc'].returncode,
+            'assigned': len(w['assigned']),
+            'finished': finished,
+            'failed': sorted(expected - set(finished)),
+            'seconds': time.time() - w['start'],
+            'log': w['log_path'],
+            'npz_dir': w['npz_dir'],
+        })
+    return reports
+
+
+# Move every finished <clip> directory of the workers into `dest_dir` (replacing older outputs)
+#
+# The clips' manifest entries are merged into `dest_dir`/.manifest_3d.json with
+# their output paths rewritten to `dest_dir`, so a later run there skips them.
+def merge_outputs(reports, dest_dir):
+    os.makedirs(dest_dir, exist_ok=True)
+    cache = StageCache(os.path.join(dest_dir, MANIFEST_NAME), '3D')
+    merged = []
+    for report in reports:
+        npz_dir = os.path.abspath(report['npz_dir'])
+        worker_cache = StageCache(os.path.join(npz_dir, MANIFEST_NAME), '3D')
+        cache.manifest['digests'].update(worker_cache.manifest['digests'])
+        for clip in report['finished']:
+            target = os.path.join(dest_dir, clip)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+            shutil.move(os.path.join(npz_dir, clip), target)
+            entry = worker_cache.manifest['clips'].get(clip)
+            if entry is not None:
+                outputs = [os.path.join(dest_dir, os.path.relpath(path, npz_dir)) for path in entry['outputs']]
+                cache.record(clip, entry['key'], outputs)
+            merged.append(clip)
+    return sorted(merged)
+
+
+def print_report(reports):
+    print('worker  exit  done/assigned  time(s)  failed')
+    for r in reports:
+        print('%6d  %4s  %6d/%-6d  %7.1f  %s' % (r['worker'], r['returncode'], len(r['finished']),
+                                                 r['assigned'], r['seconds'], ', '.join(r['failed']) or '-'))
+        if r['failed']:
+            print('        see %s' % r['log'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--blender', default='blender')
+    parser.add_argument('--joint-id', default='')
+    parser.add_argument('--armature-name', default='Armature')
+    parser.add_argument('--subject', required=True)
+    parser.add_argument('--src-dir', default=os.path.join(SCRIPT_DIR, 'regular'))
+    parser.add_argument('--work-root', default=os.path.join(SCRIPT_DIR, 'batch_work'))
+    parser.add_argument('--dest', default=None)
+    parser.add_argument('--worker-cmd', default=None)
+    parser.add_argument('--poll', type=float, default=5.0)
+    # Registered skeleton name or .json/.yaml joint map (see skeletons.py), passed on to every worker
+    parser.add_argument('--skeleton', default=None)
+    # Frame selection, passed on to every worker (see frame_selection.py)
+    for flag in ('--start', '--end', '--stride', '--random', '--seed'):
+        parser.add_argument(flag, type=int, default=None)
+    args = parser.parse_args()
+
+    files = sorted(name for name in os.listdir(args.src_dir) if name.lower().endswith('.fbx'))
+    if not files:
+        print('No .fbx files in %s' % args.src_dir)
+        sys.exit(1)
+    sizes = [os.path.getsize(os.path.join(args.src_dir, name)) for name in files]
+    shards = shard_files(files, args.workers, sizes)
+
+    if args.worker_cmd is not None:
+        cmd_template = shlex.split(args.worker_cmd)
+    else:
+        frame_args = []
+        for flag in ('start', 'end', 'stride', 'random', 'seed'):
+            if getattr(args, flag) is not None:
+                frame_args += ['--' + flag, str(getattr(args, flag))]
+        if args.skeleton is not None:
+            frame_args += ['--skeleton', os.path.abspath(args.skeleton) if os.path.exists(args.skeleton) else args.skeleton]
+        cmd_template = default_worker_cmd(args.blender, args.joint_id, args.armature_name, args.subject, frame_args)
+
+    print('%d files over %d workers' % (len(files), len(shards)))
+    reports = run_shards(shards, cmd_template, args.work_root, args.src_dir, poll=args.poll)
+
+    dest = args.dest or os.path.join(SCRIPT_DIR, f"../../BlendMimic3D/{args.subject}/D3_Positions")
+    merged = merge_outputs(reports, dest)
+    print_report(reports)
+    print('Merged %d clip(s) into %s' % (len(merged), dest))
+
+    if any(r['failed'] or r['returncode'] != 0 for r in reports):
+        sys.exit(1)
@@ -0,0 +1,57 @@
+# Benchmark: per-joint bone lookups (as fbx2jointDict used to do) vs. BoneSampler bulk reads
+#
+# Usage: python benchmarks/bench_bone_sampler.py [--frames 2000] [--bones 17 65 200] [--joints-all]
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bone_sampler import BoneSampler
+from fake_rig import FakeArmatureAdapter, synthetic_pose_matrices, synthetic_world_matrix
+
+
+# Old path: name lookup and `matrix_world @ bone.matrix @ origin` for every joint of every frame
+def per_joint(adapter, joint_names, n_frames):
+    out = np.empty((n_frames, len(joint_names), 3))
+    origin = np.array([0.0, 0.0, 0.0, 1.0])
+    for f in range(n_frames):
+        adapter.frame_set(f)
+        bones = {name: adapter.pose_matrices[adapter.frame, i] for i, name in enumerate(adapter.names)}
+        for j, name in enumerate(joint_names):
+            out[f, j] = (adapter.world @ bones[name] @ origin)[:3]
+    return out
+
+
+def batched(adapter, joint_names, n_frames):
+    out = np.empty((n_frames, len(joint_names), 3))
+    sampler = BoneSampler(adapter, joint_names)
+    for f in range(n_frames):
+        adapter.frame_set(f)
+        sampler.sample(out=out[f])
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--bones', type=int, nargs='+', default=[17, 65, 200])
+    args = parser.parse_args()
+
+    world = synthetic_world_matrix()
+    for n_bones in args.bones:
+        adapter = FakeArmatureAdapter(synthetic_pose_matrices(args.frames, n_bones), world)
+        #Dense export: every bone of the rig is a joint
+        joint_names = adapter.bone_names()
+
+        t0 = time.perf_counter()
+        ref = per_joint(adapter, joint_names, args.frames)
+        t_loop = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        out = batched(adapter, joint_names, args.frames)
+        t_batch = time.perf_counter() - t0
+
+        print('bones=%4d frames=%d  per-joint %8.1f ms  batched %7.1f ms  (%.1fx)  max diff %.1e'
+              % (n_bones, args.frames, t_loop * 1e3, t_batch * 1e3, t_loop / t_batch, np.abs(ref - out).max()))
@@ -0,0 +1,101 @@
+# Check and profile the NumPy BVH occlusion backend (bvh_occlusion.py) on synthetic scenes
+#
+# The scene is a set of UV spheres ("body parts" and occluders) around the origin,
+# watched by a ring of cameras. BVH results are checked against a brute-force
+# closest-hit search over every triangle, then rays/s is reported per mesh size.
+# Usage: python benchmarks/bench_bvh_occlusion.py [--spheres 40] [--rings 8 32 96] [--frames 20]
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bvh_occlusion import TriangleBVH, intersect_triangles, occluded_joints
+from bench_projection import synthetic_cameras
+
+
+def uv_sphere(center, radius, rings):
+    theta = np.linspace(0, np.pi, rings + 1)
+    phi = np.linspace(0, 2 * np.pi, 2 * rings, endpoint=False)
+    t, p = np.meshgrid(theta, phi, indexing='ij')
+    verts = np.stack([np.sin(t) * np.cos(p), np.sin(t) * np.sin(p), np.cos(t)], -1).reshape(-1, 3)
+    n_phi = len(phi)
+    faces = []
+    for i in range(rings):
+        for j in range(n_phi):
+            a, b = i * n_phi + j, i * n_phi + (j + 1) % n_phi
+            c, d = a + n_phi, b + n_phi
+            faces += [(a, c, b), (b, c, d)]
+    return verts * radius + center, np.array(faces)
+
+
+def synthetic_scene(n_spheres, rings, seed=0):
+    rng = np.random.default_rng(seed)
+    verts, faces, owners = [], [], []
+    offset = 0
+    for s in range(n_spheres):
+        v, f = uv_sphere(rng.uniform(-1.5, 1.5, 3) + [0, 0, 1], rng.uniform(0.05, 0.3), rings)
+        verts.append(v)
+        faces.append(f + offset)
+        owners.append(np.full(len(f), s))
+        offset += len(v)
+    return np.concatenate(verts), np.concatenate(faces), np.concatenate(owners)
+
+
+def brute_force_hits(origins, directions, verts, faces, chunk=64):
+    tri = verts[faces]
+    v0, e1, e2 = tri[:, 0], tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0]
+    best_t = np.full(len(origins), np.inf)
+    best_tri = np.full(len(origins), -1)
+    for start in range(0, len(origins), chunk):
+        o = np.repeat(origins[start:start + chunk], len(tri), axis=0)
+        d = np.repeat(directions[start:start + chunk], len(tri), axis=0)
+        n = len(o) // len(tri)
+        t = intersect_triangles(o, d, np.tile(v0, (n, 1)), np.tile(e1, (n, 1)), np.tile(e2, (n, 1))).reshape(n, -1)
+        best_tri[start:start + n] = np.where(np.isfinite(t.min(1)), t.argmin(1), -1)
+        best_t[start:start + n] = t.min(1)
+    return best_t, best_tri
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--spheres', type=int, default=40)
+    parser.add_argument('--rings', type=int, nargs='+', default=[8, 32, 96])
+    parser.add_argument('--frames', type=int, default=20)
+    parser.add_argument('--joints', type=int, default=17)
+    parser.add_argument('--cameras', type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(1)
+    _, RT = synthetic_cameras(args.cameras)
+    cam_locations = np.stack([-rt[:, :3].T @ rt[:, 3] for rt in RT])
+    joints = rng.normal(scale=0.6, size=(args.frames, args.joints, 3)) + [0, 0, 1]
+
+    #Correctness on a small scene: same closest triangle as brute force for every ray
+    verts, faces, owners = synthetic_scene(args.spheres, 6)
+    bvh = TriangleBVH(verts, faces, owners)
+    origins = np.repeat(cam_locations, args.frames * args.joints, axis=0)
+    directions = np.tile(joints.reshape(-1, 3), (args.cameras, 1)) - origins
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    t_bvh, tri_bvh = bvh.first_hits(origins, directions)
+    t_ref, tri_ref = brute_force_hits(origins, directions, verts, faces)
+    assert np.array_equal(np.isfinite(t_bvh), np.isfinite(t_ref))
+    assert np.allclose(t_bvh[np.isfinite(t_ref)], t_ref[np.isfinite(t_ref)])
+    print('check: %d rays, %d hits, closest hits match brute force' % (len(origins), np.isfinite(t_ref).sum()))
+
+    for rings in args.rings:
+        verts, faces, owners = synthetic_scene(args.spheres, rings)
+        owner_occludes = np.ones((args.spheres, args.joints), dtype=bool)
+        t0 = time.perf_counter()
+        bvh = TriangleBVH(verts, faces, owners)
+        t_build = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        n_occluded = 0
+        for frame in joints:
+            n_occluded += occluded_joints(bvh, owner_occludes, cam_locations, frame).sum()
+        t_cast = time.perf_counter() - t0
+        n_rays = args.frames * args.cameras * args.joints
+        print('triangles=%8d  build %7.1f ms  cast %7.1f ms  %9.0f rays/s  occluded %d/%d'
+              % (len(faces), t_build * 1e3, t_cast * 1e3, n_rays / t_cast, n_occluded, n_rays))
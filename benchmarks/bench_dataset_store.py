@@ -0,0 +1,68 @@
+# Benchmark: random frame-window reads from .npz outputs vs. dataset_store stores
+#
+# Usage: python benchmarks/bench_dataset_store.py [--frames 50000] [--window 243] [--reads 200]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset_store import ArrayStore, save_output, write_store
+
+
+def window_reads(read, n_frames, window, reads, seed=0):
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, n_frames - window, size=reads)
+    t0 = time.perf_counter()
+    total = 0.0
+    for start in starts:
+        total += float(read(start, start + window)[0, 0, 0])
+    return (time.perf_counter() - t0) / reads, total
+
+
+def dir_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=50000)
+    parser.add_argument('--joints', type=int, default=17)
+    parser.add_argument('--window', type=int, default=243)
+    parser.add_argument('--reads', type=int, default=200)
+    parser.add_argument('--chunk', type=int, default=1024)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    positions = np.cumsum(rng.normal(scale=0.01, size=(args.frames, args.joints, 3)), axis=0)
+    work_dir = tempfile.mkdtemp()
+    try:
+        npz_path = os.path.join(work_dir, 'clip.npz')
+        save_output(npz_path, 'both', positions_3d=positions)
+        chunked_path = os.path.join(work_dir, 'clip_chunked.store')
+        write_store(chunked_path, {'positions_3d': positions}, chunk_frames=args.chunk)
+
+        #What training scripts do today: open the .npz and decompress the whole array per sample
+        def read_npz(start, stop):
+            with np.load(npz_path) as data:
+                return data['positions_3d'][start:stop]
+
+        store = ArrayStore(os.path.join(work_dir, 'clip.store'))
+        chunked = ArrayStore(chunked_path)
+        a, b = read_npz(100, 400), chunked.window('positions_3d', 100, 400)
+        assert np.array_equal(a, store.window('positions_3d', 100, 400)) and np.array_equal(a, b)
+
+        print('frames=%d joints=%d window=%d reads=%d' % (args.frames, args.joints, args.window, args.reads))
+        for label, read, path in [
+                ('npz (savez_compressed)', read_npz, npz_path),
+                ('store, memmap', lambda s, e: store.window('positions_3d', s, e), os.path.join(work_dir, 'clip.store')),
+                ('store, chunked zlib', lambda s, e: chunked.window('positions_3d', s, e), chunked_path)]:
+            latency, _ = window_reads(read, args.frames, args.window, args.reads)
+            print('%-24s %9.1f us/window  %7.1f MB on disk' % (label, latency * 1e6, dir_size(path) / 1e6))
+    finally:
+        shutil.rmtree(work_dir)
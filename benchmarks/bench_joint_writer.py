@@ -0,0 +1,79 @@
+# Benchmark: per-frame JointDict JSON round trip vs. JointArrayWriter (in RAM and memmap-backed)
+#
+# Times the I/O side of 3D_extraction.py only (no Blender): writing F frames,
+# getting them back as an (F, J, 3) array and saving the final .npz.
+# Usage: python benchmarks/bench_joint_writer.py [--frames 10000] [--joints 17]
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from joint_writer import JointArrayWriter, save_positions_3d
+
+
+# The old path: one %04d_keypoints.json per frame, then listdir + json.load + np.stack
+def json_round_trip(frames, work_dir):
+    json_dir = os.path.join(work_dir, 'JointDict')
+    os.makedirs(json_dir)
+    for i, frame in enumerate(frames):
+        out_dict = {'pose_keypoints_3d': []}
+        for joint in frame:
+            out_dict['pose_keypoints_3d'].extend([joint[0], joint[1], joint[2]])
+        with open(os.path.join(json_dir, '%04d_keypoints.json' % i), 'w') as f:
+            json.dump(out_dict, f)
+
+    motion = []
+    for frame_file in sorted(os.listdir(json_dir)):
+        with open(os.path.join(json_dir, frame_file)) as f:
+            info = json.load(f)
+        motion.append(np.array(info['pose_keypoints_3d']).reshape((-1, 3)))
+    positions = np.stack(motion, axis=2).transpose(2, 0, 1)
+    np.savez_compressed(os.path.join(work_dir, 'clip.npz'), positions_3d=positions)
+    return positions
+
+
+def direct(frames, work_dir, spill):
+    spill_path = os.path.join(work_dir, 'clip_positions.npy') if spill else None
+    writer = JointArrayWriter(len(frames), len(frames[0]), spill_path=spill_path)
+    for i, frame in enumerate(frames):
+        writer.set_frame(i, frame)
+    positions = writer.finalize()
+    save_positions_3d(work_dir, 'clip', positions, save_txt=False)
+    writer.remove()
+    return positions
+
+
+def timed(fn, frames):
+    work_dir = tempfile.mkdtemp()
+    try:
+        t0 = time.perf_counter()
+        result = fn(frames, work_dir)
+        return time.perf_counter() - t0, result
+    finally:
+        shutil.rmtree(work_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=10000)
+    parser.add_argument('--joints', type=int, default=17)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    #Per-frame lists of (x, y, z) tuples, like the ones built from mathutils vectors
+    frames = [[tuple(j) for j in f] for f in rng.normal(size=(args.frames, args.joints, 3))]
+
+    t_json, ref = timed(json_round_trip, frames)
+    t_ram, out_ram = timed(lambda f, d: direct(f, d, False), frames)
+    t_mmap, out_mmap = timed(lambda f, d: direct(f, d, True), frames)
+    assert np.array_equal(ref, out_ram) and np.array_equal(ref, out_mmap)
+
+    print('frames=%d joints=%d' % (args.frames, args.joints))
+    print('JSON per frame  : %8.1f ms' % (t_json * 1e3))
+    print('direct (RAM)    : %8.1f ms  (%.1fx)' % (t_ram * 1e3, t_json / t_ram))
+    print('direct (memmap) : %8.1f ms  (%.1fx)' % (t_mmap * 1e3, t_json / t_mmap))
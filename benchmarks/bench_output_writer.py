@@ -0,0 +1,68 @@
+# Benchmark: saving clips on the main thread vs. handing them to OutputWriter
+#
+# Stands in for 3D_extraction.py: every clip steps F frames (a BLAS product per
+# frame, in place of frame_set + depsgraph evaluation) and then saves its
+# (F, J, 3) positions with save_positions_3d (compressed .npz + data3D.txt).
+# With the writer, compression and text export run while the next clip steps.
+# Usage: python benchmarks/bench_output_writer.py [--clips 8] [--frames 5000] [--joints 17] [--step 200]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from joint_writer import save_positions_3d
+from output_writer import OutputWriter, DEFAULT_WRITE_QUEUE
+
+
+def step_clip(rng, frames, joints, step):
+    positions = rng.normal(size=(frames, joints, 3))
+    a = rng.normal(size=(step, step))
+    for _ in range(frames):
+        a = a @ a.T / step
+    return positions
+
+
+def run(args, workers):
+    rng = np.random.default_rng(0)
+    out_dir = tempfile.mkdtemp()
+    try:
+        t0 = time.perf_counter()
+        writer = OutputWriter(workers, args.queue)
+        for clip in range(args.clips):
+            positions = step_clip(rng, args.frames, args.joints, args.step)
+            writer.submit('clip_%d' % clip, save_positions_3d, out_dir, 'clip_%d' % clip, positions)
+        writer.close()
+        elapsed = time.perf_counter() - t0
+        check = np.load(os.path.join(out_dir, 'clip_0', 'clip_0.npz'))['positions_3d']
+        return elapsed, writer.write_s, check
+    finally:
+        shutil.rmtree(out_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clips', type=int, default=8)
+    parser.add_argument('--frames', type=int, default=5000)
+    parser.add_argument('--joints', type=int, default=17)
+    parser.add_argument('--step', type=int, default=200, help='matrix size of the per-frame stand-in work')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=DEFAULT_WRITE_QUEUE)
+    args = parser.parse_args()
+
+    #Saving prints progress; keep the report readable
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        t_sync, write_sync, ref = run(args, 0)
+        t_async, write_async, out = run(args, args.workers)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    assert np.array_equal(ref, out)
+
+    print('clips=%d frames=%d joints=%d' % (args.clips, args.frames, args.joints))
+    print('main thread   : %8.2f s  (%.2f s of it saving)' % (t_sync, write_sync))
+    print('%d writer(s)   : %8.2f s  (%.2fx)' % (args.workers, t_async, t_sync / t_async))
@@ -0,0 +1,78 @@
+# Micro-benchmark: per-frame projection loop (as in 2D_extraction.py) vs. projection.project_points
+#
+# Usage: python benchmarks/bench_projection.py [--frames 10000] [--joints 17] [--cameras 4]
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from projection import stack_projection_matrices, project_points
+
+
+# Reference per-frame path, identical to compute_2d_positions in 2D_extraction.py
+def compute_2d_positions(motion, K, RT):
+    motion_homo = np.concatenate((motion, np.ones((1, motion.shape[1]))), axis=0)
+    P = K @ RT
+    proj_homo = P @ motion_homo
+    return proj_homo[:2, :] / proj_homo[2, :]
+
+
+def per_frame_projection(motion, K_list, RT_list):
+    out = []
+    for K, RT in zip(K_list, RT_list):
+        out.append(np.stack([compute_2d_positions(frame.T, K, RT).T for frame in motion], axis=0))
+    return np.stack(out, axis=0)
+
+
+# Synthetic cameras on a ring around the origin, looking at the subject
+def synthetic_cameras(n_cams, radius=5.0):
+    K_list, RT_list = [], []
+    for c in range(n_cams):
+        angle = 2 * np.pi * c / n_cams
+        K_list.append(np.array([[1150.0, 0.0, 500.0], [0.0, 1150.0, 501.0], [0.0, 0.0, 1.0]]))
+        z = -np.array([np.cos(angle), np.sin(angle), 0.0])
+        x = np.cross(z, [0.0, 0.0, 1.0])
+        x /= np.linalg.norm(x)
+        y = np.cross(z, x)
+        R = np.stack([x, y, z])
+        T = -R @ (radius * np.array([np.cos(angle), np.sin(angle), 1.0]))
+        RT_list.append(np.concatenate([R, T[:, None]], axis=1))
+    return np.stack(K_list), np.stack(RT_list)
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=10000)
+    parser.add_argument('--joints', type=int, default=17)
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--chunk', type=int, default=4096)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    motion = rng.normal(scale=0.5, size=(args.frames, args.joints, 3)) + [0.0, 0.0, 1.0]
+    K, RT = synthetic_cameras(args.cameras)
+    P = stack_projection_matrices(K, RT)
+
+    reference = per_frame_projection(motion, K, RT)
+    batched = project_points(motion, P, chunk_frames=args.chunk)
+    max_err = np.max(np.abs(reference - batched))
+
+    t_loop = best_of(lambda: per_frame_projection(motion, K, RT), args.repeat)
+    t_batch = best_of(lambda: project_points(motion, P, chunk_frames=args.chunk), args.repeat)
+
+    print('frames=%d joints=%d cameras=%d chunk=%d' % (args.frames, args.joints, args.cameras, args.chunk))
+    print('per-frame loop : %8.2f ms' % (t_loop * 1e3))
+    print('batched        : %8.2f ms  (%.1fx)' % (t_batch * 1e3, t_loop / t_batch))
+    print('max abs diff   : %.3e px' % max_err)
@@ -0,0 +1,87 @@
+# Benchmark: training-window reads reloading the .npz files per sample vs. sequence_loader batches
+#
+# Usage: python benchmarks/bench_sequence_loader.py [--actions 8] [--frames 3000] [--window 243] [--batch 256]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset_store import save_output
+from frame_selection import save_frames
+from sequence_loader import SequenceLoader, clip_paths
+
+
+# Synthetic BlendMimic3D tree: one subject with `actions` clips of D3/D2/Occlusions outputs
+def make_tree(root, actions, frames, joints, cameras, seed=0):
+    rng = np.random.default_rng(seed)
+    subject_dir = os.path.join(root, 'S1')
+    for a in range(actions):
+        action = 'Action%02d' % a
+        paths = clip_paths(subject_dir, action)
+        for path in paths.values():
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_frames(os.path.dirname(path), np.arange(1, frames + 1))
+        save_output(paths['3d'], positions_3d=rng.standard_normal((frames, joints, 3)))
+        save_output(paths['2d'], **{'Cam_%d' % c: rng.uniform(0, 1000, (frames, joints, 2)) for c in range(cameras)})
+        save_output(paths['occlusion'], **{'Cam_%d' % c: (rng.random((frames, joints)) < 0.2).astype(np.float64)
+                                          for c in range(cameras)})
+
+
+# What the ad-hoc training scripts do: open and decode all three files for every window
+def naive_window(loader, i):
+    k, c, start = (int(v) for v in loader.samples[i])
+    paths = loader.clips[k].paths
+    rows = np.clip(np.arange(start, start + loader.window), 0, loader.clips[k].n_frames - 1)
+    return (np.load(paths['3d'])['positions_3d'][rows], np.load(paths['2d'])['Cam_%d' % c][rows],
+            np.load(paths['occlusion'])['Cam_%d' % c][rows])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--actions', type=int, default=8)
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--joints', type=int, default=17)
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--window', type=int, default=243)
+    parser.add_argument('--batch', type=int, default=256)
+    parser.add_argument('--naive-samples', type=int, default=200)
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_loader_')
+    try:
+        make_tree(root, args.actions, args.frames, args.joints, args.cameras)
+        t0 = time.perf_counter()
+        loader = SequenceLoader(root, window=args.window, cache_clips=args.actions)
+        print('index: %d clips, %d samples in %.3f s' % (len(loader.clips), len(loader), time.perf_counter() - t0))
+
+        rng = np.random.default_rng(0)
+        picks = rng.integers(0, len(loader), size=args.naive_samples)
+        t0 = time.perf_counter()
+        for i in picks:
+            naive_window(loader, i)
+        naive = (time.perf_counter() - t0) / len(picks)
+        print('per-sample reload:   %10.1f windows/s' % (1 / naive))
+
+        for label, workers in (('loader (cold)', args.workers), ('loader (warm)', args.workers)):
+            t0 = time.perf_counter()
+            n = 0
+            for batch in loader.batches(args.batch, seed=0, workers=workers):
+                n += len(batch['samples'])
+            seconds = time.perf_counter() - t0
+            print('%-20s %10.1f windows/s  (%d windows, cache %d hits / %d misses)'
+                  % (label + ':', n / seconds, n, loader.hits, loader.misses))
+
+        # Loader windows match the files they came from
+        batch = loader.collate(picks[:8])
+        for b, i in enumerate(picks[:8]):
+            ref = naive_window(loader, i)
+            assert np.allclose(batch['positions_3d'][b], ref[0], atol=1e-6)
+            assert np.allclose(batch['positions_2d'][b], ref[1], atol=1e-3)
+            assert np.array_equal(batch['visibility'][b], ref[2])
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
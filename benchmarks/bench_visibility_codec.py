@@ -0,0 +1,82 @@
+# Benchmark: occluded_kpt.npz (float per joint and frame) vs. the packed visibility.npz
+#
+# Builds a synthetic (C, F, J) visibility with occlusions lasting several frames,
+# writes it in both encodings (.npz and store), checks that every reader gives
+# back the same masks and compares file sizes and window reads.
+# Usage: python benchmarks/bench_visibility_codec.py [--frames 20000] [--cameras 4] [--joints 17]
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from dataset_store import STORE_EXT, open_output
+from profiler import files_size
+from visibility_codec import FLOAT_NAME, VISIBILITY_NAME, VisibilityReader, save_occlusion_outputs, open_visibility
+
+
+# Visibility with hidden runs of `min_run`..`max_run` frames
+def make_visibility(rng, cameras, frames, joints, hidden=0.15, min_run=5, max_run=60):
+    visibility = np.ones((cameras, frames, joints))
+    n_runs = int(hidden * frames / ((min_run + max_run) / 2))
+    for c in range(cameras):
+        for j in range(joints):
+            for start, length in zip(rng.integers(0, frames, n_runs), rng.integers(min_run, max_run, n_runs)):
+                visibility[c, start:start + length, j] = 0
+    return visibility
+
+
+# Bytes of an output given by its .npz path, in format `fmt`
+def output_size(npz_path, fmt):
+    return files_size([npz_path if fmt == 'npz' else os.path.splitext(npz_path)[0] + STORE_EXT])
+
+
+# Mean time to read one (window, J) slice of a random camera
+def time_windows(reader, cameras, frames, window, n=500):
+    rng = np.random.default_rng(1)
+    t0 = time.perf_counter()
+    for camera, start in zip(rng.integers(0, cameras, n), rng.integers(0, frames - window, n)):
+        if isinstance(reader, VisibilityReader):
+            reader.window(camera, start, start + window)
+        else:
+            np.asarray(reader['Cam_%d' % camera][start:start + window])
+    return (time.perf_counter() - t0) / n
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--joints', type=int, default=17)
+    parser.add_argument('--window', type=int, default=243)
+    args = parser.parse_args()
+
+    visibility = make_visibility(np.random.default_rng(0), args.cameras, args.frames, args.joints)
+    root = tempfile.mkdtemp()
+    try:
+        sizes, reads = {}, {}
+        for fmt in ('npz', 'store'):
+            clip_dir = os.path.join(root, fmt)
+            os.makedirs(clip_dir)
+            save_occlusion_outputs(clip_dir, visibility, fmt, 'both')
+            float_path = os.path.join(clip_dir, FLOAT_NAME)
+            sizes[fmt] = (output_size(float_path, fmt), output_size(os.path.join(clip_dir, VISIBILITY_NAME), fmt))
+
+            packed = open_visibility(clip_dir)
+            for c in range(args.cameras):
+                assert np.array_equal(packed['Cam_%d' % c], visibility[c]), (fmt, c)
+                for j in range(args.joints):
+                    assert np.array_equal(packed.hidden_frames(c, j), np.flatnonzero(visibility[c, :, j] == 0))
+            reads[fmt] = (time_windows(open_output(float_path), args.cameras, args.frames, args.window),
+                          time_windows(packed, args.cameras, args.frames, args.window))
+    finally:
+        shutil.rmtree(root)
+
+    print('cameras=%d frames=%d joints=%d (round trip OK for npz and store)' % (args.cameras, args.frames, args.joints))
+    for fmt in ('npz', 'store'):
+        (float_bytes, packed_bytes), (float_s, packed_s) = sizes[fmt], reads[fmt]
+        print('%-5s float %10d B  packed %9d B  (%.1fx smaller)  window read %.3f ms vs %.3f ms'
+              % (fmt, float_bytes, packed_bytes, float_bytes / max(packed_bytes, 1), float_s * 1e3, packed_s * 1e3))
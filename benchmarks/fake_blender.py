@@ -0,0 +1,550 @@
+# Minimal stand-ins for the bpy / mathutils / bpy_extras surfaces the extraction scripts use
+#
+# install() registers the stub modules in sys.modules so 3D_extraction.py,
+# 2D_extraction.py, camParams.py and occlusion.py import unchanged; FakeScene
+# builds a synthetic world (animated armature, ring of cameras, box occluders)
+# from a few parameters. Only what the scripts touch is implemented.
+import os
+import sys
+import types
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from bvh_occlusion import TriangleBVH
+from fake_rig import synthetic_pose_matrices
+from skeletons import SKELETONS, MIXAMO_PREFIX
+
+#Bones of every registered skeleton, always present at the start of the fake rig
+RIG_BONES = list(dict.fromkeys(bone for skeleton in SKELETONS.values() if not skeleton.dense
+                               for bone in skeleton.bones))
+
+
+# ---------------------------------------------------------------- mathutils
+
+class Vector:
+
+    def __init__(self, values=(0.0, 0.0, 0.0)):
+        self._v = np.array(values, dtype=np.float64).ravel()
+
+    def __array__(self, dtype=None, copy=None):
+        return self._v if dtype is None else self._v.astype(dtype)
+
+    def __len__(self):
+        return len(self._v)
+
+    def __iter__(self):
+        return iter(self._v.tolist())
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self._v[i].tolist())
+        return float(self._v[i])
+
+    def __add__(self, other):
+        return Vector(self._v + np.asarray(other))
+
+    def __sub__(self, other):
+        return Vector(self._v - np.asarray(other))
+
+    def __neg__(self):
+        return Vector(-self._v)
+
+    def __mul__(self, scalar):
+        return Vector(self._v * scalar)
+
+    __rmul__ = __mul__
+
+    x = property(lambda self: float(self._v[0]))
+    y = property(lambda self: float(self._v[1]))
+    z = property(lambda self: float(self._v[2]))
+    w = property(lambda self: float(self._v[3]))
+
+    @property
+    def length(self):
+        return float(np.linalg.norm(self._v))
+
+    def normalized(self):
+        return Vector(self._v / np.linalg.norm(self._v))
+
+    def __repr__(self):
+        return 'Vector(%s)' % (tuple(self._v.tolist()),)
+
+
+class Matrix:
+
+    def __init__(self, rows=None):
+        self._m = np.eye(4) if rows is None else np.array([list(row) for row in rows], dtype=np.float64)
+
+    @classmethod
+    def _wrap(cls, array):
+        m = cls.__new__(cls)
+        m._m = np.array(array, dtype=np.float64)
+        return m
+
+    def __array__(self, dtype=None, copy=None):
+        return self._m if dtype is None else self._m.astype(dtype)
+
+    def __len__(self):
+        return len(self._m)
+
+    def __iter__(self):
+        return (Vector(row) for row in self._m)
+
+    def __getitem__(self, i):
+        return Vector(self._m[i])
+
+    def __matmul__(self, other):
+        if isinstance(other, Vector):
+            v = np.asarray(other)
+            if len(v) == 3 and self._m.shape == (4, 4):
+                return Vector((self._m @ np.append(v, 1.0))[:3])
+            return Vector(self._m @ v)
+        return Matrix._wrap(self._m @ np.asarray(other))
+
+    def __mul__(self, scalar):
+        return Matrix._wrap(self._m * scalar)
+
+    __rmul__ = __mul__
+
+    @property
+    def translation(self):
+        return Vector(self._m[:3, 3])
+
+    def transposed(self):
+        return Matrix._wrap(self._m.T)
+
+    def inverted(self):
+        return Matrix._wrap(np.linalg.inv(self._m))
+
+    def to_3x3(self):
+        return Matrix._wrap(self._m[:3, :3])
+
+    def decompose(self):
+        scale = np.linalg.norm(self._m[:3, :3], axis=0)
+        rotation = Matrix._wrap(self._m[:3, :3] / scale).to_quaternion()
+        return Vector(self._m[:3, 3]), rotation, Vector(scale)
+
+    def to_quaternion(self):
+        return Quaternion.from_matrix(self._m[:3, :3])
+
+    def __repr__(self):
+        return 'Matrix(%s)' % (self._m.tolist(),)
+
+
+class Quaternion:
+
+    def __init__(self, wxyz=(1.0, 0.0, 0.0, 0.0)):
+        self.w, self.x, self.y, self.z = (float(c) for c in wxyz)
+
+    @classmethod
+    def from_matrix(cls, R):
+        w = np.sqrt(max(0.0, 1 + R[0, 0] + R[1, 1] + R[2, 2])) / 2
+        x = np.copysign(np.sqrt(max(0.0, 1 + R[0, 0] - R[1, 1] - R[2, 2])) / 2, R[2, 1] - R[1, 2])
+        y = np.copysign(np.sqrt(max(0.0, 1 - R[0, 0] + R[1, 1] - R[2, 2])) / 2, R[0, 2] - R[2, 0])
+        z = np.copysign(np.sqrt(max(0.0, 1 - R[0, 0] - R[1, 1] + R[2, 2])) / 2, R[1, 0] - R[0, 1])
+        return cls((w, x, y, z))
+
+    def to_matrix(self):
+        w, x, y, z = self.w, self.x, self.y, self.z
+        return Matrix(((1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)),
+                       (2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)),
+                       (2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y))))
+
+
+class BVHTree:
+
+    def __init__(self, bvh):
+        self.bvh = bvh
+
+    @classmethod
+    def FromPolygons(cls, vertices, polygons, all_triangles=False, epsilon=0.0):
+        return cls(TriangleBVH(np.asarray(vertices), np.asarray(polygons)))
+
+    # (location, normal, index, distance), all None on a miss
+    def ray_cast(self, origin, direction, distance=np.inf):
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        t, tri = self.bvh.first_hits(origin[None], direction[None])
+        if tri[0] < 0 or t[0] > distance:
+            return None, None, None, None
+        normal = np.cross(self.bvh.e1[tri[0]], self.bvh.e2[tri[0]])
+        return Vector(origin + t[0] * direction), Vector(normal / np.linalg.norm(normal)), int(tri[0]), float(t[0])
+
+
+# ---------------------------------------------------------------- bpy data
+
+# Datablock identity, as ID.as_pointer()
+class FakeID:
+
+    def as_pointer(self):
+        return id(self)
+
+
+# bpy.types.Collection (what SceneReset imports into)
+class FakeDataCollection(FakeID):
+
+    def __init__(self, name):
+        self.name = name
+        self.objects = FakeCollection()
+
+
+# Name-indexed collection with the bpy_prop_collection calls the scripts use
+class FakeCollection(list):
+
+    def get(self, name, default=None):
+        for item in self:
+            if item.name == name:
+                return item
+        return default
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            item = self.get(key)
+            if item is None:
+                raise KeyError(key)
+            return item
+        return list.__getitem__(self, key)
+
+    def remove(self, item):
+        list.remove(self, item)
+
+    def keys(self):
+        return [item.name for item in self]
+
+    # bpy.data.collections.new
+    def new(self, name):
+        item = FakeDataCollection(name)
+        self.append(item)
+        return item
+
+
+class FakeObject(FakeID):
+
+    def __init__(self, name, obj_type, data=None, matrix_world=None):
+        self.name = name
+        self.type = obj_type
+        self.data = data
+        self.matrix_world = Matrix._wrap(np.eye(4) if matrix_world is None else matrix_world)
+        self.animation_data = None
+        self.parent = None
+        self.modifiers = []
+        self.constraints = []
+        self.original = self
+
+    @property
+    def location(self):
+        return self.matrix_world.translation
+
+    def to_mesh(self):
+        return self.data
+
+    def to_mesh_clear(self):
+        pass
+
+
+class FakeCameraData:
+
+    def __init__(self, lens=50.0, sensor_width=36.0, sensor_height=24.0, sensor_fit='AUTO'):
+        self.type = 'PERSP'
+        self.lens = lens
+        self.sensor_width = sensor_width
+        self.sensor_height = sensor_height
+        self.sensor_fit = sensor_fit
+        self.shift_x = 0.0
+        self.shift_y = 0.0
+        self.animation_data = None
+
+
+# foreach_get over a flat attribute array, like bpy_prop_collection.foreach_get
+class FakeAttributeArray:
+
+    def __init__(self, values):
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def foreach_get(self, attr, out):
+        out[:] = self.values.ravel()
+
+
+class FakeMesh:
+
+    def __init__(self, vertices, faces):
+        self.vertices = FakeAttributeArray(np.asarray(vertices, dtype=np.float32))
+        self.loop_triangles = FakeAttributeArray(np.asarray(faces, dtype=np.int32))
+        self.shape_keys = None
+
+    def calc_loop_triangles(self):
+        pass
+
+
+class FakePoseBone:
+
+    def __init__(self, bones, index, name):
+        self._bones = bones
+        self.index = index
+        self.name = name
+
+    @property
+    def matrix(self):
+        return Matrix._wrap(self._bones.matrices[self._bones.frame, self.index])
+
+    @property
+    def head(self):
+        return Vector(self._bones.matrices[self._bones.frame, self.index, :3, 3])
+
+
+# pose.bones of an armature playing back precomputed (F, B, 4, 4) matrices
+class FakePoseBones(FakeCollection):
+
+    def __init__(self, names, matrices):
+        self.matrices = matrices
+        self.frame = 0
+        FakeCollection.__init__(self, [FakePoseBone(self, i, name) for i, name in enumerate(names)])
+
+    def foreach_get(self, attr, out):
+        if attr != 'head':
+            raise NotImplementedError(attr)
+        out[:] = self.matrices[self.frame, :, :3, 3].ravel()
+
+
+class FakeAction(FakeID):
+
+    def __init__(self, name, n_frames):
+        self.name = name
+        self.frame_range = (1.0, float(n_frames))
+
+
+class FakeRender:
+
+    def __init__(self, resolution=(1000, 1002)):
+        self.resolution_x, self.resolution_y = resolution
+        self.resolution_percentage = 100
+        self.pixel_aspect_x = 1.0
+        self.pixel_aspect_y = 1.0
+
+
+class FakeInstance:
+
+    def __init__(self, obj):
+        self.object = obj
+        self.matrix_world = obj.matrix_world
+
+
+class FakeDepsgraph:
+
+    def __init__(self, scene):
+        self.scene = scene
+
+    @property
+    def object_instances(self):
+        return [FakeInstance(obj) for obj in self.scene.objects if obj.type == 'MESH']
+
+
+# Scene with an animated armature, cameras on a ring around it and static box occluders
+class FakeScene:
+
+    def __init__(self, n_frames=1000, n_bones=65, n_cameras=4, n_occluders=4, joint_id='',
+                 armature_name='Armature', resolution=(1000, 1002), seed=0):
+        self.name = 'Scene'
+        self.render = FakeRender(resolution)
+        self.frame_start = 1
+        self.frame_end = n_frames
+        self.frame_current = 1
+        self.frame_sets = 0
+        self.ray_casts = 0
+        self.homefile_reloads = 0
+        self.objects = FakeCollection()
+        self.actions = FakeCollection()
+        self.collections = FakeCollection()
+        self.collection = types.SimpleNamespace(children=types.SimpleNamespace(link=lambda collection: None))
+        self.armature_name = armature_name
+        self.joint_id = joint_id
+        self.n_bones = max(n_bones, len(RIG_BONES))
+        self.seed = seed
+        self.n_frames = n_frames
+        self.armature = None
+        self._triangles = None
+
+        for i in range(n_cameras):
+            self.objects.append(FakeObject('Camera_%d' % i, 'CAMERA', FakeCameraData(),
+                                           look_at(ring_position(i, n_cameras, 6.0, 1.5), (0.0, 0.0, 1.0))))
+        for i in range(n_occluders):
+            angle = 2 * np.pi * (i + 0.5) / max(n_occluders, 1)
+            center = (2.5 * np.cos(angle), 2.5 * np.sin(angle), 0.6)
+            self.objects.append(FakeObject('Wall%d' % i, 'MESH', FakeMesh(*box(center, (0.4, 0.4, 0.6)))))
+        self.load_clip('clip', n_frames)
+
+    # What an FBX import brings in: the armature and its action
+    def load_clip(self, clip_name, n_frames):
+        if self.armature is not None and self.armature in self.objects:
+            self.objects.remove(self.armature)
+        prefix = MIXAMO_PREFIX.format(id=self.joint_id)
+        names = [prefix + name for name in RIG_BONES]
+        names += ['%sExtra%03d' % (prefix, i) for i in range(self.n_bones - len(names))]
+        matrices = synthetic_pose_matrices(n_frames + 1, self.n_bones, seed=self.seed)
+        self.armature = FakeObject(self.armature_name, 'ARMATURE')
+        self.armature.pose = types.SimpleNamespace(bones=FakePoseBones(names, matrices))
+        self.armature.animation_data = types.SimpleNamespace(action=None, drivers=[])
+        self.objects.append(self.armature)
+        self.actions[:] = [FakeAction(clip_name, n_frames)]
+        self.armature.animation_data.action = self.actions[0]
+        self.n_frames = n_frames
+        self.frame_end = n_frames
+
+    # World-space joint positions the scripts should extract for frames 1..F -> (F, J, 3)
+    def expected_positions(self, joint_names):
+        bones = self.armature.pose.bones
+        index = [bones.get(name).index for name in joint_names]
+        heads = bones.matrices[1:self.n_frames + 1][:, index][..., :3, 3]
+        world = np.asarray(self.armature.matrix_world)
+        return heads @ world[:3, :3].T + world[:3, 3]
+
+    # read_homefile: drop whatever the clips imported
+    def read_homefile(self):
+        self.homefile_reloads += 1
+        if self.armature in self.objects:
+            self.objects.remove(self.armature)
+        self.actions[:] = []
+        self.collections[:] = []
+
+    # bpy.data.batch_remove over the collections the fake scene keeps
+    def batch_remove(self, ids):
+        for item in ids:
+            for blocks in (self.objects, self.actions, self.collections):
+                if item in blocks:
+                    blocks.remove(item)
+                    break
+
+    def frame_set(self, frame):
+        self.frame_current = frame
+        self.frame_sets += 1
+        bones = self.armature.pose.bones
+        bones.frame = min(max(int(frame), 0), len(bones.matrices) - 1)
+
+    # World-space occluder triangles as (v0, v1 - v0, v2 - v0) and the object of each
+    def _occluder_triangles(self):
+        if self._triangles is None:
+            triangles, owners = [], []
+            for obj in self.objects:
+                if obj.type != 'MESH':
+                    continue
+                world = np.asarray(obj.matrix_world)
+                vertices = obj.data.vertices.values.astype(np.float64) @ world[:3, :3].T + world[:3, 3]
+                triangles.append(vertices[obj.data.loop_triangles.values])
+                owners += [obj] * len(obj.data.loop_triangles.values)
+            triangles = np.concatenate(triangles) if triangles else np.empty((0, 3, 3))
+            self._triangles = (triangles[:, 0], triangles[:, 1] - triangles[:, 0], triangles[:, 2] - triangles[:, 0],
+                               owners)
+        return self._triangles
+
+    # (result, location, normal, index, object, matrix) like Scene.ray_cast
+    #
+    # Brute-force Moller-Trumbore against every triangle, written independently of
+    # bvh_occlusion.TriangleBVH so that the 'raycast' backend checks the 'bvh' one.
+    def ray_cast(self, depsgraph, origin, direction, distance=1.70141e+38):
+        self.ray_casts += 1
+        origin = np.asarray(origin, dtype=np.float64)
+        direction = np.asarray(direction, dtype=np.float64)
+        v0, e1, e2, owners = self._occluder_triangles()
+        if not owners:
+            return False, Vector(), Vector(), -1, None, None
+        pvec = np.cross(direction, e2)
+        det = np.sum(e1 * pvec, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            tvec = origin - v0
+            u = np.sum(tvec * pvec, axis=1) / det
+            qvec = np.cross(tvec, e1)
+            v = np.sum(direction * qvec, axis=1) / det
+            t = np.sum(e2 * qvec, axis=1) / det
+            t[~((det != 0) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > 0) & (t <= distance))] = np.inf
+        tri = int(np.argmin(t))
+        if not np.isfinite(t[tri]):
+            return False, Vector(), Vector(), -1, None, None
+        normal = np.cross(e1[tri], e2[tri])
+        obj = owners[tri]
+        return (True, Vector(origin + t[tri] * direction), Vector(normal / np.linalg.norm(normal)), tri, obj,
+                obj.matrix_world)
+
+
+def ring_position(i, n, radius, height):
+    angle = 2 * np.pi * i / max(n, 1)
+    return np.array([radius * np.cos(angle), radius * np.sin(angle), height])
+
+
+# Camera matrix_world at `position` looking at `target` (Blender cameras look down -Z, Y up)
+def look_at(position, target):
+    z = np.asarray(position, dtype=np.float64) - target
+    z /= np.linalg.norm(z)
+    x = np.cross([0.0, 0.0, 1.0], z)
+    x /= np.linalg.norm(x)
+    world = np.eye(4)
+    world[:3, 0] = x
+    world[:3, 1] = np.cross(z, x)
+    world[:3, 2] = z
+    world[:3, 3] = position
+    return world
+
+
+# Triangulated axis-aligned box -> (vertices (8, 3), faces (12, 3))
+def box(center, half_size):
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=np.float64)
+    faces = np.array([[0, 1, 3], [0, 3, 2], [4, 6, 7], [4, 7, 5], [0, 4, 5], [0, 5, 1],
+                      [2, 3, 7], [2, 7, 6], [0, 2, 6], [0, 6, 4], [1, 5, 7], [1, 7, 3]])
+    return corners * half_size + center, faces
+
+
+# ---------------------------------------------------------------- module installation
+
+# world_to_camera_view: normalized (x, y) in [0, 1] and depth z in front of the camera
+def world_to_camera_view(scene, camera, co):
+    from camera_arrays import calibration_matrices_K, rt_matrices_from_world
+    camd = camera.data
+    render = scene.render
+    K = calibration_matrices_K([camd.lens], [camd.sensor_fit], [camd.sensor_width], [camd.sensor_height],
+                               [camd.shift_x], [camd.shift_y], render.resolution_x, render.resolution_y,
+                               render.resolution_percentage, render.pixel_aspect_x, render.pixel_aspect_y)[0]
+    RT = rt_matrices_from_world(np.asarray(camera.matrix_world))
+    p = K @ (RT[:, :3] @ np.asarray(co) + RT[:, 3])
+    scale = render.resolution_percentage / 100
+    return Vector((p[0] / p[2] / (scale * render.resolution_x), 1 - p[1] / p[2] / (scale * render.resolution_y), p[2]))
+
+
+# Register stub bpy, mathutils and bpy_extras modules backed by `scene`; returns the bpy stub
+def install(scene, blend_dir='.'):
+    mathutils = types.ModuleType('mathutils')
+    mathutils.Vector, mathutils.Matrix, mathutils.Quaternion = Vector, Matrix, Quaternion
+    bvhtree = types.ModuleType('mathutils.bvhtree')
+    bvhtree.BVHTree = BVHTree
+    mathutils.bvhtree = bvhtree
+
+    bpy = types.ModuleType('bpy')
+    bpy.data = types.SimpleNamespace(objects=scene.objects, actions=scene.actions,
+                                     scenes={'Scene': scene}, collections=scene.collections,
+                                     batch_remove=scene.batch_remove,
+                                     filepath=os.path.join(os.path.abspath(blend_dir), 'fake.blend'))
+    view_layer = types.SimpleNamespace(active_layer_collection=None,
+                                       layer_collection=types.SimpleNamespace(children=scene.collections))
+    bpy.context = types.SimpleNamespace(scene=scene, object=scene.armature, view_layer=view_layer,
+                                        evaluated_depsgraph_get=lambda: FakeDepsgraph(scene))
+    bpy.path = types.SimpleNamespace(abspath=lambda path: os.path.join(os.path.abspath(blend_dir), path.lstrip('/')))
+    bpy.types = types.SimpleNamespace(Object=FakeObject)
+    clip_frames = {}
+    # import_scene.fbx loads the clip registered for that file (default: the scene's clip length)
+    bpy.ops = types.SimpleNamespace(
+        wm=types.SimpleNamespace(read_homefile=lambda filepath=None: scene.read_homefile(),
+                                 save_as_mainfile=lambda filepath=None: None),
+        import_scene=types.SimpleNamespace(fbx=lambda filepath: scene.load_clip(
+            os.path.splitext(os.path.basename(filepath))[0], clip_frames.get(filepath, scene.n_frames))))
+    bpy.clip_frames = clip_frames
+
+    bpy_extras = types.ModuleType('bpy_extras')
+    object_utils = types.ModuleType('bpy_extras.object_utils')
+    object_utils.world_to_camera_view = world_to_camera_view
+    bpy_extras.object_utils = object_utils
+
+    sys.modules.update({'bpy': bpy, 'mathutils': mathutils, 'mathutils.bvhtree': bvhtree,
+                        'bpy_extras': bpy_extras, 'bpy_extras.object_utils': object_utils})
+    return bpy
@@ -0,0 +1,53 @@
+# Synthetic armatures for running the extraction cores without Blender
+import numpy as np
+
+
+def random_rotation(rng, n):
+    q = rng.normal(size=(n, 4))
+    q /= np.linalg.norm(q, axis=1, keepdims=True)
+    w, x, y, z = q.T
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], -1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], -1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], -1),
+    ], 1)
+
+
+# Per-frame pose-bone matrices (armature space) for `n_bones` bones over `n_frames` frames
+def synthetic_pose_matrices(n_frames, n_bones, seed=0):
+    rng = np.random.default_rng(seed)
+    mats = np.zeros((n_frames, n_bones, 4, 4))
+    mats[:, :, :3, :3] = random_rotation(rng, n_frames * n_bones).reshape(n_frames, n_bones, 3, 3)
+    mats[:, :, :3, 3] = rng.normal(scale=0.5, size=(n_frames, n_bones, 3)) + [0.0, 0.0, 1.0]
+    mats[:, :, 3, 3] = 1.0
+    return mats
+
+
+def synthetic_world_matrix(seed=1):
+    rng = np.random.default_rng(seed)
+    world = np.eye(4)
+    world[:3, :3] = random_rotation(rng, 1)[0]
+    world[:3, 3] = rng.normal(size=3)
+    return world
+
+
+# Adapter with the BoneSampler interface over precomputed synthetic matrices
+class FakeArmatureAdapter:
+
+    def __init__(self, pose_matrices, world, bone_prefix='mixamorig:'):
+        self.pose_matrices = pose_matrices
+        self.world = world
+        self.names = ['%sBone%03d' % (bone_prefix, i) for i in range(pose_matrices.shape[1])]
+        self.frame = 0
+
+    def frame_set(self, frame):
+        self.frame = frame
+
+    def bone_names(self):
+        return self.names
+
+    def read_heads(self, out):
+        out[:] = self.pose_matrices[self.frame, :, :3, 3].ravel()
+
+    def world_matrix(self):
+        return self.world
@@ -0,0 +1,243 @@
+# Headless benchmark of every extraction stage against the fake Blender in fake_blender.py
+#
+# Runs camParams (K/RT/P), fbx2jointDict, jointDict2npy, 2D_extraction.main and the
+# occlusion frame walk (each --backend) on a synthetic scene, checks the outputs
+# against the known synthetic poses, and reports per-stage throughput and peak
+# Python-heap memory (tracemalloc, measured in a second untimed run) as JSON.
+#
+# Usage: python benchmarks/run_benchmarks.py [--frames 1000] [--clips 2] [--bones 65] [--cameras 4]
+#            [--occluders 4] [--backends raycast bvhtree bvh] [--skeleton mixamo17] [--output results.json]
+import os
+import sys
+import io
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+import importlib.util
+import tracemalloc
+import contextlib
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.append(REPO_DIR)
+sys.path.append(BENCH_DIR)
+import fake_blender
+from dataset_store import open_output
+from skeletons import DEFAULT_SKELETON, get_skeleton
+
+SUBJECT = 'S1'
+
+
+def load_script(path, name):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# Run `fn` with the scripts' prints silenced; returns (result, seconds)
+def timed(fn):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        result = fn()
+        return result, time.perf_counter() - t0
+
+
+# Peak traced heap of a second run of `fn`, in bytes
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class Harness:
+
+    def __init__(self, args):
+        self.args = args
+        self.root = tempfile.mkdtemp(prefix='bench_extraction_')
+        #The scripts resolve ../../BlendMimic3D/<subject> against the working (and .blend) directory
+        self.work_dir = os.path.join(self.root, 'scripts', 'blend')
+        self.out_root = os.path.join(self.root, 'BlendMimic3D', SUBJECT)
+        os.makedirs(os.path.join(self.work_dir, 'regular'))
+        os.makedirs(os.path.join(self.out_root, 'Cameras'))
+        self.old_cwd = os.getcwd()
+        os.chdir(self.work_dir)
+
+        self.scene = fake_blender.FakeScene(n_frames=args.frames, n_bones=args.bones, n_cameras=args.cameras,
+                                            n_occluders=args.occluders, joint_id=args.joint_id)
+        self.bpy = fake_blender.install(self.scene, self.work_dir)
+        self.clips = ['clip_%03d' % i for i in range(args.clips)]
+        for clip in self.clips:
+            with open(os.path.join('regular', clip + '.fbx'), 'w') as f:
+                f.write(clip)
+        self.skeleton = get_skeleton(args.skeleton)
+        self.joint_names = self.skeleton.bone_names(args.joint_id, [bone.name for bone in self.scene.armature.pose.bones])
+
+        self.camParams = load_script('camParams.py', 'camParams')
+        self.extraction_3d = load_script('3D_extraction.py', 'extraction_3d')
+        self.extraction_2d = load_script('2D_extraction.py', 'extraction_2d')
+        self.occlusion = load_script('occlusion.py', 'occlusion')
+        self.results = []
+
+    def close(self):
+        os.chdir(self.old_cwd)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+    def record(self, stage, fn, frames, joints=None, rays=None, check=None, **extra):
+        result, seconds = timed(fn)
+        entry = {'stage': stage, 'seconds': seconds, 'frames': frames, 'frames_per_s': frames / seconds}
+        if joints is not None:
+            entry['joints_per_s'] = joints / seconds
+        if rays is not None:
+            entry['rays'] = rays
+            entry['rays_per_s'] = rays / seconds
+        if not self.args.no_memory:
+            entry['peak_mem_bytes'] = peak_memory(fn)
+        if check is not None:
+            entry['max_error'] = float(check(result))
+        entry.update(extra)
+        self.results.append(entry)
+        print('%-24s %8.3f s  %10.1f frames/s%s' % (stage, seconds, entry['frames_per_s'],
+              '' if rays is None else '  %12.1f rays/s' % entry['rays_per_s']), file=sys.stderr)
+        return result
+
+    def cameras(self):
+        cameras = self.camParams.find_cameras()
+
+        def run():
+            K, RT, P = self.camParams.get_camera_matrices(cameras)
+            np.savez(os.path.join(self.out_root, 'Cameras', f'matrices_{SUBJECT}.npz'), K=K, RT=RT, P=P,
+                     camera_names=np.array([cam.name for cam in cameras]))
+            return P
+
+        # The mathutils port in camParams is the reference
+        legacy = np.array([np.asarray(self.camParams.get_3x4_P_matrix_from_blender(cam)[0]) for cam in cameras])
+        self.P = self.record('camParams', run, frames=1, check=lambda P: np.abs(P - legacy).max() / np.abs(legacy).max(),
+                             cameras=len(cameras))
+
+    def fbx2jointDict(self):
+        frames = self.args.frames * len(self.clips)
+        expected = self.scene.expected_positions(self.joint_names)
+
+        home_blocks = len(self.scene.objects) - 1 + len(self.scene.collections)
+
+        def run():
+            self.scene.homefile_reloads = 0
+            self.extraction_3d.fbx2jointDict(self.joint_names, 'Armature', SUBJECT, force=True, fmt=self.args.format,
+                                             skeleton=self.skeleton, reload_every=self.args.reload_every,
+                                             write_workers=self.args.write_workers)
+            return np.asarray(open_output(os.path.join(self.out_root, 'D3_Positions', self.clips[-1], self.clips[-1] + '.npz'))['positions_3d'])
+
+        self.record('fbx2jointDict', run, frames, joints=frames * len(self.joint_names),
+                    check=lambda positions: np.abs(positions - expected).max())
+        #Scene reset between clips: full reloads done, and datablocks left behind by the purge
+        self.results[-1]['homefile_reloads'] = self.scene.homefile_reloads
+        self.results[-1]['leaked_datablocks'] = (len(self.scene.objects) + len(self.scene.actions)
+                                                 + len(self.scene.collections) - home_blocks)
+        assert self.results[-1]['leaked_datablocks'] == 0, self.results[-1]['leaked_datablocks']
+        #JointDict JSON input for jointDict2npy (not timed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.extraction_3d.fbx2jointDict(self.joint_names, 'Armature', SUBJECT, dump_json=True, force=True,
+                                             skeleton=self.skeleton)
+
+    def jointDict2npy(self):
+        frames = self.args.frames * len(self.clips)
+        expected = self.scene.expected_positions(self.joint_names)
+
+        def run():
+            self.extraction_3d.jointDict2npy(SUBJECT, fmt=self.args.format, write_workers=self.args.write_workers)
+            return np.asarray(open_output(os.path.join(self.out_root, 'D3_Positions', self.clips[-1], self.clips[-1] + '.npz'))['positions_3d'])
+
+        self.record('jointDict2npy', run, frames, joints=frames * len(self.joint_names),
+                    check=lambda positions: np.abs(positions - expected).max())
+
+    def extraction_2d_main(self):
+        frames = self.args.frames * len(self.clips)
+        expected = self.scene.expected_positions(self.joint_names)
+        reference = self.extraction_2d.project_points(expected, self.P)
+
+        def run():
+            for clip in self.clips:
+                sys.argv = ['blender', '--', SUBJECT, clip, '--force', '--format', self.args.format]
+                self.extraction_2d.main()
+            data = open_output(os.path.join(self.out_root, 'D2_Positions', self.clips[-1], '2D_positions.npz'))
+            return np.stack([np.asarray(data[f'Cam_{c}']) for c in range(len(self.P))])
+
+        self.record('2D_extraction.main', run, frames, joints=frames * len(self.joint_names) * len(self.P),
+                    check=lambda positions: np.abs(positions - reference).max())
+
+    def occlusion_walk(self, backend):
+        occlusion = self.occlusion
+        cameras = self.camParams.find_cameras()
+        render = self.scene.render
+        resolution = (render.resolution_x * render.resolution_percentage / 100,
+                      render.resolution_y * render.resolution_percentage / 100)
+        frames = np.arange(1, self.args.frames + 1)
+        expected = self.scene.expected_positions(self.joint_names)
+        rays = int(occlusion.in_view_mask(expected, self.P, resolution).sum())
+        cam_locations = occlusion.camera_locations(cameras)
+
+        def run():
+            self.scene.load_clip(self.clips[0], self.args.frames)
+            sampler = occlusion.BoneSampler(occlusion.BlenderArmatureAdapter(self.scene.armature), self.joint_names)
+            return occlusion.walk_clip(frames, cameras, sampler, self.joint_names, self.scene.armature.pose.bones,
+                                       resolution, backend, self.P, cam_locations)[0]
+
+        prob = self.record('occlusion[%s]' % backend, run, len(frames), joints=len(frames) * len(self.joint_names),
+                           rays=rays)
+        if self.reference_prob is None:
+            self.reference_prob = prob
+        #Fraction of (camera, frame, joint) entries that disagree with the first backend
+        self.results[-1]['max_error'] = float(np.mean(prob != self.reference_prob))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--frames', type=int, default=1000)
+    parser.add_argument('--clips', type=int, default=2)
+    parser.add_argument('--bones', type=int, default=65)
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--occluders', type=int, default=4)
+    parser.add_argument('--joint-id', default='')
+    parser.add_argument('--format', default='npz')
+    parser.add_argument('--skeleton', default=DEFAULT_SKELETON)
+    parser.add_argument('--reload-every', type=int, default=25, help='clips between home-file reloads in fbx2jointDict')
+    parser.add_argument('--write-workers', type=int, default=2, help='background output writers (0: main thread)')
+    parser.add_argument('--backends', nargs='+', default=['raycast', 'bvhtree', 'bvh'])
+    parser.add_argument('--no-memory', action='store_true', help='skip the second, tracemalloc-traced run')
+    parser.add_argument('--output', default=None, help='write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    harness = Harness(args)
+    harness.reference_prob = None
+    try:
+        harness.cameras()
+        harness.fbx2jointDict()
+        harness.jointDict2npy()
+        harness.extraction_2d_main()
+        for backend in args.backends:
+            harness.occlusion_walk(backend)
+    finally:
+        harness.close()
+
+    report = {
+        'meta': {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+                 'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(),
+                 'params': vars(args)},
+        'results': harness.results,
+    }
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
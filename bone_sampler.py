@@ -0,0 +1,54 @@
+import numpy as np
+
+#Adapters expose an armature to BoneSampler through three calls:
+#   bone_names()        -> names of all pose bones, in pose.bones order
+#   read_heads(out)     -> fill `out` (float32, N*3) with every pose-bone head in armature space
+#   world_matrix()      -> 4x4 armature matrix_world as a NumPy array
+#This keeps the sampling core free of bpy so it can run against a fake armature.
+
+
+# Adapter over a Blender armature object (bpy.types.Object with pose data)
+class BlenderArmatureAdapter:
+
+    def __init__(self, armature):
+        self.armature = armature
+        self.pose_bones = armature.pose.bones
+
+    def bone_names(self):
+        return [bone.name for bone in self.pose_bones]
+
+    def read_heads(self, out):
+        # PoseBone.head is the translation of PoseBone.matrix, i.e. bone.matrix @ Vector((0, 0, 0))
+        self.pose_bones.foreach_get('head', out)
+
+    def world_matrix(self):
+        return np.array(self.armature.matrix_world, dtype=np.float64)
+
+
+# Samples world-space head positions for a fixed list of joints, one bulk read per frame
+#
+# Joint names are resolved to pose-bone indices once per clip; each `sample()`
+# then reads every bone head in a single foreach_get and applies matrix_world
+# to the selected joints as one vectorized transform.
+class BoneSampler:
+
+    def __init__(self, adapter, joint_names):
+        self.adapter = adapter
+        names = adapter.bone_names()
+        index = {name: i for i, name in enumerate(names)}
+        missing = [name for name in joint_names if name not in index]
+        if missing:
+            raise KeyError('Bones not found in armature: %s' % ', '.join(missing))
+        self.joint_index = np.array([index[name] for name in joint_names], dtype=np.intp)
+        self._heads = np.empty(len(names) * 3, dtype=np.float32)
+
+    # World-space (J, 3) positions for the current frame
+    def sample(self, out=None):
+        self.adapter.read_heads(self._heads)
+        heads = self._heads.reshape(-1, 3)[self.joint_index].astype(np.float64)
+        world = self.adapter.world_matrix()
+        if out is None:
+            out = np.empty((len(self.joint_index), 3), dtype=np.float64)
+        np.matmul(heads, world[:3, :3].T, out=out)
+        out += world[:3, 3]
+        return out
@@ -0,0 +1,205 @@
+import numpy as np
+
+#Triangles per BVH leaf
+DEFAULT_LEAF_SIZE = 8
+
+#Hits closer than this to the ray origin are ignored (same role as Blender's ray_cast epsilon)
+RAY_EPSILON = 1e-6
+
+
+# Interleave the low 10 bits of x with two zero bits (for 30-bit Morton codes)
+def _spread_bits(x):
+    x = x & 0x3ff
+    x = (x | (x << 16)) & 0x030000ff
+    x = (x | (x << 8)) & 0x0300f00f
+    x = (x | (x << 4)) & 0x030c30c3
+    x = (x | (x << 2)) & 0x09249249
+    return x
+
+
+# Bounding-volume hierarchy over a triangle soup, traversed with vectorized NumPy ray batches.
+#
+# `vertices` is (V, 3), `faces` is (T, 3) vertex indices and `tri_owner` (T,)
+# says which object each triangle belongs to. Triangles are sorted along a
+# Morton curve, grouped into leaves of `leaf_size` and the tree is built bottom-up
+# by pairing neighbouring nodes, so the build is a handful of array operations
+# per level. Nodes are stored in flat arrays, root first.
+class TriangleBVH:
+
+    def __init__(self, vertices, faces, tri_owner=None, leaf_size=DEFAULT_LEAF_SIZE):
+        vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 3)
+        faces = np.asarray(faces, dtype=np.int64).reshape(-1, 3)
+        self.leaf_size = int(leaf_size)
+        self.tri_owner = (np.zeros(len(faces), dtype=np.int64) if tri_owner is None
+                          else np.asarray(tri_owner, dtype=np.int64))
+
+        tri = vertices[faces]
+        self.v0 = tri[:, 0]
+        self.e1 = tri[:, 1] - tri[:, 0]
+        self.e2 = tri[:, 2] - tri[:, 0]
+        self._build(tri.min(axis=1), tri.max(axis=1), tri.mean(axis=1))
+
+    def _build(self, tri_min, tri_max, centroids):
+        n_tris = len(centroids)
+        L = self.leaf_size
+        if n_tris:
+            lo = centroids.min(axis=0)
+            extent = np.maximum(centroids.max(axis=0) - lo, 1e-12)
+            q = ((centroids - lo) / extent * 1023).astype(np.uint64)
+            codes = _spread_bits(q[:, 0]) | (_spread_bits(q[:, 1]) << 1) | (_spread_bits(q[:, 2]) << 2)
+            order = np.argsort(codes, kind='stable')
+            starts = np.arange(0, n_tris, L)
+            level_min = np.minimum.reduceat(tri_min[order], starts)
+            level_max = np.maximum.reduceat(tri_max[order], starts)
+        else:
+            order = np.zeros(0, dtype=np.int64)
+            level_min = np.full((1, 3), np.inf)
+            level_max = np.full((1, 3), np.inf)
+        n_leaves = len(level_min)
+
+        #Leaf triangle lists padded with -1 to leaf_size (plus one empty leaf for padding nodes),
+        #so a batch of leaves is a single 2D gather
+        leaf_tris = np.full((n_leaves + 1) * L, -1, dtype=np.int64)
+        leaf_tris[:n_tris] = order
+        self.leaf_tris = leaf_tris.reshape(n_leaves + 1, L)
+
+        #Pair neighbours level by level; odd levels get an empty box (never hit) as padding
+        levels = [(level_min, level_max, np.zeros(n_leaves, dtype=bool))]
+        while len(levels[-1][0]) > 1:
+            m, M, pad = levels[-1]
+            if len(m) % 2:
+                m = np.vstack([m, np.full((1, 3), np.inf)])
+                M = np.vstack([M, np.full((1, 3), np.inf)])
+                pad = np.append(pad, True)
+                levels[-1] = (m, M, pad)
+            levels.append((np.minimum(m[0::2], m[1::2]), np.maximum(M[0::2], M[1::2]),
+                           np.zeros(len(m) // 2, dtype=bool)))
+        levels.reverse()
+
+        offsets = np.cumsum([0] + [len(level[0]) for level in levels])
+        node_leaf, children = [], []
+        for k, (m, _, pad) in enumerate(levels):
+            n = len(m)
+            if k == len(levels) - 1:
+                node_leaf.append(np.where(pad, n_leaves, np.arange(n)))
+                children.append(np.full((n, 2), -1, dtype=np.int64))
+            else:
+                node_leaf.append(np.where(pad, n_leaves, -1))
+                first = offsets[k + 1] + 2 * np.arange(n)
+                children.append(np.stack([first, first + 1], axis=1))
+
+        self.node_min = np.concatenate([level[0] for level in levels])
+        self.node_max = np.concatenate([level[1] for level in levels])
+        self.node_leaf = np.concatenate(node_leaf)
+        self.children = np.concatenate(children)
+
+    # Closest hit of each ray: (distance, triangle index), inf/-1 where nothing is hit
+    def first_hits(self, origins, directions):
+        origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+        directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+        n_rays = len(origins)
+        best_t = np.full(n_rays, np.inf)
+        best_tri = np.full(n_rays, -1, dtype=np.int64)
+        if n_rays == 0 or len(self.v0) == 0:
+            return best_t, best_tri
+
+        safe = np.where(np.abs(directions) < 1e-30, 1e-30, directions)
+        inv_d = 1.0 / safe
+
+        #Breadth-first traversal over (ray, node) pairs; each level is one vectorized step
+        ray_ids = np.arange(n_rays)
+        node_ids = np.zeros(n_rays, dtype=np.int64)
+        while ray_ids.size:
+            o = origins[ray_ids]
+            inv = inv_d[ray_ids]
+            t0 = (self.node_min[node_ids] - o) * inv
+            t1 = (self.node_max[node_ids] - o) * inv
+            t_near = np.minimum(t0, t1).max(axis=1)
+            t_far = np.maximum(t0, t1).min(axis=1)
+            keep = (t_near <= t_far) & (t_far >= 0) & (t_near < best_t[ray_ids])
+            ray_ids = ray_ids[keep]
+            node_ids = node_ids[keep]
+
+            leaf = self.node_leaf[node_ids]
+            is_leaf = leaf >= 0
+            if is_leaf.any():
+                self._intersect_leaves(origins, directions, ray_ids[is_leaf], leaf[is_leaf], best_t, best_tri)
+
+            inner_rays = ray_ids[~is_leaf]
+            inner_nodes = node_ids[~is_leaf]
+            ray_ids = np.concatenate([inner_rays, inner_rays])
+            node_ids = np.concatenate([self.children[inner_nodes, 0], self.children[inner_nodes, 1]])
+
+        return best_t, best_tri
+
+    def _intersect_leaves(self, origins, directions, rays, leaves, best_t, best_tri):
+        tris = self.leaf_tris[leaves]
+        rays = np.repeat(rays, tris.shape[1])
+        tris = tris.ravel()
+        valid = tris >= 0
+        rays = rays[valid]
+        tris = tris[valid]
+
+        t = intersect_triangles(origins[rays], directions[rays], self.v0[tris], self.e1[tris], self.e2[tris])
+        hit = t < best_t[rays]
+        rays = rays[hit]
+        tris = tris[hit]
+        t = t[hit]
+        if not rays.size:
+            return
+        np.minimum.at(best_t, rays, t)
+        closest = t == best_t[rays]
+        best_tri[rays[closest]] = tris[closest]
+
+
+# Moller-Trumbore ray/triangle test for matching rows; returns the hit distance or inf
+def intersect_triangles(origins, directions, v0, e1, e2):
+    pvec = np.cross(directions, e2)
+    det = np.einsum('ij,ij->i', e1, pvec)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        inv_det = 1.0 / det
+        tvec = origins - v0
+        u = np.einsum('ij,ij->i', tvec, pvec) * inv_det
+        qvec = np.cross(tvec, e1)
+        v = np.einsum('ij,ij->i', directions, qvec) * inv_det
+        t = np.einsum('ij,ij->i', e2, qvec) * inv_det
+        hit = (np.abs(det) > 1e-12) & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > RAY_EPSILON)
+    return np.where(hit, t, np.inf)
+
+
+# Occlusion of each (camera, joint) pair for one frame -> (C, J)
+#
+# Casts a ray from every camera location towards every joint, like
+# occlusion.is_occluded does with scene.ray_cast, and looks up the first object
+# hit in `owner_occludes` (n_owners, J): True when hitting that object hides the
+# joint. `bvh` may be a list of trees (e.g. static and deforming geometry); the
+# closest hit over all of them wins. Pairs with `in_view` False are not cast and
+# reported as not occluded.
+def occluded_joints(bvh, owner_occludes, cam_locations, joints, in_view=None):
+    bvhs = bvh if isinstance(bvh, (list, tuple)) else [bvh]
+    cam_locations = np.asarray(cam_locations, dtype=np.float64).reshape(-1, 3)
+    joints = np.asarray(joints, dtype=np.float64).reshape(-1, 3)
+    n_cams, n_joints = len(cam_locations), len(joints)
+    occluded = np.zeros((n_cams, n_joints), dtype=bool)
+
+    cam_idx, joint_idx = np.indices((n_cams, n_joints)).reshape(2, -1)
+    if in_view is not None:
+        cast = np.asarray(in_view, dtype=bool).ravel()
+        cam_idx, joint_idx = cam_idx[cast], joint_idx[cast]
+    if not cam_idx.size:
+        return occluded
+
+    origins = cam_locations[cam_idx]
+    directions = joints[joint_idx] - origins
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    best_t = np.full(len(origins), np.inf)
+    best_owner = np.full(len(origins), -1, dtype=np.int64)
+    for tree in bvhs:
+        t, tri = tree.first_hits(origins, directions)
+        closer = t < best_t
+        best_t[closer] = t[closer]
+        best_owner[closer] = tree.tri_owner[tri[closer]]
+
+    hit = best_owner >= 0
+    occluded[cam_idx[hit], joint_idx[hit]] = owner_occludes[best_owner[hit], joint_idx[hit]]
+    return occluded
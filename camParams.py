@@ -2,6 +2,16 @@ import bpy
 from mathutils import Matrix, Vector, Quaternion
 import numpy as np
 import sys
+import os
+import re
+from fnmatch import fnmatch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from camera_arrays import calibration_matrices_K, rt_matrices_from_world, CameraRuns
+from profiler import PROFILER, parse_profile_args
+
+#Cameras exported when neither --cameras nor --collection is given
+DEFAULT_CAMERA_PATTERN = 'Camera_*'
 
 #---------------------------------------------------------------
 # 3x4 P matrix from Blender camera
@@ -161,65 +171,137 @@ def convert_matrix_to_quaternion(R_world2cv):
     quat_orientation = R_world2cv.to_quaternion()
     return quat_orientation
 
+# Sort key so that Camera_2 comes before Camera_10
+def natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', name)]
+
+# Camera objects to export: every camera in `collection`, or those whose name matches `pattern`
+def find_cameras(pattern=DEFAULT_CAMERA_PATTERN, collection=None):
+    if collection is not None:
+        objects = bpy.data.collections[collection].all_objects
+    else:
+        objects = [obj for obj in bpy.data.objects if fnmatch(obj.name, pattern)]
+    cameras = [obj for obj in objects if obj.type == 'CAMERA']
+    return sorted(cameras, key=lambda obj: natural_key(obj.name))
+
+# Stacked K (C,3,3), RT (C,3,4) and P (C,3,4) float64 arrays for `cameras`, computed with NumPy
+def get_camera_matrices(cameras):
+    render = bpy.context.scene.render
+    for cam in cameras:
+        if cam.data.type != 'PERSP':
+            raise ValueError('Non-perspective cameras not supported: %s' % cam.name)
+    K = calibration_matrices_K(
+        [cam.data.lens for cam in cameras], [cam.data.sensor_fit for cam in cameras],
+        [cam.data.sensor_width for cam in cameras], [cam.data.sensor_height for cam in cameras],
+        [cam.data.shift_x for cam in cameras], [cam.data.shift_y for cam in cameras],
+        render.resolution_x, render.resolution_y, render.resolution_percentage,
+        render.pixel_aspect_x, render.pixel_aspect_y)
+    RT = rt_matrices_from_world([np.array(cam.matrix_world) for cam in cameras])
+    return K, RT, K @ RT
+
+# True if the camera (its object, lens data or a parent) has animation data
+def is_animated(cam):
+    obj = cam
+    while obj is not None:
+        if obj.animation_data is not None:
+            return True
+        obj = obj.parent
+    return cam.data.animation_data is not None
+
+# Per-frame K, RT and P of `cameras` over frames [frame_start, frame_end] as CameraRuns
+#
+# Every frame is set once and all cameras are read together; runs of frames
+# where a camera does not change are stored once.
+def get_camera_tracks(cameras, frame_start, frame_end):
+    scene = bpy.context.scene
+    current = scene.frame_current
+    n_frames = frame_end - frame_start + 1
+    K = np.empty((len(cameras), n_frames, 3, 3))
+    RT = np.empty((len(cameras), n_frames, 3, 4))
+    for f in range(n_frames):
+        scene.frame_set(frame_start + f)
+        K[:, f], RT[:, f], _ = get_camera_matrices(cameras)
+    scene.frame_set(current)
+    return CameraRuns.from_frames(K), CameraRuns.from_frames(RT), CameraRuns.from_frames(K @ RT)
+
 # ----------------------------------------------------------
 if __name__ == "__main__":
      # Get command-line arguments
     argv = sys.argv
     argv = argv[argv.index("--") + 1:]  # Get arguments after '--'
+    # --profile [trace.json|trace.csv]: per-phase timing summary (and trace file) at the end of the run
+    argv = parse_profile_args(argv)
 
     if len(argv) < 1:
-        print("Usage: blender --background H3.6M.blend --python camParamsV2.py -- S1")
+        print("Usage: blender --background H3.6M.blend --python camParams.py -- S1 [--cameras 'Camera_*' | --collection Cameras] [--txt] [--animated] [--out-dir DIR]")
         sys.exit(1)
 
     subject = argv[0]
+    pattern = DEFAULT_CAMERA_PATTERN
+    collection = None
+    # Output directory (2D_extraction.py reads ../../BlendMimic3D/<subject>/Cameras)
+    out_dir = f"../H3.6M_synthetic/{subject}/Cameras"
+    # Also write one CamView{i}_P3x4.txt file per camera
+    write_txt = "--txt" in argv
+    # Also export per-frame K/RT/P over the scene frame range (moving cameras)
+    animated = "--animated" in argv
+    options = [arg for arg in argv[1:] if arg not in ("--txt", "--animated")]
+    for i in range(0, len(options), 2):
+        if options[i] == "--cameras":
+            pattern = options[i + 1]
+        elif options[i] == "--collection":
+            collection = options[i + 1]
+        elif options[i] == "--out-dir":
+            out_dir = options[i + 1]
 
     
-    # List of camera names
-    camera_names = ['Camera_0', 'Camera_1', 'Camera_2', 'Camera_3'] #Same order as H3.6M dataset 
-    #camera_names = ['Camera_0'] #Same order as H3.6M dataset 
+    # Cameras are discovered by name pattern or collection, in natural name order (Camera_0, Camera_1, ...)
+    with PROFILER.phase('find_cameras'):
+        cameras = find_cameras(pattern, collection)
+    if not cameras:
+        print("No cameras found.")
+        sys.exit(1)
+    camera_names = [cam.name for cam in cameras]
+    print(camera_names)
+    
+    # All cameras at once: K (C,3,3), RT (C,3,4), P (C,3,4)
+    with PROFILER.phase('matrices') as phase:
+        K, RT, P = get_camera_matrices(cameras)
+        phase.add_items(len(cameras))
+    print(K)
+    print(RT)
+    
+    # Per-frame tracks, stored as runs of unchanged frames; frame 0 of a track is scene.frame_start
+    tracks = {}
+    if animated:
+        scene = bpy.context.scene
+        print("Animated cameras:", [cam.name for cam in cameras if is_animated(cam)])
+        with PROFILER.phase('camera_tracks') as phase:
+            K_runs, RT_runs, P_runs = get_camera_tracks(cameras, scene.frame_start, scene.frame_end)
+            phase.add_items(scene.frame_end - scene.frame_start + 1)
+        for name, runs in (('K', K_runs), ('RT', RT_runs), ('P', P_runs)):
+            tracks.update(runs.to_arrays(name))
+        tracks['track_frame_start'] = np.int64(scene.frame_start)
+        print("%d frames, %d P runs for %d cameras" % (P_runs.n_frames, len(P_runs.values), len(cameras)))
+    
+    os.makedirs(out_dir, exist_ok=True)
     
     intrinsic_params_list = []
     extrinsic_params_list = []  # List to hold individual camera extrinsic parameter dictionaries for each subject
-    K_list = []
-    RT_list = []
-    P_list = []
-    extrinsic_params_dict = {}
-    i=0
     
-    for cam_name in camera_names:
-        
-        cam = bpy.data.objects.get(cam_name)
-        P, K, RT = get_3x4_P_matrix_from_blender(cam)
-        
-        print(K)
-        print(RT)
-           
-        nP = np.matrix(P)
-        np.savetxt(f"../H3.6M_synthetic/{subject}/Cameras/CamView{i}_P3x4.txt", nP)  # to select precision, use e.g. fmt='%.2f'
-
-        #Create a list to hold intrinsic parameter dictionaries for all cameras
-        intrinsic_params = save_intrinsic_params_to_dict(cam)
-        intrinsic_params_list.append(intrinsic_params)
-       
-        # Create a dictionary to hold extrinsic parameter dictionaries for each subject
-        extrinsic_params = save_extrinsic_params_to_dict(RT)
-        extrinsic_params_list.append(extrinsic_params)
+    for i, cam in enumerate(cameras):
+        with PROFILER.phase('camera_params', camera=cam.name):
         
-        # Append matrices K, RT, and P to their respective lists
-        K_list.append(K)
-        RT_list.append(RT)
-        P_list.append(P)
-       
-        #h36m_cameras_extrinsic_params = {
-         #   subject : [save_extrinsic_params_to_dict(RT)],
-        #}
-        #print(h36m_cameras_extrinsic_params)
+            if write_txt:
+                np.savetxt(os.path.join(out_dir, f"CamView{i}_P3x4.txt"), P[i])  # to select precision, use e.g. fmt='%.2f'
+
+            #Create a list to hold intrinsic parameter dictionaries for all cameras
+            intrinsic_params = save_intrinsic_params_to_dict(cam)
+            intrinsic_params_list.append(intrinsic_params)
        
-        
-        #orientation= h36m_cameras_extrinsic_params[subject][0]['orientation']
-        #translation = h36m_cameras_extrinsic_params[subject][0]['translation']
-         
-        i = i+1
+            # Create a dictionary to hold extrinsic parameter dictionaries for each subject
+            extrinsic_params = save_extrinsic_params_to_dict(Matrix(RT[i].tolist()))
+            extrinsic_params_list.append(extrinsic_params)
         
     extrinsic_params_dict = {
         subject: extrinsic_params_list
@@ -227,18 +309,12 @@ if __name__ == "__main__":
     
     print(intrinsic_params_list)
     print(extrinsic_params_dict)
-    print(K_list)
     # Save intrinsic and extrinsic parameters to npz file
-    np.savez(f"../H3.6M_synthetic/{subject}/Cameras/camera_params_{subject}.npz", intrinsic_params=intrinsic_params_list, extrinsic_params=extrinsic_params_dict)
-     # Save matrices K, RT, and P to another npz file
-    np.savez(f"../H3.6M_synthetic/{subject}/Cameras/matrices_{subject}.npz", K=K_list, RT=RT_list, P=P_list)
+    with PROFILER.phase('save') as phase:
+        np.savez(os.path.join(out_dir, f"camera_params_{subject}.npz"), intrinsic_params=intrinsic_params_list, extrinsic_params=extrinsic_params_dict)
+        # Save matrices K, RT, P and the camera names as plain arrays (loads with allow_pickle=False)
+        np.savez(os.path.join(out_dir, f"matrices_{subject}.npz"), K=K, RT=RT, P=P, camera_names=np.array(camera_names), **tracks)
+        phase.add_files([os.path.join(out_dir, f"camera_params_{subject}.npz"), os.path.join(out_dir, f"matrices_{subject}.npz")])
 
     print("Data saved successfully.")
-    
-   
-
-
-
-   
-
-  
\ No newline at end of file
+    PROFILER.finish()
@@ -0,0 +1,127 @@
+import numpy as np
+
+#Blender camera axes (y up, looking down -z) to computer-vision axes (y down, looking down +z)
+R_BCAM2CV = np.diag([1.0, -1.0, -1.0])
+
+
+# Stacked (C, 3, 3) intrinsic matrices, a NumPy port of camParams.get_calibration_matrix_K_from_blender
+#
+# Camera fields are (C,) arrays (sensor_fit holds 'AUTO'/'HORIZONTAL'/'VERTICAL');
+# render settings are scalars shared by every camera.
+def calibration_matrices_K(lens, sensor_fit, sensor_width, sensor_height, shift_x, shift_y,
+                           resolution_x, resolution_y, resolution_percentage=100,
+                           pixel_aspect_x=1.0, pixel_aspect_y=1.0):
+    lens = np.asarray(lens, dtype=np.float64)
+    sensor_fit = np.asarray(sensor_fit)
+    scale = resolution_percentage / 100
+    resolution_x_in_px = scale * resolution_x
+    resolution_y_in_px = scale * resolution_y
+
+    # BKE_camera_sensor_size / BKE_camera_sensor_fit
+    sensor_size_in_mm = np.where(sensor_fit == 'VERTICAL', sensor_height, sensor_width).astype(np.float64)
+    auto_fit = 'HORIZONTAL' if pixel_aspect_x * resolution_x_in_px >= pixel_aspect_y * resolution_y_in_px else 'VERTICAL'
+    fit = np.where(sensor_fit == 'AUTO', auto_fit, sensor_fit)
+
+    pixel_aspect_ratio = pixel_aspect_y / pixel_aspect_x
+    view_fac_in_px = np.where(fit == 'HORIZONTAL', resolution_x_in_px, pixel_aspect_ratio * resolution_y_in_px)
+    pixel_size_mm_per_px = sensor_size_in_mm / lens / view_fac_in_px
+    s_u = 1 / pixel_size_mm_per_px
+    s_v = 1 / pixel_size_mm_per_px / pixel_aspect_ratio
+
+    K = np.zeros((len(lens), 3, 3))
+    K[:, 0, 0] = s_u
+    K[:, 1, 1] = s_v
+    K[:, 0, 2] = resolution_x_in_px / 2 - np.asarray(shift_x) * view_fac_in_px
+    K[:, 1, 2] = resolution_y_in_px / 2 + np.asarray(shift_y) * view_fac_in_px / pixel_aspect_ratio
+    K[:, 2, 2] = 1
+    return K
+
+
+# Stacked (..., 3, 4) world-to-CV extrinsics from (..., 4, 4) camera matrix_world arrays
+#
+# NumPy port of camParams.get_3x4_RT_matrix_from_blender: the scale is removed from
+# matrix_world (as decompose() does) before inverting the rotation.
+def rt_matrices_from_world(matrix_world):
+    matrix_world = np.asarray(matrix_world, dtype=np.float64)
+    location = matrix_world[..., :3, 3]
+    rotation = matrix_world[..., :3, :3]
+    rotation = rotation / np.linalg.norm(rotation, axis=-2, keepdims=True)
+    R_world2bcam = np.swapaxes(rotation, -1, -2)
+    T_world2bcam = -R_world2bcam @ location[..., None]
+
+    RT = np.empty(matrix_world.shape[:-2] + (3, 4))
+    RT[..., :3] = R_BCAM2CV @ R_world2bcam
+    RT[..., 3:] = R_BCAM2CV @ T_world2bcam
+    return RT
+
+
+# Per-camera run-length encoding of a (C, F, ...) per-frame camera array (K, RT or P)
+#
+# Each camera keeps only the frames where its matrix changes: `values` holds
+# the runs of all cameras back to back, `starts` the first frame of each run
+# and `offsets` (C + 1) where each camera's runs begin. A camera that never
+# moves is a single run, so static rigs cost the same as one matrix per camera.
+# Frames past the last sampled one hold the last value.
+class CameraRuns:
+
+    def __init__(self, values, starts, offsets, n_frames):
+        self.values = np.asarray(values, dtype=np.float64)
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.n_frames = int(n_frames)
+
+    @classmethod
+    def from_frames(cls, frames):
+        frames = np.asarray(frames, dtype=np.float64)
+        values, starts, offsets = [], [], [0]
+        for track in frames:
+            flat = track.reshape(len(track), -1)
+            changed = np.ones(len(track), dtype=bool)
+            changed[1:] = np.any(flat[1:] != flat[:-1], axis=1)
+            run_starts = np.flatnonzero(changed)
+            values.append(track[run_starts])
+            starts.append(run_starts)
+            offsets.append(offsets[-1] + len(run_starts))
+        return cls(np.concatenate(values), np.concatenate(starts), offsets, frames.shape[1])
+
+    @property
+    def n_cameras(self):
+        return len(self.offsets) - 1
+
+    # True when no camera changes over the sampled frames
+    @property
+    def static(self):
+        return len(self.values) == self.n_cameras
+
+    # (C, ...) values on frame `frame`
+    def at(self, frame):
+        return self.window(frame, frame + 1)[:, 0]
+
+    # (C, stop - start, ...) values for frames [start, stop)
+    def window(self, start, stop):
+        return self.take(np.arange(start, stop))
+
+    # (C, len(frames), ...) values for arbitrary track frame indices; IndexError outside [0, n_frames)
+    def take(self, frames):
+        frames = np.asarray(frames, dtype=np.int64)
+        if len(frames) and (frames.min() < 0 or frames.max() >= self.n_frames):
+            raise IndexError('Track frames %d..%d outside the %d sampled camera frames'
+                             % (frames.min(), frames.max(), self.n_frames))
+        out = np.empty((self.n_cameras, len(frames)) + self.values.shape[1:])
+        for c in range(self.n_cameras):
+            first, last = self.offsets[c], self.offsets[c + 1]
+            run = np.searchsorted(self.starts[first:last], frames, side='right') - 1
+            out[c] = self.values[first + np.maximum(run, 0)]
+        return out
+
+    # Plain arrays for np.savez, named '<name>_runs', '<name>_starts', '<name>_offsets'
+    def to_arrays(self, name):
+        return {f'{name}_runs': self.values, f'{name}_starts': self.starts,
+                f'{name}_offsets': self.offsets, f'{name}_frames': np.int64(self.n_frames)}
+
+    # Read back what to_arrays wrote; None if the file has no per-frame `name`
+    @classmethod
+    def from_arrays(cls, data, name):
+        if f'{name}_runs' not in data:
+            return None
+        return cls(data[f'{name}_runs'], data[f'{name}_starts'], data[f'{name}_offsets'], data[f'{name}_frames'])
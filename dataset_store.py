@@ -0,0 +1,166 @@
+import os
+import json
+import zlib
+import shutil
+from collections import OrderedDict
+import numpy as np
+
+#Extension of the memory-mappable store directories written next to (or instead of) the .npz files
+STORE_EXT = '.store'
+INDEX_NAME = 'index.json'
+STORE_VERSION = 1
+
+#Output formats the extraction stages accept for --format
+OUTPUT_FORMATS = ('npz', 'store', 'both')
+
+
+# Write `arrays` (name -> array with frames on axis 0) as a store directory at `path`
+#
+# Without `chunk_frames` every array is a plain .npy file that readers memory-map.
+# With `chunk_frames` each array is split along axis 0 into zlib-compressed chunks,
+# so a reader only decompresses the chunks a frame window touches. The small
+# index.json records dtype, shape and layout of every array. The store is built
+# in a temporary directory and renamed into place.
+def write_store(path, arrays, chunk_frames=None, level=6):
+    tmp_path = path + '.tmp'
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    index = {'version': STORE_VERSION, 'arrays': {}}
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        entry = {'dtype': array.dtype.str, 'shape': list(array.shape)}
+        if chunk_frames is None:
+            entry['layout'] = 'npy'
+            np.save(os.path.join(tmp_path, name + '.npy'), array)
+        else:
+            entry['layout'] = 'chunked'
+            entry['chunk_frames'] = int(chunk_frames)
+            with open(os.path.join(tmp_path, name + '.bin'), 'wb') as f:
+                offsets = [0]
+                for start in range(0, max(len(array), 1), chunk_frames):
+                    f.write(zlib.compress(array[start:start + chunk_frames].tobytes(), level))
+                    offsets.append(f.tell())
+            entry['offsets'] = offsets
+        index['arrays'][name] = entry
+
+    with open(os.path.join(tmp_path, INDEX_NAME), 'w') as f:
+        json.dump(index, f, indent=1)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return os.path.join(path, INDEX_NAME)
+
+
+# Read-only view of a store directory; arrays are memory-mapped or decompressed per chunk
+class ArrayStore:
+
+    def __init__(self, path, cache_chunks=8):
+        self.path = path
+        with open(os.path.join(path, INDEX_NAME)) as f:
+            self.index = json.load(f)
+        self._maps = {}
+        self._chunks = OrderedDict()
+        self.cache_chunks = cache_chunks
+
+    def keys(self):
+        return list(self.index['arrays'])
+
+    def __contains__(self, name):
+        return name in self.index['arrays']
+
+    def shape(self, name):
+        return tuple(self.index['arrays'][name]['shape'])
+
+    def __len__(self):
+        return len(self.index['arrays'])
+
+    # Whole array: a read-only memmap for 'npy' layouts, decompressed for 'chunked' ones
+    def __getitem__(self, name):
+        entry = self.index['arrays'][name]
+        if entry['layout'] == 'npy':
+            return self._memmap(name)
+        return self.window(name, 0, entry['shape'][0])
+
+    def _memmap(self, name):
+        if name not in self._maps:
+            self._maps[name] = np.load(os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._maps[name]
+
+    def _chunk(self, name, i):
+        key = (name, i)
+        if key in self._chunks:
+            self._chunks.move_to_end(key)
+            return self._chunks[key]
+        entry = self.index['arrays'][name]
+        offsets = entry['offsets']
+        with open(os.path.join(self.path, name + '.bin'), 'rb') as f:
+            f.seek(offsets[i])
+            raw = zlib.decompress(f.read(offsets[i + 1] - offsets[i]))
+        chunk = np.frombuffer(raw, dtype=np.dtype(entry['dtype'])).reshape((-1,) + tuple(entry['shape'][1:]))
+        self._chunks[key] = chunk
+        if len(self._chunks) > self.cache_chunks:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    # Frames [start, stop) of `name`; a zero-copy view for 'npy' layouts
+    def window(self, name, start, stop):
+        entry = self.index['arrays'][name]
+        n_frames = entry['shape'][0]
+        start, stop, _ = slice(start, stop).indices(n_frames)
+        if entry['layout'] == 'npy':
+            return self._memmap(name)[start:stop]
+
+        step = entry['chunk_frames']
+        first, last = start // step, max(start, stop - 1) // step
+        parts = [self._chunk(name, i) for i in range(first, last + 1)]
+        if len(parts) == 1:
+            return parts[0][start - first * step:stop - first * step]
+        return np.concatenate(parts)[start - first * step:stop - first * step]
+
+
+# Save one stage output given its .npz path: as .npz, as a store directory next to it, or both
+#
+# Returns the list of files written (used for the stage caches).
+def save_output(npz_path, fmt='npz', chunk_frames=None, **arrays):
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError('Unknown output format %r, expected one of %s' % (fmt, ', '.join(OUTPUT_FORMATS)))
+    written = []
+    if fmt in ('npz', 'both'):
+        #Written next to the target and renamed, so a crash never leaves a truncated .npz
+        tmp_path = npz_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp_path, npz_path)
+        written.append(npz_path)
+    if fmt in ('store', 'both'):
+        written.append(write_store(os.path.splitext(npz_path)[0] + STORE_EXT, arrays, chunk_frames=chunk_frames))
+    return written
+
+
+# Shape of one array of an opened output (ArrayStore, NpzFile, or a reader with shape()), without decoding it
+def array_shape(data, name):
+    if not isinstance(data, np.lib.npyio.NpzFile):
+        return tuple(data.shape(name))
+    with data.zip.open(name + '.npy') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            return np.lib.format.read_array_header_1_0(f)[0]
+        return np.lib.format.read_array_header_2_0(f)[0]
+
+
+# Open a stage output by its .npz path, preferring the store directory when one exists
+def open_output(npz_path):
+    store_path = os.path.splitext(npz_path)[0] + STORE_EXT
+    if os.path.isdir(store_path):
+        return ArrayStore(store_path)
+    return np.load(npz_path)
+
+
+# Digests of an output given by its .npz path (every file of its store directory, when that is what exists)
+def output_digests(cache, npz_path):
+    if os.path.exists(npz_path):
+        return [cache.file_digest(npz_path)]
+    store_path = os.path.splitext(npz_path)[0] + STORE_EXT
+    return [cache.file_digest(os.path.join(store_path, name)) for name in sorted(os.listdir(store_path))]
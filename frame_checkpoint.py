@@ -0,0 +1,100 @@
+import os
+import json
+import shutil
+import numpy as np
+
+#Frames per chunk written to disk (and the most work a crash can lose)
+DEFAULT_CHECKPOINT_FRAMES = 256
+CHECKPOINT_NAME = 'checkpoint.json'
+
+
+# Crash-safe, chunked per-frame output of one clip.
+#
+# Frames are collected into fixed-size chunks; a finished chunk is written as
+# one .npy file per array (temporary file + rename) and only then recorded in
+# checkpoint.json, so the checkpoint never points at a partial chunk. Arrays
+# are named freely (e.g. positions_3d, Cam_0, Cam_1, ...) and their per-frame
+# shape is taken from the first frame written. Reopening the same directory
+# with the same `key` resumes after the last completed chunk: iterate from
+# `resume_frame`. Any other key (changed inputs) starts over. `finalize()`
+# returns the full (F, ...) arrays; `remove()` deletes the directory and is
+# only called once the outputs built from them are on disk.
+class FrameCheckpoint:
+
+    def __init__(self, path, n_frames, key, chunk_frames=DEFAULT_CHECKPOINT_FRAMES):
+        self.path = path
+        self.n_frames = int(n_frames)
+        self.chunk_frames = max(1, int(chunk_frames))
+        self.state = {'key': key, 'n_frames': self.n_frames, 'chunk_frames': self.chunk_frames,
+                      'done_chunks': 0, 'arrays': {}}
+        self._buffers = {}
+
+        checkpoint_file = os.path.join(path, CHECKPOINT_NAME)
+        if os.path.exists(checkpoint_file):
+            with open(checkpoint_file) as f:
+                state = json.load(f)
+            if all(state.get(name) == self.state[name] for name in ('key', 'n_frames', 'chunk_frames')):
+                self.state = state
+            else:
+                shutil.rmtree(path)
+        os.makedirs(path, exist_ok=True)
+
+    # First frame that is not safely on disk yet
+    @property
+    def resume_frame(self):
+        return min(self.state['done_chunks'] * self.chunk_frames, self.n_frames)
+
+    def _chunk_file(self, name, chunk):
+        return os.path.join(self.path, '%s.%06d.npy' % (name, chunk))
+
+    # Store frame `i` of each named array; writes the chunk once its last frame is set
+    def set_frame(self, i, **values):
+        chunk, offset = divmod(i, self.chunk_frames)
+        chunk_len = min(self.chunk_frames, self.n_frames - chunk * self.chunk_frames)
+        for name, value in values.items():
+            value = np.asarray(value)
+            buffer = self._buffers.get(name)
+            if buffer is None or buffer[0] != chunk:
+                buffer = (chunk, np.zeros((chunk_len,) + value.shape, dtype=value.dtype))
+                self._buffers[name] = buffer
+                self.state['arrays'][name] = {'dtype': value.dtype.str, 'shape': list(value.shape)}
+            buffer[1][offset] = value
+        if offset == chunk_len - 1:
+            self._write_chunk(chunk)
+
+    def _write_chunk(self, chunk):
+        for name, (buffer_chunk, buffer) in self._buffers.items():
+            if buffer_chunk != chunk:
+                continue
+            tmp_file = self._chunk_file(name, chunk) + '.tmp'
+            with open(tmp_file, 'wb') as f:
+                np.save(f, buffer)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self._chunk_file(name, chunk))
+        self.state['done_chunks'] = chunk + 1
+        tmp_file = os.path.join(self.path, CHECKPOINT_NAME + '.tmp')
+        with open(tmp_file, 'w') as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp_file, os.path.join(self.path, CHECKPOINT_NAME))
+
+    # Copy the frames of `name` held by the finished chunks (0..resume_frame) into `out`, e.g. a memmap
+    def read_into(self, name, out):
+        for chunk in range(self.state['done_chunks']):
+            start = chunk * self.chunk_frames
+            part = np.load(self._chunk_file(name, chunk))
+            out[start:start + len(part)] = part
+        return out
+
+    # Full (F, ...) arrays read back from the chunks (the directory is kept until remove())
+    def finalize(self):
+        if self.resume_frame < self.n_frames:
+            raise RuntimeError('Checkpoint %s has %d of %d frames' % (self.path, self.resume_frame, self.n_frames))
+        arrays = {}
+        for name, entry in self.state['arrays'].items():
+            out = np.empty((self.n_frames,) + tuple(entry['shape']), dtype=np.dtype(entry['dtype']))
+            arrays[name] = self.read_into(name, out)
+        return arrays
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
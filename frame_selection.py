@@ -0,0 +1,96 @@
+import os
+import numpy as np
+
+#Selected scene frame numbers, saved in every clip output directory
+FRAMES_FILE = 'frames.npy'
+
+#Flags taking a value; --start_frame/--end_frame are the names occlusion.py always had
+FRAME_FLAGS = {'--start': 'start', '--start_frame': 'start', '--end': 'end', '--end_frame': 'end',
+               '--stride': 'stride', '--random': 'sample', '--seed': 'seed'}
+
+
+# Which frames of a clip the extraction stages process.
+#
+# `start`/`end` (inclusive scene frame numbers) clip the clip's own frame range,
+# `stride` keeps every n-th frame from the start, and `sample` then keeps a
+# random subset of that many frames (reproducible through `seed`). Every stage
+# applies the same rule, so the 3D, 2D and occlusion outputs of a clip line up.
+# Stages that read an earlier output apply it with select() to the rows that
+# output has: `stride` and `sample` then count rows, not scene frames.
+class FrameSelection:
+
+    def __init__(self, start=None, end=None, stride=1, sample=None, seed=0):
+        self.start = None if start is None else int(start)
+        self.end = None if end is None else int(end)
+        self.stride = max(1, int(stride))
+        self.sample = None if sample is None else int(sample)
+        self.seed = int(seed)
+
+    # Selected frame numbers (sorted int64) of a clip spanning [first, last]
+    def frames(self, first, last):
+        first = int(first) if self.start is None else max(int(first), self.start)
+        last = int(last) if self.end is None else min(int(last), self.end)
+        frames = np.arange(first, last + 1, self.stride, dtype=np.int64)
+        if self.sample is not None and self.sample < len(frames):
+            rng = np.random.default_rng(self.seed)
+            frames = np.sort(rng.choice(frames, self.sample, replace=False))
+        return frames
+
+    # Selected frames among `available` (sorted frame numbers already extracted) and their positions
+    #
+    # start/end filter by frame number; stride and sample pick among the remaining
+    # rows, so an already subsampled input is not thinned against the scene range.
+    # On a contiguous input this selects what frames() does. ValueError when
+    # `sample` asks for more rows than there are.
+    def select(self, available):
+        available = np.asarray(available, dtype=np.int64)
+        keep = np.ones(len(available), dtype=bool)
+        if self.start is not None:
+            keep &= available >= self.start
+        if self.end is not None:
+            keep &= available <= self.end
+        index = np.flatnonzero(keep)[::self.stride]
+        if self.sample is not None:
+            if self.sample > len(index):
+                raise ValueError('--random %d asks for more frames than the %d available' % (self.sample, len(index)))
+            rng = np.random.default_rng(self.seed)
+            index = np.sort(rng.choice(index, self.sample, replace=False))
+        return available[index], index
+
+    # Everything that changes the selection, for the stage cache keys
+    def key(self):
+        return [self.start, self.end, self.stride, self.sample, self.seed]
+
+    def __repr__(self):
+        return 'FrameSelection(start=%r, end=%r, stride=%r, sample=%r, seed=%r)' % tuple(self.key())
+
+
+# Remove the frame-selection flags from `argv`; returns (FrameSelection, remaining argv)
+def parse_frame_args(argv):
+    options = {}
+    rest = []
+    i = 0
+    while i < len(argv):
+        if argv[i] in FRAME_FLAGS:
+            options[FRAME_FLAGS[argv[i]]] = int(argv[i + 1])
+            i += 2
+        else:
+            rest.append(argv[i])
+            i += 1
+    return FrameSelection(**options), rest
+
+
+# Save the selected frame numbers next to a clip's outputs; returns the file written
+def save_frames(clip_dir, frames):
+    os.makedirs(clip_dir, exist_ok=True)
+    path = os.path.join(clip_dir, FRAMES_FILE)
+    np.save(path, np.asarray(frames, dtype=np.int64))
+    return path
+
+
+# Frame numbers stored in a clip directory, or None when it predates frame selection
+def load_frames(clip_dir):
+    path = os.path.join(clip_dir, FRAMES_FILE)
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
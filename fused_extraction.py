@@ -0,0 +1,180 @@
+import bpy
+import sys
+import os
+from functools import partial
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from stage_cache import StageCache
+from dataset_store import save_output
+from joint_writer import save_positions_3d
+import visibility_codec
+from visibility_codec import save_occlusion_outputs
+from bone_sampler import BlenderArmatureAdapter, BoneSampler
+import bone_sampler
+import projection
+from projection import project_points
+import camera_arrays
+import bvh_occlusion
+import occlusion
+from occlusion import SRC_DATA_DIR, camera_locations, camera_signature, clip_saved, walk_clip
+from frame_checkpoint import FrameCheckpoint, DEFAULT_CHECKPOINT_FRAMES
+from frame_selection import parse_frame_args, save_frames
+from profiler import PROFILER, parse_profile_args
+from camParams import DEFAULT_CAMERA_PATTERN, find_cameras, get_camera_matrices, is_animated
+from skeletons import DEFAULT_SKELETON, get_skeleton, save_skeleton
+from output_writer import OutputWriter, parse_writer_args
+
+
+# Writer job: project the 2D positions (unless d2_dir is None) and write all outputs of one action
+#
+# Returns the files written.
+def save_clip_outputs(d3_dir, d2_dir, occlusion_dir, clip_name, positions, P, prob, frames, skeleton, joint_names,
+                      fmt='npz', visibility_fmt='float'):
+    written = save_positions_3d(d3_dir, clip_name, positions, fmt=fmt)
+    clip_dirs = [d3_dir, occlusion_dir]
+    if d2_dir is not None:
+        # 2D positions of all frames on all cameras from the positions just sampled -> (C, F, J, 2)
+        positions_2d = project_points(positions, P)
+        os.makedirs(os.path.join(d2_dir, clip_name), exist_ok=True)
+        written += save_output(os.path.join(d2_dir, clip_name, "2D_positions.npz"), fmt,
+                               **{f'Cam_{idx}': positions_2d[idx] for idx in range(len(positions_2d))})
+        clip_dirs.append(d2_dir)
+    os.makedirs(os.path.join(occlusion_dir, clip_name), exist_ok=True)
+    written += save_occlusion_outputs(os.path.join(occlusion_dir, clip_name), prob, fmt, visibility_fmt)
+    for clip_dir in clip_dirs:
+        written.append(save_frames(os.path.join(clip_dir, clip_name), frames))
+    written.append(save_skeleton(os.path.join(d3_dir, clip_name), skeleton, joint_names))
+    return written
+
+
+# 3D positions, 2D projections and occlusions of every action in one walk over its frames
+#
+# Same inputs as occlusion.py (the .blend with the actions, cameras and
+# environment). Each frame is set and evaluated once: the joints are sampled
+# and tested for visibility in that pass, then all frames are projected onto
+# all cameras at once. The three outputs are written to the usual
+# D3_Positions, D2_Positions and Occlusions directories (D2_Positions is
+# skipped with --no-2d; readers then project on read with projection_view.py).
+if __name__ == '__main__':
+
+    backend = 'bvhtree'
+    #Output format: npz (default), store (memory-mappable directory) or both
+    fmt = 'npz'
+    #Visibility output: float (occluded_kpt.npz, default), packed (bit-packed visibility.npz) or both
+    visibility_fmt = 'float'
+    camera_pattern = DEFAULT_CAMERA_PATTERN
+    camera_collection = None
+    #Frames per on-disk chunk of the crash-safe checkpoint (0 keeps everything in memory)
+    checkpoint_frames = DEFAULT_CHECKPOINT_FRAMES
+    #Joints to export: registered skeleton name or .json/.yaml joint map (see skeletons.py)
+    skeleton = get_skeleton(DEFAULT_SKELETON)
+    anim_files = None
+    argv = sys.argv[sys.argv.index("--") + 1:]  # Get arguments after "--"
+    # --start/--end/--stride/--random/--seed restrict the frames of every action
+    selection, argv = parse_frame_args(argv)
+    # --profile [trace.json|trace.csv]: per-phase timing summary (and trace file) at the end of the run
+    argv = parse_profile_args(argv)
+    # --write-workers N (0: write on the main thread) and --write-queue N: background output writing
+    write_workers, write_queue, argv = parse_writer_args(argv)
+    # Recompute even if the outputs are up to date
+    force = "--force" in argv
+    # Skip D2_Positions: 2D keypoints are then projected on read (projection_view.py)
+    materialize_2d = "--no-2d" not in argv
+    argv = [arg for arg in argv if arg not in ("--force", "--no-2d")]
+    # Parse the command-line arguments
+    for i in range(0, len(argv), 2):
+        if argv[i] == "--joint-id":
+            joint_id = argv[i + 1]
+        elif argv[i] == "--armature-name":
+            armature_name = argv[i + 1]
+        elif argv[i] == "--subject":
+            subject = argv[i + 1]
+        elif argv[i] == "--backend":
+            backend = argv[i + 1]
+        elif argv[i] == "--format":
+            fmt = argv[i + 1]
+        elif argv[i] == "--visibility":
+            visibility_fmt = argv[i + 1]
+        elif argv[i] == "--cameras":
+            camera_pattern = argv[i + 1]
+        elif argv[i] == "--collection":
+            camera_collection = argv[i + 1]
+        elif argv[i] == "--checkpoint-frames":
+            checkpoint_frames = int(argv[i + 1])
+        elif argv[i] == "--skeleton":
+            skeleton = get_skeleton(argv[i + 1])
+        elif argv[i] == "--file-list":
+            #Text file with one .fbx name per line: only these actions (default: every file in SRC_DATA_DIR)
+            with open(argv[i + 1]) as f:
+                anim_files = [line.strip() for line in f if line.strip()]
+
+    out_root = os.path.join(bpy.path.abspath("//"), f"../../BlendMimic3D/{subject}")
+    d3_dir = os.path.join(out_root, "D3_Positions")
+    d2_dir = os.path.join(out_root, "D2_Positions")
+    occlusion_dir = os.path.join(out_root, "Occlusions")
+
+    cameras = find_cameras(camera_pattern, camera_collection)
+    armature = bpy.data.objects[armature_name]
+    keypoints = armature.pose.bones
+    #Rig bones of the skeleton's joints, resolved to pose-bone indices once by the sampler
+    adapter = BlenderArmatureAdapter(armature)
+    joint_names = skeleton.bone_names(joint_id, adapter.bone_names())
+    sampler = BoneSampler(adapter, joint_names)
+
+    _, _, P = get_camera_matrices(cameras)
+    render = bpy.context.scene.render
+    scale = render.resolution_percentage / 100
+    resolution = (scale * render.resolution_x, scale * render.resolution_y)
+    cam_locations = camera_locations(cameras)
+    animated_cameras = any(is_animated(cam) for cam in cameras)
+
+    cache = StageCache(os.path.join(out_root, '.manifest_fused.json'), 'fused', force=force)
+    scene_key = dict(blend=cache.file_digest(bpy.data.filepath), joints=joint_names, armature=armature_name,
+                     skeleton=skeleton.name, cameras=[camera_signature(cam) for cam in cameras],
+                     resolution=[render.resolution_x, render.resolution_y, render.resolution_percentage],
+                     backend=backend, fmt=fmt, materialize_2d=materialize_2d, visibility=visibility_fmt,
+                     script=cache.code_digest(__file__, occlusion.__file__, projection.__file__, bvh_occlusion.__file__,
+                                              camera_arrays.__file__, bone_sampler.__file__, visibility_codec.__file__))
+    output_writer = OutputWriter(write_workers, write_queue)
+
+    for anim_name in os.listdir(SRC_DATA_DIR) if anim_files is None else anim_files:
+        clip_name = anim_name.split('.')[0]
+        action = bpy.data.actions.get(clip_name)
+        if action is None:
+            print("No action found:", clip_name)
+            continue
+        armature.animation_data.action = action
+        frames = selection.frames(action.frame_range[0], action.frame_range[1])
+        if len(frames) == 0:
+            print("No frames selected, skipping", clip_name)
+            continue
+
+        PROFILER.set_clip(clip_name)
+        clip_key = cache.key(action=clip_name, frames=frames, **scene_key)
+        if cache.is_current(clip_name, clip_key):
+            print("Up to date:", clip_name)
+            continue
+
+        # Finished chunks survive a crash; a rerun with the same key resumes after the last one
+        checkpoint = None
+        if checkpoint_frames > 0:
+            checkpoint = FrameCheckpoint(os.path.join(out_root, '.partial', clip_name), len(frames),
+                                         clip_key, checkpoint_frames)
+
+        # The only scene walk: frame_set, joint sampling and visibility, once per frame
+        prob, positions, P_frames, timings = walk_clip(frames, cameras, sampler, joint_names, keypoints,
+                                                       resolution, backend, P, cam_locations, animated_cameras, checkpoint)
+        print("Timing %s (%d frames, %s): " % (clip_name, len(positions), backend)
+              + ", ".join("%s %.2fs" % (phase, seconds) for phase, seconds in timings.items()))
+
+        # Projection, compression and writing overlap the next action's walk; recorded once on disk
+        with PROFILER.phase('save'):
+            output_writer.submit(clip_name, save_clip_outputs, d3_dir, d2_dir if materialize_2d else None,
+                                 occlusion_dir, clip_name, positions, P if P_frames is None else P_frames, prob, frames,
+                                 skeleton, joint_names, fmt, visibility_fmt,
+                                 on_done=partial(clip_saved, cache, clip_name, clip_key, checkpoint))
+
+    output_writer.close()
+    cache.summary()
+    PROFILER.finish()
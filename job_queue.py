@@ -0,0 +1,507 @@
+# Shared-directory job queue that spreads the extraction stages over several machines
+#
+# Usage (plain Python, on any node; the queue directory lives on the shared mount):
+#   python job_queue.py submit --queue /mnt/shared/queue --subject S1 --blend /mnt/shared/S1.blend --joint-id 8
+#   python job_queue.py work   --queue /mnt/shared/queue [--slots 2] [--node NAME]
+#   python job_queue.py status --queue /mnt/shared/queue
+#
+# A job is one (subject, action, stage): 'cameras' runs once per subject,
+# '3d', '2d' and 'occlusion' once per action. '2d' and 'occlusion' wait for the
+# subject's 'cameras' job and the action's '3d' job. A node takes a job by
+# creating its lease file, refreshes the lease every --heartbeat seconds while
+# the command runs, and removes it once the job is recorded as done. The next
+# node to see a lease that outlived its expiry (crashed or cut-off node) renames
+# it away and the job is run again, up to --max-attempts attempts. Expiry is
+# checked against the nodes' own clocks, so keep them in sync (NTP).
+#
+# Queue directory:
+#   jobs/<job>.json             stage, subject, action, command template and dependencies
+#   jobs/<job>.files            .fbx names passed as --file-list
+#   leases/<job>.lease          node, pid, token and expiry of the running attempt
+#   done/<job>.json             node, start/end time of the successful attempt
+#   attempts/<job>.<token>.json failed or expired attempts (one file each, never rewritten)
+#   nodes/<node>.json           last poll of each worker
+#   logs/<job>.<node>.log       output of each attempt
+import os
+import sys
+import json
+import time
+import uuid
+import shlex
+import socket
+import argparse
+import threading
+import subprocess
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+#Stages in dependency order; jobs of earlier stages are picked first
+STAGES = ('cameras', '3d', '2d', 'occlusion')
+
+#Stages each stage waits for: 'subject' jobs are per subject, the others per action
+STAGE_DEPENDENCIES = {'cameras': (), '3d': (), '2d': ('cameras', '3d'), 'occlusion': ('cameras', '3d')}
+SUBJECT_STAGES = ('cameras',)
+
+#Command templates (run from the script directory). Fields: blender, blend, subject, action,
+#joint_id, armature_name, src_dir, file_list; work_dir, node and job are filled in by the worker.
+STAGE_COMMANDS = {
+    'cameras': ['{blender}', '--background', '{blend}', '--python', 'camParams.py', '--', '{subject}',
+                '--out-dir', '../../BlendMimic3D/{subject}/Cameras'],
+    '3d': ['{blender}', '--background', '-P', '3D_extraction.py', '--', '--joint-id', '{joint_id}',
+           '--armature-name', '{armature_name}', '--subject', '{subject}', '--src-dir', '{src_dir}',
+           '--file-list', '{file_list}', '--work-dir', '{work_dir}'],
+    '2d': ['{blender}', '--background', '{blend}', '--python', '2D_extraction.py', '--', '{subject}', '{action}'],
+    'occlusion': ['{blender}', '--background', '{blend}', '--python', 'occlusion.py', '--', '--joint-id', '{joint_id}',
+                  '--armature-name', '{armature_name}', '--subject', '{subject}', '--file-list', '{file_list}'],
+}
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_HEARTBEAT_SECONDS = 30
+DEFAULT_MAX_ATTEMPTS = 2
+
+
+def job_id(subject, action, stage):
+    return '__'.join([subject] + ([action] if action is not None else []) + [stage])
+
+
+def queue_path(queue_dir, kind, name=''):
+    return os.path.join(queue_dir, kind, name)
+
+
+def read_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Write JSON next to `path` and rename it into place (readers never see a partial file)
+def write_json(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+    with open(tmp_path, 'w') as f:
+        json.dump(value, f, indent=1)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Lease on one job, held by `node` while it runs the job's command
+#
+# acquire() hard-links a private temp file to leases/<job>.lease: the link fails
+# when the lease exists, on NFS too, where create-exclusive is not reliable. A
+# lost link reply is caught by checking the temp file's link count. renew() and
+# release() only touch the lease while its token is still ours.
+class Lease:
+
+    def __init__(self, queue_dir, job, node, seconds=DEFAULT_LEASE_SECONDS):
+        self.path = queue_path(queue_dir, 'leases', job + '.lease')
+        self.job = job
+        self.node = node
+        self.seconds = seconds
+        self.token = uuid.uuid4().hex
+
+    def _info(self):
+        now = time.time()
+        return {'job': self.job, 'node': self.node, 'host': socket.gethostname(), 'pid': os.getpid(),
+                'token': self.token, 'acquired': getattr(self, 'acquired', now), 'heartbeat': now,
+                'expires': now + self.seconds}
+
+    def acquire(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.acquired = time.time()
+        tmp_path = '%s.%s.tmp' % (self.path, self.token)
+        with open(tmp_path, 'w') as f:
+            json.dump(self._info(), f)
+        try:
+            os.link(tmp_path, self.path)
+            owned = True
+        except OSError:
+            owned = os.stat(tmp_path).st_nlink == 2
+        os.remove(tmp_path)
+        return owned
+
+    def owned(self):
+        info = read_json(self.path)
+        return info is not None and info.get('token') == self.token
+
+    # Push the expiry forward; False once another node has reclaimed the lease
+    def renew(self):
+        if not self.owned():
+            return False
+        write_json(self.path, self._info())
+        return True
+
+    def release(self):
+        if self.owned():
+            os.remove(self.path)
+
+
+# Move an expired lease out of the way; returns its info, or None if it was not ours to reclaim
+#
+# Two nodes may see the same expired lease. The rename only succeeds for one of
+# them; if what it moved turns out to be a fresh lease taken in between, it is
+# linked back.
+def reclaim_lease(queue_dir, job, now=None):
+    path = queue_path(queue_dir, 'leases', job + '.lease')
+    info = read_json(path)
+    now = time.time() if now is None else now
+    if info is None or info['expires'] > now:
+        return None
+    moved = '%s.expired.%s' % (path, uuid.uuid4().hex)
+    try:
+        os.rename(path, moved)
+    except OSError:
+        return None
+    taken = read_json(moved)
+    #A fresh lease, or ours renewed in the meantime: put it back
+    if taken is None or taken.get('token') != info['token'] or taken['expires'] > now:
+        try:
+            os.link(moved, path)
+        except OSError:
+            pass
+        os.remove(moved)
+        return None
+    os.remove(moved)
+    write_json(queue_path(queue_dir, 'attempts', '%s.%s.json' % (job, info['token'])),
+               dict(info, reason='lease expired', reclaimed=now))
+    return info
+
+
+# Snapshot of the queue: every job with its state
+#
+# States: done, running (live lease), expired (lease past its expiry), failed
+# (attempts used up), blocked (a dependency failed), waiting (dependencies not
+# done) and ready.
+def scan_queue(queue_dir, now=None):
+    now = time.time() if now is None else now
+
+    def names(kind, suffix):
+        directory = queue_path(queue_dir, kind)
+        if not os.path.isdir(directory):
+            return []
+        return [name for name in os.listdir(directory) if name.endswith(suffix)]
+
+    jobs = {}
+    for name in names('jobs', '.json'):
+        spec = read_json(queue_path(queue_dir, 'jobs', name))
+        if spec is not None:
+            jobs[spec['id']] = dict(spec, attempts=[], lease=None, done=None)
+    for name in names('done', '.json'):
+        job = name[:-len('.json')]
+        if job in jobs:
+            jobs[job]['done'] = read_json(queue_path(queue_dir, 'done', name))
+    for name in names('attempts', '.json'):
+        job = name.rsplit('.', 2)[0]
+        if job in jobs:
+            jobs[job]['attempts'].append(read_json(queue_path(queue_dir, 'attempts', name)) or {})
+    for name in names('leases', '.lease'):
+        job = name[:-len('.lease')]
+        if job in jobs:
+            jobs[job]['lease'] = read_json(queue_path(queue_dir, 'leases', name))
+
+    def state(job):
+        if 'state' in job:
+            return job['state']
+        if job['done'] is not None:
+            job['state'] = 'done'
+        elif job['lease'] is not None:
+            job['state'] = 'running' if job['lease']['expires'] > now else 'expired'
+        elif len(job['attempts']) >= job['max_attempts']:
+            job['state'] = 'failed'
+        else:
+            job['state'] = 'waiting'
+            deps = [state(jobs[dep]) for dep in job['deps'] if dep in jobs]
+            if any(dep in ('failed', 'blocked') for dep in deps):
+                job['state'] = 'blocked'
+            elif all(dep == 'done' for dep in deps):
+                job['state'] = 'ready'
+        return job['state']
+
+    for job in jobs.values():
+        state(job)
+    return jobs
+
+
+# Add the jobs of one subject to the queue; returns the ids written
+#
+# Actions are named after `fbx_files` (names in the --src-dir of the 3D stage).
+# Existing jobs are rewritten (new command or dependencies) but keep their
+# done/attempt records unless `redo` is set.
+def submit_jobs(queue_dir, subject, fbx_files, stages, fields, commands=None, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                redo=False):
+    commands = dict(STAGE_COMMANDS, **(commands or {}))
+    actions = {os.path.splitext(name)[0]: name for name in fbx_files}
+    existing = set(name[:-len('.json')] for name in os.listdir(queue_path(queue_dir, 'jobs'))
+                   if name.endswith('.json')) if os.path.isdir(queue_path(queue_dir, 'jobs')) else set()
+    specs = []
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        for action in [None] if stage in SUBJECT_STAGES else sorted(actions):
+            specs.append((stage, action, job_id(subject, action, stage)))
+    submitted = existing | set(job for _, _, job in specs)
+
+    written = []
+    for stage, action, job in specs:
+        deps = [job_id(subject, None if dep in SUBJECT_STAGES else action, dep) for dep in STAGE_DEPENDENCIES[stage]]
+        file_list = queue_path(queue_dir, 'jobs', job + '.files')
+        if action is not None:
+            with open(file_list, 'w') as f:
+                f.write(actions[action] + '\n')
+        job_fields = dict(fields, subject=subject, action=action or '', file_list=os.path.abspath(file_list))
+        write_json(queue_path(queue_dir, 'jobs', job + '.json'),
+                   {'id': job, 'subject': subject, 'action': action, 'stage': stage, 'command': commands[stage],
+                    'fields': job_fields, 'deps': [dep for dep in deps if dep in submitted],
+                    'max_attempts': max_attempts, 'submitted': time.time()})
+        if redo:
+            for kind in ('done', 'attempts'):
+                directory = queue_path(queue_dir, kind)
+                for name in os.listdir(directory) if os.path.isdir(directory) else []:
+                    if name == job + '.json' or name.startswith(job + '.'):
+                        os.remove(os.path.join(directory, name))
+        written.append(job)
+    return written
+
+
+# Pulls ready jobs from the queue and runs up to `slots` of them at once
+class Worker:
+
+    def __init__(self, queue_dir, node, slots=1, lease_seconds=DEFAULT_LEASE_SECONDS,
+                 heartbeat=DEFAULT_HEARTBEAT_SECONDS, poll=10.0, work_root=None):
+        self.queue_dir = queue_dir
+        self.node = node
+        self.slots = max(1, slots)
+        self.lease_seconds = lease_seconds
+        self.heartbeat = heartbeat
+        self.poll = poll
+        self.work_root = work_root or os.path.join(SCRIPT_DIR, 'queue_work')
+        self.running = {}
+        self.finished = 0
+        self.failed = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+    # Run one leased job to completion, heartbeating the lease; records done or a failed attempt
+    def run_job(self, spec, lease):
+        job = spec['id']
+        start = time.time()
+        work_dir = os.path.join(self.work_root, job)
+        #Node-local scratch, only for the commands that take it
+        if any('{work_dir}' in token for token in spec['command']):
+            os.makedirs(work_dir, exist_ok=True)
+        fields = dict(spec['fields'], work_dir=work_dir, node=self.node, job=job)
+        cmd = [token.format(**fields) for token in spec['command']]
+        log_path = queue_path(self.queue_dir, 'logs', '%s.%s.log' % (job, self.node))
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+        lost = False
+        with open(log_path, 'w') as log:
+            log.write('$ %s\n' % ' '.join(shlex.quote(token) for token in cmd))
+            log.flush()
+            try:
+                proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=SCRIPT_DIR)
+            except OSError as error:
+                log.write('%s\n' % error)
+                proc = None
+            while proc is not None and proc.poll() is None:
+                try:
+                    proc.wait(timeout=self.heartbeat)
+                except subprocess.TimeoutExpired:
+                    if not lease.renew():
+                        #Reclaimed by another node (we missed our heartbeats): stop, the job runs there
+                        lost = True
+                        proc.kill()
+                        proc.wait()
+        returncode = proc.returncode if proc is not None else None
+        record = {'job': job, 'stage': spec['stage'], 'node': self.node, 'host': socket.gethostname(),
+                  'pid': os.getpid(), 'token': lease.token, 'start': start, 'end': time.time(),
+                  'returncode': returncode, 'log': log_path}
+        if lost:
+            print('[%s] lost the lease of %s' % (self.node, job))
+        elif returncode == 0:
+            write_json(queue_path(self.queue_dir, 'done', job + '.json'), record)
+        else:
+            write_json(queue_path(self.queue_dir, 'attempts', '%s.%s.json' % (job, lease.token)),
+                       dict(record, reason='exit code %s' % returncode))
+        lease.release()
+        with self.lock:
+            del self.running[job]
+            if returncode == 0 and not lost:
+                self.finished += 1
+            else:
+                self.failed += 1
+        print('[%s] %s %s in %.1fs' % (self.node, job, 'done' if returncode == 0 and not lost else 'failed',
+                                       record['end'] - start))
+
+    def write_node(self):
+        with self.lock:
+            info = {'node': self.node, 'host': socket.gethostname(), 'pid': os.getpid(), 'slots': self.slots,
+                    'started': self.started, 'seen': time.time(), 'running': sorted(self.running),
+                    'finished': self.finished, 'failed': self.failed}
+        write_json(queue_path(self.queue_dir, 'nodes', self.node + '.json'), info)
+
+    # One pass: reclaim expired leases and start ready jobs in free slots; returns the queue snapshot
+    def step(self):
+        jobs = scan_queue(self.queue_dir)
+        for job in jobs.values():
+            if job['state'] == 'expired' and reclaim_lease(self.queue_dir, job['id']) is not None:
+                print('[%s] reclaimed the expired lease of %s (%s)' % (self.node, job['id'], job['lease']['node']))
+        ready = sorted((job for job in jobs.values() if job['state'] == 'ready' and job['id'] not in self.running),
+                       key=lambda job: (STAGES.index(job['stage']), job['subject'], job['action'] or ''))
+        for job in ready:
+            if len(self.running) >= self.slots:
+                break
+            lease = Lease(self.queue_dir, job['id'], self.node, self.lease_seconds)
+            if not lease.acquire():
+                continue
+            #A node may have finished it between the scan and the lease
+            if os.path.exists(queue_path(self.queue_dir, 'done', job['id'] + '.json')):
+                lease.release()
+                continue
+            print('[%s] running %s' % (self.node, job['id']))
+            thread = threading.Thread(target=self.run_job, args=(job, lease), daemon=True)
+            with self.lock:
+                self.running[job['id']] = thread
+            thread.start()
+        self.write_node()
+        return jobs
+
+    # Work until no job is left to run (or forever with `wait`); returns the ids of the jobs left failed or blocked
+    def run(self, wait=False):
+        while True:
+            jobs = self.step()
+            pending = [job for job in jobs.values() if job['state'] in ('ready', 'waiting', 'running', 'expired')]
+            if not pending and not self.running and not wait:
+                break
+            time.sleep(self.poll)
+        self.write_node()
+        print('[%s] %d job(s) done, %d failed' % (self.node, self.finished, self.failed))
+        #Attempts that failed and were retried successfully do not count
+        unfinished = sorted(job['id'] for job in jobs.values() if job['state'] in ('failed', 'blocked'))
+        if unfinished:
+            print('[%s] %d job(s) failed or blocked: %s' % (self.node, len(unfinished), ', '.join(unfinished)))
+        return unfinished
+
+
+# Per-node totals from the done/attempt records and the node files
+def node_throughput(queue_dir, jobs, now=None):
+    now = time.time() if now is None else now
+    nodes = {}
+
+    def entry(node):
+        return nodes.setdefault(node, {'node': node, 'done': 0, 'failed': 0, 'lost': 0, 'busy_s': 0.0,
+                                       'first': None, 'last': None, 'running': 0, 'seen': None})
+
+    for job in jobs.values():
+        records = [(job['done'], True)] if job['done'] is not None else []
+        records += [(attempt, False) for attempt in job['attempts'] if 'start' in attempt]
+        #Leases reclaimed from a node that stopped heartbeating
+        for attempt in job['attempts']:
+            if 'reclaimed' in attempt:
+                entry(attempt['node'])['lost'] += 1
+        for record, ok in records:
+            node = entry(record['node'])
+            node['done' if ok else 'failed'] += 1
+            node['busy_s'] += record['end'] - record['start']
+            node['first'] = record['start'] if node['first'] is None else min(node['first'], record['start'])
+            node['last'] = record['end'] if node['last'] is None else max(node['last'], record['end'])
+        if job['state'] == 'running':
+            entry(job['lease']['node'])['running'] += 1
+    directory = queue_path(queue_dir, 'nodes')
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        info = read_json(os.path.join(directory, name))
+        if info is not None:
+            entry(info['node'])['seen'] = info['seen']
+    for node in nodes.values():
+        span = (node['last'] or now) - (node['first'] or now)
+        node['jobs_per_hour'] = node['done'] * 3600.0 / span if span > 0 else 0.0
+    return [nodes[name] for name in sorted(nodes)]
+
+
+def print_status(queue_dir, now=None):
+    now = time.time() if now is None else now
+    jobs = scan_queue(queue_dir, now)
+    states = ('done', 'running', 'ready', 'waiting', 'expired', 'failed', 'blocked')
+    print('%d job(s): %s' % (len(jobs), ', '.join('%d %s' % (sum(job['state'] == s for job in jobs.values()), s)
+                                                  for s in states)))
+
+    print('%-10s %s %9s' % ('stage', ' '.join('%8s' % s for s in states), 'mean (s)'))
+    for stage in STAGES:
+        stage_jobs = [job for job in jobs.values() if job['stage'] == stage]
+        if not stage_jobs:
+            continue
+        times = [job['done']['end'] - job['done']['start'] for job in stage_jobs if job['done'] is not None]
+        print('%-10s %s %9s' % (stage, ' '.join('%8d' % sum(job['state'] == s for job in stage_jobs) for s in states),
+                                '%.1f' % (sum(times) / len(times)) if times else '-'))
+
+    print('%-20s %6s %6s %6s %8s %10s %8s %10s' % ('node', 'done', 'failed', 'lost', 'running', 'busy (s)', 'jobs/h',
+                                                 'last seen'))
+    for node in node_throughput(queue_dir, jobs, now):
+        seen = '%.0fs ago' % (now - node['seen']) if node['seen'] is not None else '-'
+        print('%-20s %6d %6d %6d %8d %10.1f %8.1f %10s' % (node['node'], node['done'], node['failed'], node['lost'],
+                                                          node['running'], node['busy_s'], node['jobs_per_hour'], seen))
+
+    for job in sorted(jobs.values(), key=lambda job: job['id']):
+        if job['state'] in ('running', 'expired'):
+            lease = job['lease']
+            print('  %-8s %s on %s for %.0fs, heartbeat %.0fs ago' % (job['state'], job['id'], lease['node'],
+                                                                     now - lease['acquired'], now - lease['heartbeat']))
+        elif job['state'] == 'failed':
+            last = max(job['attempts'], key=lambda attempt: attempt.get('end', attempt.get('reclaimed', 0)))
+            print('  failed   %s after %d attempt(s): %s %s' % (job['id'], len(job['attempts']), last.get('reason', '?'),
+                                                               last.get('log', '')))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='add the jobs of a subject')
+    submit.add_argument('--queue', required=True)
+    submit.add_argument('--subject', required=True)
+    submit.add_argument('--blend', default='', help='.blend with the actions and cameras (cameras, 2d, occlusion)')
+    submit.add_argument('--src-dir', default=os.path.join(SCRIPT_DIR, 'regular'), help='.fbx files, one action each')
+    submit.add_argument('--actions', nargs='+', default=None, help='<action>.fbx names; default: every .fbx in --src-dir')
+    submit.add_argument('--stages', nargs='+', default=list(STAGES), choices=STAGES)
+    submit.add_argument('--joint-id', default='')
+    submit.add_argument('--armature-name', default='Armature')
+    submit.add_argument('--blender', default='blender')
+    submit.add_argument('--max-attempts', type=int, default=DEFAULT_MAX_ATTEMPTS)
+    submit.add_argument('--redo', action='store_true', help='forget earlier done/failed records of these jobs')
+    # e.g. --cmd 2d "python stub.py {subject} {action}" (same placeholders as STAGE_COMMANDS)
+    submit.add_argument('--cmd', nargs=2, action='append', default=[], metavar=('STAGE', 'TEMPLATE'))
+
+    work = commands.add_parser('work', help='run jobs until none is left')
+    work.add_argument('--queue', required=True)
+    work.add_argument('--node', default=socket.gethostname())
+    work.add_argument('--slots', type=int, default=1, help='jobs run at once on this node')
+    work.add_argument('--lease', type=float, default=DEFAULT_LEASE_SECONDS, help='lease expiry (s)')
+    work.add_argument('--heartbeat', type=float, default=DEFAULT_HEARTBEAT_SECONDS, help='lease renewal period (s)')
+    work.add_argument('--poll', type=float, default=10.0)
+    work.add_argument('--work-root', default=None, help='node-local scratch (default: ./queue_work)')
+    work.add_argument('--wait', action='store_true', help='keep polling for new jobs')
+
+    status = commands.add_parser('status', help='job states and per-node throughput')
+    status.add_argument('--queue', required=True)
+    args = parser.parse_args()
+
+    queue_dir = os.path.abspath(args.queue)
+    if args.command == 'submit':
+        if args.actions:
+            fbx_files = [action + '.fbx' for action in args.actions]
+        else:
+            fbx_files = sorted(name for name in os.listdir(args.src_dir) if name.lower().endswith('.fbx'))
+        fields = {'blender': args.blender, 'blend': os.path.abspath(args.blend) if args.blend else '',
+                  'joint_id': args.joint_id, 'armature_name': args.armature_name,
+                  'src_dir': os.path.abspath(args.src_dir)}
+        os.makedirs(queue_path(queue_dir, 'jobs'), exist_ok=True)
+        written = submit_jobs(queue_dir, args.subject, fbx_files, args.stages, fields,
+                              {stage: shlex.split(template) for stage, template in args.cmd},
+                              max_attempts=args.max_attempts, redo=args.redo)
+        print('Submitted %d job(s) for %s (%d action(s))' % (len(written), args.subject, len(fbx_files)))
+    elif args.command == 'work':
+        worker = Worker(queue_dir, args.node, args.slots, args.lease, args.heartbeat, args.poll, args.work_root)
+        unfinished = worker.run(wait=args.wait)
+        sys.exit(1 if unfinished else 0)
+    else:
+        print_status(queue_dir)
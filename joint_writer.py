@@ -0,0 +1,71 @@
+import os
+import json
+import numpy as np
+
+from dataset_store import save_output
+
+
+# Collects per-frame joint positions straight into a preallocated (F, J, 3) array.
+#
+# With `spill_path` set the buffer is an on-disk .npy memmap instead of RAM, so
+# very long clips only keep the pages being written resident. Call `finalize()`
+# once all frames are in to get the array back (the memmap itself, so saving it
+# never copies the clip into RAM) and `remove()` once it is saved to drop the
+# spill file.
+class JointArrayWriter:
+
+    def __init__(self, n_frames, n_joints, spill_path=None, json_dir=None):
+        self.n_frames = int(n_frames)
+        self.n_joints = int(n_joints)
+        self.spill_path = spill_path
+        self.json_dir = json_dir
+        shape = (self.n_frames, self.n_joints, 3)
+        if spill_path is not None:
+            self.positions = np.lib.format.open_memmap(spill_path, mode='w+', dtype=np.float64, shape=shape)
+        else:
+            self.positions = np.empty(shape, dtype=np.float64)
+        if json_dir is not None and not os.path.exists(json_dir):
+            os.makedirs(json_dir)
+
+    # Store frame `i`; `joints` is anything reshapeable to (J, 3)
+    def set_frame(self, i, joints):
+        self.positions[i] = np.asarray(joints, dtype=np.float64).reshape(self.n_joints, 3)
+        if self.json_dir is not None:
+            #Optional debug output, same layout as the old JointDict directories
+            out_dict = {'pose_keypoints_3d': self.positions[i].ravel().tolist()}
+            with open(os.path.join(self.json_dir, '%04d_keypoints.json' % i), 'w') as f:
+                json.dump(out_dict, f)
+
+    def finalize(self):
+        if self.spill_path is not None:
+            self.positions.flush()
+        return self.positions
+
+    # Drop the spill file; the finalized positions must not be read afterwards
+    def remove(self):
+        if self.spill_path is not None and os.path.exists(self.spill_path):
+            self.positions = None
+            os.remove(self.spill_path)
+
+
+# Write one clip's (F, J, 3) positions as D3_Positions/<anim>/<anim>.npz (+ data3D.txt)
+#
+# `fmt` is one of dataset_store.OUTPUT_FORMATS; returns the output files written.
+def save_positions_3d(npz_dir, anim_name, positions, save_txt=True, fmt='npz'):
+    save_path = os.path.join(npz_dir, anim_name)
+    if not os.path.exists(save_path):
+        os.makedirs(save_path)
+
+    print('Saving...')
+    written = save_output(os.path.join(save_path, anim_name + ".npz"), fmt, positions_3d=positions)
+    print('Done.')
+
+    if save_txt:
+        #Same (J, 3*F) layout jointDict2npy has always written
+        data = positions.transpose(1, 2, 0)
+        print(data.shape)
+        reshaped_data = np.reshape(data, (data.shape[0], -1))
+        txt_path = os.path.join(save_path, 'data3D.txt')
+        np.savetxt(txt_path + '.tmp', reshaped_data, delimiter=' ')
+        os.replace(txt_path + '.tmp', txt_path)
+    return written
@@ -0,0 +1,71 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+#Per-frame files written by fbx2jointDict: '%04d_keypoints.json'
+FRAME_FILE_RE = re.compile(r'^(\d+)_keypoints\.json$')
+
+
+# Sorted (frame_index, path) pairs for a JointDict directory; raises if frames are missing
+def list_frame_files(files_path):
+    frames = []
+    for name in os.listdir(files_path):
+        match = FRAME_FILE_RE.match(name)
+        if match:
+            frames.append((int(match.group(1)), os.path.join(files_path, name)))
+    frames.sort()
+
+    if not frames:
+        raise ValueError('No keypoint files found in %s' % files_path)
+    first = frames[0][0]
+    indices = [idx for idx, _ in frames]
+    if indices != list(range(first, first + len(frames))):
+        present = set(indices)
+        missing = [idx for idx in range(first, indices[-1] + 1) if idx not in present]
+        raise ValueError('%s is missing %d frame(s): %s' % (files_path, len(missing), missing[:20]))
+    return frames
+
+
+def _read_keypoints(path):
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            return orjson.loads(f.read())['pose_keypoints_3d']
+    with open(path) as f:
+        return json.load(f)['pose_keypoints_3d']
+
+
+# Load a JointDict directory into an (F, n_joints, 3) array ordered by frame index
+#
+# Files are read and parsed on a thread pool (orjson is used when installed) and
+# each frame is copied into a preallocated array as soon as it is parsed.
+# `n_joints=None` keeps every joint, taking the count from the first frame.
+def load_joint_dict(files_path, n_joints=None, workers=None):
+    frames = list_frame_files(files_path)
+    if n_joints is None:
+        n_joints = len(_read_keypoints(frames[0][1])) // 3
+    positions = np.empty((len(frames), n_joints, 3), dtype=np.float64)
+
+    def load(slot):
+        joint = np.asarray(_read_keypoints(frames[slot][1]), dtype=np.float64).reshape((-1, 3))
+        if joint.shape[0] < n_joints:
+            raise ValueError('%s has %d joints, expected at least %d' % (frames[slot][1], joint.shape[0], n_joints))
+        positions[slot] = joint[:n_joints, :]
+
+    if workers is None:
+        workers = min(32, (os.cpu_count() or 1) + 4)
+    if workers <= 1:
+        for slot in range(len(frames)):
+            load(slot)
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            #list() re-raises the first worker exception, if any
+            list(pool.map(load, range(len(frames))))
+
+    return positions
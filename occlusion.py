@@ -1,21 +1,38 @@
 import bpy
 import sys
 import os
+import time
+from functools import partial
 from mathutils import Vector
+from mathutils.bvhtree import BVHTree
 from bpy import context
-import bpy_extras
 import numpy as np
 #from bpy_extras import object_utils
 
-#Crucial joints sufficient for visualisation #FIX ME - Add more joints if desirable for MixamRig
-BASE_JOINT_NAMES = ['Hips', 'LeftUpLeg', 'LeftLeg', 'LeftFoot', 'RightUpLeg', 'RightLeg', 'RightFoot', 
-                    'Spine1', 'Neck','Head', 'HeadTop_End', 'RightArm', 'RightForeArm', 'RightHand', 
-                    'LeftArm', 'LeftForeArm', 'LeftHand',
-                    ]
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from stage_cache import StageCache
+import visibility_codec
+from visibility_codec import save_occlusion_outputs
+from bone_sampler import BlenderArmatureAdapter, BoneSampler
+import projection
+from projection import in_view_mask
+import camera_arrays
+from camParams import DEFAULT_CAMERA_PATTERN, find_cameras, get_camera_matrices, is_animated
+import bvh_occlusion
+from bvh_occlusion import TriangleBVH, occluded_joints
+from frame_checkpoint import FrameCheckpoint, DEFAULT_CHECKPOINT_FRAMES
+from frame_selection import parse_frame_args, save_frames
+from profiler import PROFILER, parse_profile_args
+from output_writer import OutputWriter, parse_writer_args
+from skeletons import DEFAULT_SKELETON, get_skeleton
 
 #Source directory where .fbx exist
 SRC_DATA_DIR ='regular'
 
+#Modifiers that make a mesh change shape over time (its BVH is rebuilt every frame)
+DEFORM_MODIFIERS = {'ARMATURE', 'CLOTH', 'SOFT_BODY', 'MESH_CACHE', 'MESH_SEQUENCE_CACHE', 'HOOK', 'SURFACE_DEFORM',
+                    'MESH_DEFORM', 'LATTICE', 'CURVE', 'SHRINKWRAP', 'WAVE', 'DYNAMIC_PAINT', 'OCEAN', 'NODES'}
+
 def remove_trailing_numbers(bone_name):
     # Initialize an empty string to hold the result
     result = ""
@@ -31,35 +48,19 @@ def remove_trailing_numbers(bone_name):
 
     return result                   
 
-def is_keypoint_out_of_view(keypoint, keypoint_location, camera):
-    scene = bpy.context.scene
-    #camera = bpy.context.scene.camera
-    
-    # Get the 3D location of the keypoint
-    #keypoint_location = keypoint.matrix @ bpy.context.object.matrix_world @ keypoint.location
-
-    # Project the 3D location of the keypoint onto the camera's image plane
-    projected_co = bpy_extras.object_utils.world_to_camera_view(scene, camera, keypoint_location)
-
-    # Check if the projected 2D point is outside the image boundaries
-    if 0 <= projected_co.x <= 1 and 0 <= projected_co.y <= 1 and projected_co.z > 0:
-        # The keypoint is within the camera's viewport
-        return False
-    else:
-        # The keypoint is outside the camera's viewport
-        return True
-
-def is_occluded(keypoint, kpt_global_location, camera):
+def is_occluded(keypoint, kpt_global_location, camera, depsgraph=None):
    
     scene = bpy.context.scene
-    depsgraph = bpy.context.evaluated_depsgraph_get()
+    # Pass the frame's depsgraph in to avoid fetching it again for every joint
+    if depsgraph is None:
+        depsgraph = bpy.context.evaluated_depsgraph_get()
     #camera = bpy.context.scene.camera
    
-    # Calculate the direction from the camera to the keypoint
-    direction = (kpt_global_location - camera.location).normalized()
+    # Calculate the direction from the camera to the keypoint (world position, also for parented cameras)
+    direction = (kpt_global_location - camera.matrix_world.translation).normalized()
 
     # Define the ray's starting and ending points
-    ray_start = camera.location
+    ray_start = camera.matrix_world.translation
     ray_end = kpt_global_location
     
     # Perform the ray casting
@@ -75,12 +76,232 @@ def is_occluded(keypoint, kpt_global_location, camera):
 
     return False
 
+# World-space ray origins of the cameras -> (C, 3); matrix_world also places parented or constrained cameras
+def camera_locations(cameras):
+    return np.array([cam.matrix_world.translation for cam in cameras], dtype=np.float64)
+
+# True for meshes whose evaluated geometry or placement can change from frame to frame
+def is_deforming(obj):
+    obj = obj.original
+    if any(mod.type in DEFORM_MODIFIERS for mod in obj.modifiers) or len(obj.constraints):
+        return True
+    if getattr(obj.data, 'shape_keys', None) is not None:
+        return True
+    while obj is not None:
+        if obj.type == 'ARMATURE':
+            return True
+        if obj.animation_data is not None and (obj.animation_data.action is not None or len(obj.animation_data.drivers)):
+            return True
+        obj = obj.parent
+    return False
+
+# World-space triangles of the visible meshes in the evaluated scene (body plus occluders)
+#
+# Returns vertices (V, 3), faces (T, 3) and the owner index of each triangle; owner
+# object names are appended to `owner_names`. `select` filters the objects exported.
+def export_scene_triangles(depsgraph, owner_names, select=None):
+    vertices, faces, owners = [], [], []
+    offset = 0
+    for instance in depsgraph.object_instances:
+        obj = instance.object
+        if obj.type != 'MESH' or (select is not None and not select(obj)):
+            continue
+        mesh = obj.to_mesh()
+        mesh.calc_loop_triangles()
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+        mesh.vertices.foreach_get('co', co)
+        tris = np.empty(len(mesh.loop_triangles) * 3, dtype=np.int32)
+        mesh.loop_triangles.foreach_get('vertices', tris)
+        obj.to_mesh_clear()
+
+        world = np.array(instance.matrix_world, dtype=np.float64)
+        vertices.append(co.reshape(-1, 3) @ world[:3, :3].T + world[:3, 3])
+        faces.append(tris.reshape(-1, 3) + offset)
+        owners.append(np.full(len(tris) // 3, len(owner_names)))
+        owner_names.append(obj.name)
+        offset += len(co) // 3
+
+    if not faces:
+        return np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(vertices), np.concatenate(faces), np.concatenate(owners)
+
+# Ray-cast structure over exported triangles for the given backend (None when there is no geometry)
+def build_occluder_tree(backend, vertices, faces, owners):
+    if not len(faces):
+        return None
+    if backend == 'bvh':
+        return TriangleBVH(vertices, faces, owners)
+    return BVHTree.FromPolygons(vertices.tolist(), faces.tolist(), all_triangles=True), owners
+
+# Occlusion of every in-view (camera, joint) pair of the current frame with mathutils BVH trees -> (C, J)
+def occluded_joints_bvhtree(trees, owner_occludes, cam_locations, joints, in_view):
+    occluded = np.zeros(in_view.shape, dtype=bool)
+    for c, j in zip(*np.nonzero(in_view)):
+        origin = Vector(cam_locations[c])
+        direction = (Vector(joints[j]) - origin).normalized()
+        best = None
+        for tree, owners in trees:
+            location, normal, index, distance = tree.ray_cast(origin, direction)
+            if index is not None and (best is None or distance < best[0]):
+                best = (distance, owners[index])
+        if best is not None:
+            occluded[c, j] = owner_occludes[best[1], j]
+    return occluded
+
+# (n_owners, J) table: True when a ray hitting that object hides the joint (same rule as is_occluded)
+def owner_occlusion_table(owner_names, joint_names):
+    return np.array([[remove_trailing_numbers(owner) not in joint for joint in joint_names]
+                     for owner in owner_names], dtype=bool).reshape(len(owner_names), len(joint_names))
+
+# Everything about a camera that affects visibility: world matrix and lens/sensor settings
+def camera_signature(camera):
+    camd = camera.data
+    return [[list(row) for row in camera.matrix_world], camd.type, camd.lens, camd.sensor_fit,
+            camd.sensor_width, camd.sensor_height, camd.shift_x, camd.shift_y]
+
+
+# Walk the scene `frames` once: sample the joints and test every (camera, joint) pair
+#
+# Each frame is set and evaluated once. Returns the visibility (C, F, J) (0 for
+# out-of-view or occluded joints), the sampled (F, J, 3) world positions, the
+# per-frame (C, F, 3, 4) P when `animated_cameras` (else None) and the time
+# spent per phase. Static occluders are indexed once, deforming meshes per frame.
+# With a FrameCheckpoint every frame is also streamed to disk in chunks, the
+# walk starts at the checkpoint's resume frame and the returned arrays are the
+# finalized ones read back from it (the caller removes it once they are saved).
+def walk_clip(frames, cameras, sampler, joint_names, keypoints, resolution, backend,
+              P, cam_locations, animated_cameras=False, checkpoint=None):
+    n_frames = len(frames)
+    prob = np.ones((len(cameras), n_frames, len(joint_names)))
+    positions = np.empty((n_frames, len(joint_names), 3))
+    P_frames = np.empty((len(cameras), n_frames, 3, 4)) if animated_cameras else None
+    timings = {'frame_set': 0.0, 'depsgraph': 0.0, 'static_bvh': 0.0, 'dynamic_bvh': 0.0, 'ray_cast': 0.0}
+    static_tree = None
+    owner_names = []
+    rays_per_camera = np.zeros(len(cameras), dtype=np.int64)
+    first = checkpoint.resume_frame if checkpoint is not None else 0
+    if 0 < first < n_frames:
+        print("Resuming at frame %d" % frames[first])
+    
+    for f in range(first, n_frames):
+        frame = int(frames[f])
+        t0 = time.perf_counter()
+        with PROFILER.phase('frame_set'):
+            bpy.context.scene.frame_set(frame)
+        t1 = time.perf_counter()
+        with PROFILER.phase('depsgraph'):
+            depsgraph = bpy.context.evaluated_depsgraph_get()
+        timings['frame_set'] += t1 - t0
+        timings['depsgraph'] += time.perf_counter() - t1
+        
+        with PROFILER.phase('sample_bones'):
+            sampler.sample(out=positions[f])
+            if animated_cameras:
+                _, _, P = get_camera_matrices(cameras)
+                P_frames[:, f] = P
+                cam_locations = camera_locations(cameras)
+        # Out-of-view joints (batched projection test) are never ray cast
+        with PROFILER.phase('in_view'):
+            frame_in_view = in_view_mask(positions[f][None], P, resolution)[:, 0]
+        rays_per_camera += frame_in_view.sum(axis=1)
+        
+        if backend == 'raycast':
+            t0 = time.perf_counter()
+            with PROFILER.phase('ray_cast') as phase:
+                frame_occluded = np.zeros(frame_in_view.shape, dtype=bool)
+                for c, j in zip(*np.nonzero(frame_in_view)):
+                    frame_occluded[c, j] = is_occluded(keypoints[joint_names[j]], Vector(positions[f, j]), cameras[c], depsgraph)
+                phase.add_items(frame_in_view.sum())
+            timings['ray_cast'] += time.perf_counter() - t0
+        else:
+            if f == first:
+                #Static occluders (environment) are exported and indexed once per clip
+                t0 = time.perf_counter()
+                with PROFILER.phase('static_bvh'):
+                    static_tree = build_occluder_tree(backend, *export_scene_triangles(
+                        depsgraph, owner_names, select=lambda obj: not is_deforming(obj)))
+                    n_static = len(owner_names)
+                timings['static_bvh'] += time.perf_counter() - t0
+            
+            #Deforming meshes (the characters) are refreshed every frame
+            t0 = time.perf_counter()
+            with PROFILER.phase('dynamic_bvh'):
+                del owner_names[n_static:]
+                dynamic_tree = build_occluder_tree(backend, *export_scene_triangles(depsgraph, owner_names, select=is_deforming))
+                owner_occludes = owner_occlusion_table(owner_names, joint_names)
+                trees = [tree for tree in (static_tree, dynamic_tree) if tree is not None]
+            timings['dynamic_bvh'] += time.perf_counter() - t0
+            
+            t0 = time.perf_counter()
+            with PROFILER.phase('ray_cast') as phase:
+                if backend == 'bvh':
+                    frame_occluded = occluded_joints(trees, owner_occludes, cam_locations, positions[f], in_view=frame_in_view)
+                else:
+                    frame_occluded = occluded_joints_bvhtree(trees, owner_occludes, cam_locations, positions[f], frame_in_view)
+                phase.add_items(frame_in_view.sum())
+            timings['ray_cast'] += time.perf_counter() - t0
+        
+        prob[:, f][~frame_in_view | frame_occluded] = 0
+        if checkpoint is not None:
+            with PROFILER.phase('checkpoint'):
+                extra = {'P': P} if animated_cameras else {}
+                checkpoint.set_frame(f, positions_3d=positions[f], visibility=prob[:, f], **extra)
+    
+    #Rays cast per camera (in-view joints)
+    for c, cam in enumerate(cameras):
+        PROFILER.add('rays', 0.0, calls=0, items=rays_per_camera[c], camera=cam.name)
+    
+    if checkpoint is not None:
+        arrays = checkpoint.finalize()
+        positions = arrays['positions_3d']
+        prob = arrays['visibility'].transpose(1, 0, 2)
+        if animated_cameras:
+            P_frames = arrays['P'].transpose(1, 0, 2, 3)
+    return prob, positions, P_frames, timings
+
+
+# Writer callback: record the saved clip in the cache, then drop its checkpoint
+def clip_saved(cache, clip_name, clip_key, checkpoint, written):
+    cache.record(clip_name, clip_key, written)
+    if checkpoint is not None:
+        checkpoint.remove()
+
+
+# Writer job: one action's Occlusions outputs (visibility and frames.npy); returns the files written
+def save_clip_occlusion(save_path, prob, frames, fmt='npz', visibility_fmt='float'):
+    written = save_occlusion_outputs(save_path, prob, fmt, visibility_fmt)
+    written.append(save_frames(save_path, frames))
+    return written
+
 
 if __name__ == '__main__':
     
-    start_frame = 0
-    end_frame = 0
+    #'bvhtree': mathutils BVH trees (static geometry once per clip, deforming meshes per frame)
+    #'bvh': same split with the NumPy BVH in bvh_occlusion.py
+    #'raycast': scene.ray_cast with one depsgraph per frame
+    backend = 'bvhtree'
+    #Output format: npz (default), store (memory-mappable directory) or both
+    fmt = 'npz'
+    #Visibility output: float (occluded_kpt.npz, default), packed (bit-packed visibility.npz) or both
+    visibility_fmt = 'float'
+    #Cameras to test, by name pattern or collection (same discovery as camParams.py)
+    camera_pattern = DEFAULT_CAMERA_PATTERN
+    camera_collection = None
+    #Frames per on-disk chunk of the crash-safe checkpoint (0 keeps everything in memory)
+    checkpoint_frames = DEFAULT_CHECKPOINT_FRAMES
+    #Joints to test: registered skeleton name or .json/.yaml joint map (see skeletons.py)
+    skeleton = get_skeleton(DEFAULT_SKELETON)
+    anim_files = None
     argv = sys.argv[sys.argv.index("--") + 1:]  # Get arguments after "--"
+    # --start/--end/--stride/--random/--seed (--start_frame/--end_frame still work) restrict the frames of every action
+    selection, argv = parse_frame_args(argv)
+    # --profile [trace.json|trace.csv]: per-phase timing summary (and trace file) at the end of the run
+    argv = parse_profile_args(argv)
+    # --write-workers N (0: write on the main thread) and --write-queue N: background output writing
+    write_workers, write_queue, argv = parse_writer_args(argv)
+    # Recompute even if the outputs are up to date
+    force = "--force" in argv
+    argv = [arg for arg in argv if arg != "--force"]
     # Parse the command-line arguments
     if argv:
         for i in range(0, len(argv), 2):
@@ -90,46 +311,85 @@ if __name__ == '__main__':
                 armature_name = argv[i + 1]
             elif argv[i] == "--subject":
                 subject = argv[i + 1]
-            elif argv[i] == "--start_frame":
-                start_frame = argv[i + 1]
-            elif argv[i] == "--end_frame":
-                end_frame = argv[i + 1]
+            elif argv[i] == "--backend":
+                backend = argv[i + 1]
+            elif argv[i] == "--format":
+                fmt = argv[i + 1]
+            elif argv[i] == "--visibility":
+                visibility_fmt = argv[i + 1]
+            elif argv[i] == "--cameras":
+                camera_pattern = argv[i + 1]
+            elif argv[i] == "--collection":
+                camera_collection = argv[i + 1]
+            elif argv[i] == "--checkpoint-frames":
+                checkpoint_frames = int(argv[i + 1])
+            elif argv[i] == "--skeleton":
+                skeleton = get_skeleton(argv[i + 1])
+            elif argv[i] == "--file-list":
+                #Text file with one .fbx name per line: only these actions (default: every file in SRC_DATA_DIR)
+                with open(argv[i + 1]) as f:
+                    anim_files = [line.strip() for line in f if line.strip()]
                
-
-    #Number of joints to be used from MixamoRig
-    joint_names = ['mixamorig'+ joint_id +':' + x for x in BASE_JOINT_NAMES]
     
     OUT_DATA_DIR = f"../../BlendMimic3D/{subject}/Occlusions"
     
-    # List of camera names
-    camera_names = ['Camera_0', 'Camera_1', 'Camera_2', 'Camera_3'] #Same order as H3.6M dataset 
+    # Cameras in natural name order (Camera_0, Camera_1, ... matches the H3.6M order)
+    cameras = find_cameras(camera_pattern, camera_collection)
    
     # Replace 'Armature' with the actual name of your armature object
     armature = bpy.data.objects[armature_name]
     keypoints = armature.pose.bones
-    bone_struct = bpy.data.objects[armature_name].pose.bones
+    
+    #Rig bones of the skeleton's joints, resolved to pose-bone indices once by the sampler
+    adapter = BlenderArmatureAdapter(armature)
+    joint_names = skeleton.bone_names(joint_id, adapter.bone_names())
     
   
     #Get animation(.fbx) file paths
-    anims_path = os.listdir(SRC_DATA_DIR)
+    anims_path = os.listdir(SRC_DATA_DIR) if anim_files is None else anim_files
     
     #Make OUT_DATA_DIR
     if not os.path.exists(OUT_DATA_DIR):
         os.makedirs(OUT_DATA_DIR)
     
-    cam_idx = 0
+    #Skip actions whose .blend, cameras, joints and script are unchanged since the last run
+    cache = StageCache(os.path.join(bpy.path.abspath("//"), OUT_DATA_DIR, '.manifest_occlusion.json'), 'occlusion', force=force)
+    scene_key = dict(blend=cache.file_digest(bpy.data.filepath), joints=joint_names, armature=armature_name,
+                     skeleton=skeleton.name, cameras=[camera_signature(cam) for cam in cameras],
+                     resolution=[bpy.context.scene.render.resolution_x, bpy.context.scene.render.resolution_y,
+                                 bpy.context.scene.render.resolution_percentage],
+                     backend=backend, fmt=fmt, visibility=visibility_fmt,
+                     script=cache.code_digest(__file__, projection.__file__, bvh_occlusion.__file__, camera_arrays.__file__,
+                                              visibility_codec.__file__))
+    output_writer = OutputWriter(write_workers, write_queue)
+    
+    #Projection matrices of all cameras (same K/RT camParams.py exports) for the batched in-view test
+    _, _, P = get_camera_matrices(cameras)
+    render = bpy.context.scene.render
+    scale = render.resolution_percentage / 100
+    resolution = (scale * render.resolution_x, scale * render.resolution_y)
+    
+    cam_locations = camera_locations(cameras)
+    
+    #Moving cameras: P and ray origins are re-read after every frame_set (static rigs skip this)
+    animated_cameras = any(is_animated(cam) for cam in cameras)
+    
+    sampler = BoneSampler(adapter, joint_names)
     
     for anim_name in anims_path:
-        # Replace 'start_frame' and 'end_frame' with the range of frames you want to process
         # Find the action and assign it to the armature's active action
         print(anim_name.split('.')[0])
         action = bpy.data.actions.get(anim_name.split('.')[0])
         if action:
             armature.animation_data.action = action
-            start_frame = int(action.frame_range[0])
-            end_frame = int(action.frame_range[1])
+            # Frames of the action's range kept by --start/--end/--stride/--random
+            frames = selection.frames(action.frame_range[0], action.frame_range[1])
         else:
             print("No action found.")
+            continue
+        if len(frames) == 0:
+            print("No frames selected, skipping", anim_name.split('.')[0])
+            continue
                 
         
         save_dir = os.path.join(OUT_DATA_DIR,anim_name.split('.')[0])
@@ -137,84 +397,37 @@ if __name__ == '__main__':
         if not os.path.exists(save_dir):
             os.makedirs(save_dir)
         
-        # Create a dictionary to store 'prob' vectors for each camera
-        occlusions_dict = {}
+        PROFILER.set_clip(anim_name.split('.')[0])
+        clip_key = cache.key(action=anim_name.split('.')[0], frames=frames, **scene_key)
+        if cache.is_current(anim_name.split('.')[0], clip_key):
+            print("Up to date:", anim_name.split('.')[0])
+            continue
         
-        for cam_name in camera_names:
-            print("--------------------------------------------\n")
-            print(cam_name)
-            cam = bpy.data.objects.get(cam_name)
-            prob = np.ones(( end_frame-start_frame+1 , 17))
-            print(start_frame)
-            for frame in range(start_frame, end_frame + 1):
-                # Set the current frame
-                bpy.context.scene.frame_set(frame)
-
-                occluded_keypoints = []
-                out_of_view_keypoints = []
-                all_occlusions = []
-                
-                # Iterate over the keypoints (bones) of the armature
-                for idx, name in enumerate(joint_names):
-                    keypoint = armature.pose.bones[name]
-                    global_location = armature.matrix_world @ bone_struct[name].matrix @ Vector((0, 0, 0))
-                    
-                    # Check if the keypoint is out of the viewport
-                    if is_keypoint_out_of_view(keypoint, global_location, cam):
-                        out_of_view_keypoints.append(keypoint.name)
-                        all_occlusions.append(keypoint.name)
-                        prob[frame-start_frame][idx] = 0
-                        
-                    elif is_occluded(keypoint, global_location, cam):
-                        # Keypoint is occluded
-                        occluded_keypoints.append(keypoint.name)
-                        all_occlusions.append(keypoint.name)
-                        prob[frame-start_frame][idx] = 0
-                    
-                   
-                #if occluded_keypoints:
-                    #print("Occluded keypoints in frame", frame)
-                    #for keypoint_name in occluded_keypoints:
-                        #print(keypoint_name)
-                #else:
-                    #print("No occluded keypoints in frame", frame)
-
-                #if out_of_view_keypoints:
-                    #print("Out-of-view keypoints:")
-                    #for keypoint_name in out_of_view_keypoints:
-                        #print(keypoint_name)
-                #else:
-                    #print("All keypoints are within the camera's viewport.")
-                '''
-                if occluded_keypoints or out_of_view_keypoints:
-                    print("\n")
-                    print("Camera", cam_name)
-                    print("Frame", frame)
-                    print("List of non visible keypoints: ")
-                    for keypoint_name in all_occlusions:
-                        print(keypoint_name)
-                    print("---------------------------------------")
-                    #exit(0)
-                '''
-            # Save 'prob' vector for this camera to a separate NPZ file
-            print("Frame", frame)
-            ''' # Get the absolute path of the script location
-            script_path = bpy.path.abspath("//")
-            # Create the directory to save the NPZ file if it does not exist
-            save_path = os.path.join(script_path, save_dir)
-            os.makedirs(save_path, exist_ok=True)
-                        
-            np.savez_compressed(os.path.join(save_path, f"occluded_kpt_Camera_{cam_idx}.npz"), prob=prob)'''
-                   
-            # Store the 2D positions in the dictionary with camera name as the key
-            occlusions_dict[f'Camera_{cam_idx}'] = prob 
-            cam_idx = cam_idx+1
+        # Get the absolute path of the script location
+        script_path = bpy.path.abspath("//")
+        save_path = os.path.join(script_path, save_dir)
+        n_frames = len(frames)
+        
+        # Finished chunks survive a crash; a rerun with the same key resumes after the last one
+        checkpoint = None
+        if checkpoint_frames > 0:
+            checkpoint = FrameCheckpoint(os.path.join(save_path, 'occluded_kpt.partial'), n_frames, clip_key, checkpoint_frames)
+        
+        # Each frame is set and evaluated once; all cameras x joints are then tested against it
+        prob, positions, _, timings = walk_clip(frames, cameras, sampler, joint_names, keypoints,
+                                                resolution, backend, P, cam_locations, animated_cameras, checkpoint)
+        
+        print("Timing %s (%d frames, %s): " % (anim_name.split('.')[0], n_frames, backend)
+              + ", ".join("%s %.2fs" % (phase, seconds) for phase, seconds in timings.items()))
                
-    # Save 2D positions to another NPZ file
-    # Get the absolute path of the script location
-    script_path = bpy.path.abspath("//")
-    # Create the directory to save the NPZ file if it does not exist
-    save_path = os.path.join(script_path, save_dir)
-    os.makedirs(save_path, exist_ok=True)
-    np.savez_compressed(os.path.join(save_path, "occluded_kpt.npz"), Cam_0=occlusions_dict['Camera_0'],  Cam_1=occlusions_dict['Camera_1'],  Cam_2=occlusions_dict['Camera_2'],  Cam_3=occlusions_dict['Camera_3'])
-    
\ No newline at end of file
+        # Save the occlusions of this action to its own NPZ file
+        # Create the directory to save the NPZ file if it does not exist
+        os.makedirs(save_path, exist_ok=True)
+        # Written in the background while the next action is walked; recorded once on disk
+        with PROFILER.phase('save'):
+            output_writer.submit(anim_name.split('.')[0], save_clip_occlusion, save_path, prob, frames, fmt,
+                                 visibility_fmt, on_done=partial(clip_saved, cache, anim_name.split('.')[0], clip_key, checkpoint))
+    
+    output_writer.close()
+    cache.summary()
+    PROFILER.finish()
@@ -0,0 +1,151 @@
+import time
+import queue
+import atexit
+import threading
+import traceback
+
+from profiler import PROFILER, files_size
+
+#Background threads that compress and write outputs (0 writes on the calling thread, as before)
+DEFAULT_WRITE_WORKERS = 2
+
+#Jobs that may wait for a free writer thread before submit() blocks
+DEFAULT_WRITE_QUEUE = 4
+
+
+class _WriteJob:
+
+    def __init__(self, name, fn, args, kwargs, on_done):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.result = None
+        self.error = None
+        self.traceback = None
+        self.seconds = 0.0
+        self.done = threading.Event()
+
+    def run(self):
+        start = time.perf_counter()
+        try:
+            self.result = self.fn(*self.args, **self.kwargs)
+        except Exception as error:
+            self.error = error
+            self.traceback = traceback.format_exc()
+        self.seconds = time.perf_counter() - start
+        #Drop the arrays as soon as they are on disk
+        self.args = self.kwargs = None
+        self.done.set()
+
+
+# Writes stage outputs on background threads while the caller moves on to the next clip.
+#
+# submit(name, fn, *args, **kwargs) queues fn(*args, **kwargs), a save function
+# that returns the files it wrote. At most `max_pending` jobs wait for a thread;
+# past that submit() blocks until one is picked up, so slow disks hold back the
+# scene walk instead of piling up arrays in memory. `on_done(result)` runs on
+# the calling thread, in submission order, from a later submit(), poll() or
+# flush(), so stage caches only record clips whose files are on disk. A failed
+# job skips its on_done; flush() waits for everything and raises a RuntimeError
+# listing the failures. Pending jobs are also flushed at interpreter exit.
+class OutputWriter:
+
+    def __init__(self, workers=DEFAULT_WRITE_WORKERS, max_pending=DEFAULT_WRITE_QUEUE):
+        self.workers = max(0, int(workers))
+        self.queue = queue.Queue(maxsize=max(1, int(max_pending)))
+        self.pending = []
+        self.failed = []
+        self.jobs = 0
+        self.write_s = 0.0
+        self.wait_s = 0.0
+        self.threads = [threading.Thread(target=self._drain, name='output-writer-%d' % i, daemon=True)
+                        for i in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        atexit.register(self._close_at_exit)
+
+    def _drain(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.run()
+
+    def submit(self, name, fn, *args, on_done=None, **kwargs):
+        job = _WriteJob(name, fn, args, kwargs, on_done)
+        self.pending.append(job)
+        self.jobs += 1
+        if not self.threads:
+            job.run()
+        else:
+            start = time.perf_counter()
+            #Blocks while `max_pending` jobs are already waiting
+            self.queue.put(job)
+            self.wait_s += time.perf_counter() - start
+        self.poll()
+        return job
+
+    # Run the callbacks of the jobs finished so far (in submission order)
+    def poll(self):
+        while self.pending and self.pending[0].done.is_set():
+            self._complete(self.pending.pop(0))
+
+    def _complete(self, job):
+        self.write_s += job.seconds
+        if PROFILER.enabled:
+            written = job.result if isinstance(job.result, list) else []
+            PROFILER.add('write', job.seconds, nbytes=files_size(written), clip=job.name)
+        if job.error is not None:
+            self.failed.append(job)
+            print('Write failed for %s: %r' % (job.name, job.error))
+        elif job.on_done is not None:
+            job.on_done(job.result)
+
+    # Barrier: wait for every submitted job; raises if any of them failed
+    def flush(self):
+        start = time.perf_counter()
+        for job in list(self.pending):
+            job.done.wait()
+        self.wait_s += time.perf_counter() - start
+        self.poll()
+        if self.failed:
+            failed, self.failed = self.failed, []
+            for job in failed:
+                print(job.traceback)
+            raise RuntimeError('%d output write(s) failed: %s' % (len(failed), ', '.join(job.name for job in failed)))
+
+    # Flush, stop the threads and print the totals
+    def close(self):
+        atexit.unregister(self._close_at_exit)
+        try:
+            self.flush()
+        finally:
+            for _ in self.threads:
+                self.queue.put(None)
+            for thread in self.threads:
+                thread.join()
+            self.threads = []
+            self.summary()
+
+    def _close_at_exit(self):
+        try:
+            self.close()
+        except RuntimeError as error:
+            print(error)
+
+    def summary(self):
+        print('[writer] %d job(s) on %d thread(s): %.2fs writing, %.2fs waited for the writers'
+              % (self.jobs, self.workers, self.write_s, self.wait_s))
+
+
+# Remove `--write-workers N` and `--write-queue N` from argv; returns (workers, max_pending, argv)
+def parse_writer_args(argv):
+    options = {'--write-workers': DEFAULT_WRITE_WORKERS, '--write-queue': DEFAULT_WRITE_QUEUE}
+    for flag in options:
+        if flag in argv:
+            pos = argv.index(flag)
+            options[flag] = int(argv[pos + 1])
+            del argv[pos:pos + 2]
+    return options['--write-workers'], options['--write-queue'], argv
@@ -0,0 +1,211 @@
+# Pack the per-action outputs of every subject into VideoPose3D-style archives
+#
+# Usage (plain Python, not inside Blender):
+#   python pack_dataset.py [--root ../../BlendMimic3D] [--subjects S1 S5] [--workers 8] [--append]
+#
+# Writes to <root>/packed (or --output-dir):
+#   data_3d_<name>.npz      positions_3d[subject][action] -> (F, J, 3)
+#   data_2d_<name>_gt.npz   positions_2d[subject][action][cam] -> (F, J, 2), plus metadata
+#                           (layout_name, num_joints, keypoints_symmetry)
+#   cameras_<name>.json     per-subject camera names, K, RT and the camParams.py
+#                           intrinsic/extrinsic dicts
+# Actions are loaded and converted by worker processes into float32 .npy parts
+# under <output-dir>/.parts; the archives are then written in one streaming pass
+# that loads one part at a time, so peak memory is about one action. Parts of
+# actions whose outputs are unchanged are reused, and `--append` keeps the
+# subjects packed by earlier runs, so adding a subject only converts that subject.
+import os
+import sys
+import json
+import pickle
+import zipfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(SCRIPT_DIR)
+from stage_cache import StageCache
+from dataset_store import output_digests
+from sequence_loader import Clip, clip_paths, output_exists
+import sequence_loader
+import projection_view
+from skeletons import SKELETON_FILE, DEFAULT_SKELETON, Skeleton, get_skeleton
+
+PARTS_DIR = '.parts'
+
+
+# A packed part on disk that pickles as the array it holds (camera `camera` of a 2D part)
+#
+# The archive pickler meets these instead of arrays: each part is read only
+# while it is being written and released right after.
+class _Part:
+
+    def __init__(self, path, camera=None):
+        self.path = path
+        self.camera = camera
+
+    def __reduce__(self):
+        array = np.load(self.path, mmap_mode='r')
+        if self.camera is not None:
+            array = array[self.camera]
+        return np.ascontiguousarray(array).__reduce__()
+
+
+# Stream `value` into <archive>.npz as the object array `name`, as np.savez(..., name=value) would
+#
+# Memoization is off, so the bytes of parts already written are not kept alive.
+def write_object_archive(path, name, value, **arrays):
+    tmp_path = path + '.tmp'
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+            np.lib.format.write_array_header_2_0(f, {'descr': '|O', 'fortran_order': False, 'shape': ()})
+            holder = np.empty((), dtype=object)
+            holder[()] = value
+            pickler = pickle.Pickler(f, protocol=4)
+            pickler.fast = True
+            pickler.dump(holder)
+        for key, array in arrays.items():
+            with zf.open(key + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Worker: load one action's aligned 3D/2D outputs and save them as float32 parts
+def convert_clip(subject, action, paths, subject_dir, parts_dir):
+    arrays = Clip(subject, action, paths, subject_dir).load(np.float32)
+    out_dir = os.path.join(parts_dir, subject)
+    os.makedirs(out_dir, exist_ok=True)
+    written = []
+    for kind, key in (('3d', 'positions_3d'), ('2d', 'positions_2d')):
+        path = os.path.join(out_dir, '%s_%s.npy' % (action, kind))
+        np.save(path + '.tmp.npy', arrays[key])
+        os.replace(path + '.tmp.npy', path)
+        written.append(path)
+    return written
+
+
+# Skeleton of the packed 3D outputs (skeleton.json of the first action that has one)
+def find_skeleton(root, subjects):
+    for subject in subjects:
+        d3_dir = os.path.join(root, subject, 'D3_Positions')
+        for action in sorted(os.listdir(d3_dir)) if os.path.isdir(d3_dir) else []:
+            path = os.path.join(d3_dir, action, SKELETON_FILE)
+            if os.path.exists(path):
+                with open(path) as f:
+                    spec = json.load(f)
+                return Skeleton(spec['name'], spec['joints'], spec['bones'], spec['parents'])
+    return get_skeleton(DEFAULT_SKELETON)
+
+
+# Camera metadata of one subject: matrices_<subject>.npz and camera_params_<subject>.npz (camParams.py)
+def subject_cameras(camera_dirs):
+    cameras = {}
+    for camera_dir in camera_dirs:
+        subject = os.path.basename(os.path.dirname(os.path.normpath(camera_dir)))
+        matrices = os.path.join(camera_dir, f'matrices_{subject}.npz')
+        if os.path.exists(matrices) and 'K' not in cameras:
+            data = np.load(matrices, allow_pickle=False)
+            cameras.update(camera_names=data['camera_names'].tolist(), K=data['K'].tolist(), RT=data['RT'].tolist())
+        params = os.path.join(camera_dir, f'camera_params_{subject}.npz')
+        if os.path.exists(params) and 'intrinsic' not in cameras:
+            #Written by our own camParams.py (lists of dicts, hence the pickle)
+            data = np.load(params, allow_pickle=True)
+            cameras['intrinsic'] = data['intrinsic_params'].tolist()
+            cameras['extrinsic'] = data['extrinsic_params'].item().get(subject)
+    return cameras
+
+
+def _json_default(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--root', default=os.path.join(SCRIPT_DIR, '../../BlendMimic3D'))
+    parser.add_argument('--subjects', nargs='+', default=None, help='subjects to (re)convert; all by default')
+    parser.add_argument('--output-dir', default=None, help='default: <root>/packed')
+    parser.add_argument('--name', default='blendmimic3d', help='archive suffix: data_3d_<name>.npz, ...')
+    parser.add_argument('--cameras-root', default=None,
+                        help='extra directory with <subject>/Cameras (camParams.py writes to ../H3.6M_synthetic)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--append', action='store_true', help='keep subjects packed by earlier runs')
+    parser.add_argument('--derive-2d', action='store_true', help='project 2D from 3D even where D2_Positions exists')
+    parser.add_argument('--force', action='store_true')
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    out_dir = os.path.abspath(args.output_dir or os.path.join(root, 'packed'))
+    parts_dir = os.path.join(out_dir, PARTS_DIR)
+    subjects = args.subjects or sorted(name for name in os.listdir(root)
+                                       if os.path.isdir(os.path.join(root, name, 'D3_Positions')))
+
+    cache = StageCache(os.path.join(parts_dir, '.manifest_pack.json'), 'pack', force=args.force)
+    #Without --append only the actions scanned now end up in the archives
+    packed = set(cache.manifest['clips']) if args.append else set()
+    script = cache.code_digest(__file__, sequence_loader.__file__, projection_view.__file__)
+
+    jobs = []
+    for subject in subjects:
+        subject_dir = os.path.join(root, subject)
+        d3_dir = os.path.join(subject_dir, 'D3_Positions')
+        matrices = os.path.join(subject_dir, 'Cameras', f'matrices_{subject}.npz')
+        for action in sorted(os.listdir(d3_dir)):
+            if not os.path.isdir(os.path.join(d3_dir, action)):
+                continue
+            paths = clip_paths(subject_dir, action)
+            del paths['occlusion']
+            if os.path.exists(matrices) and (args.derive_2d or not output_exists(paths['2d'])):
+                del paths['2d']
+            inputs = [paths[source] for source in sorted(paths)] + ([] if '2d' in paths else [matrices])
+            if not all(output_exists(path) for path in inputs):
+                print('Skipping %s/%s: missing outputs' % (subject, action))
+                continue
+            key = cache.key(inputs=[output_digests(cache, path) for path in inputs], script=script)
+            name = '%s/%s' % (subject, action)
+            packed.add(name)
+            if cache.is_current(name, key):
+                continue
+            jobs.append((name, key, (subject, action, paths, subject_dir, parts_dir)))
+
+    print('%d action(s) to convert over %d worker(s)' % (len(jobs), args.workers))
+    if jobs:
+        with ProcessPoolExecutor(max_workers=max(1, args.workers)) as pool:
+            futures = [(name, key, pool.submit(convert_clip, *job)) for name, key, job in jobs]
+            for name, key, future in futures:
+                cache.record(name, key, future.result())
+                print('Converted', name)
+    cache.summary()
+
+    # One streaming pass: the nested dicts hold _Part placeholders, loaded as they are pickled
+    positions_3d, positions_2d = {}, {}
+    n_joints = None
+    for name in sorted(packed):
+        subject, action = name.split('/', 1)
+        path_3d, path_2d = cache.manifest['clips'][name]['outputs']
+        if not (os.path.exists(path_3d) and os.path.exists(path_2d)):
+            print('Missing parts, not packed:', name)
+            continue
+        n_cameras = np.load(path_2d, mmap_mode='r').shape[0]
+        n_joints = np.load(path_3d, mmap_mode='r').shape[1]
+        positions_3d.setdefault(subject, {})[action] = _Part(path_3d)
+        positions_2d.setdefault(subject, {})[action] = [_Part(path_2d, c) for c in range(n_cameras)]
+
+    skeleton = find_skeleton(root, sorted(positions_3d))
+    metadata = {'layout_name': skeleton.name, 'num_joints': n_joints,
+                'keypoints_symmetry': [list(side) for side in skeleton.symmetry()]}
+    write_object_archive(os.path.join(out_dir, f'data_3d_{args.name}.npz'), 'positions_3d', positions_3d)
+    write_object_archive(os.path.join(out_dir, f'data_2d_{args.name}_gt.npz'), 'positions_2d', positions_2d,
+                         metadata=np.array(metadata, dtype=object))
+
+    cameras = {}
+    for subject in sorted(positions_3d):
+        camera_dirs = [os.path.join(root, subject, 'Cameras')]
+        if args.cameras_root:
+            camera_dirs.append(os.path.join(args.cameras_root, subject, 'Cameras'))
+        cameras[subject] = subject_cameras(camera_dirs)
+    with open(os.path.join(out_dir, f'cameras_{args.name}.json'), 'w') as f:
+        json.dump(cameras, f, indent=1, default=_json_default)
+
+    print('Packed %d subject(s), %d action(s) into %s' % (len(positions_3d), len(packed), out_dir))
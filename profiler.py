@@ -0,0 +1,192 @@
+import os
+import sys
+import csv
+import json
+import time
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+#Columns of the CSV trace and the summary table
+FIELDS = ('phase', 'clip', 'camera', 'calls', 'wall_s', 'cpu_s', 'bytes', 'items')
+
+
+# Total size of files (or store directories, walked) that exist among `paths`
+def files_size(paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            total += sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+# No-op phase handed out while profiling is disabled (one shared instance, no clock reads)
+class _NullPhase:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def add_files(self, paths):
+        pass
+
+    def add_items(self, n):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+
+    def __init__(self, profiler, key):
+        self.profiler = profiler
+        self.key = key
+        self.bytes = 0
+        self.items = 0
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._add(self.key, time.perf_counter() - self.wall, time.process_time() - self.cpu,
+                           self.bytes, self.items)
+        return False
+
+    # Count the size of files (or store directories) written inside the phase
+    def add_files(self, paths):
+        self.bytes += files_size(paths)
+
+    # Count work items (rays, frames, joints...) done inside the phase
+    def add_items(self, n):
+        self.items += int(n)
+
+
+# Opt-in per-phase timing for the extraction scripts.
+#
+# `with PROFILER.phase('frame_set', clip=name):` accumulates wall time, CPU time
+# and call count per (phase, clip, camera), plus any bytes/items the block adds.
+# While disabled, phase() returns a shared no-op object, so instrumented code
+# costs one attribute check per call. finish() prints a summary table and
+# writes the trace as JSON or CSV (by extension).
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.trace_path = None
+        self.clip = None
+        self.records = {}
+
+    def enable(self, trace_path=None):
+        self.enabled = True
+        self.trace_path = trace_path
+        self.started = time.perf_counter()
+
+    # Clip that phases are attributed to when they don't name one
+    def set_clip(self, clip):
+        self.clip = clip
+
+    def phase(self, name, clip=None, camera=None):
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, (name, self.clip if clip is None else clip, camera))
+
+    # Add a measurement taken elsewhere (e.g. a loop's own timers) without a `with` block
+    def add(self, name, wall, cpu=0.0, calls=1, nbytes=0, items=0, clip=None, camera=None):
+        if self.enabled:
+            self._add((name, self.clip if clip is None else clip, camera), wall, cpu, nbytes, items, calls)
+
+    def _add(self, key, wall, cpu, nbytes, items, calls=1):
+        record = self.records.get(key)
+        if record is None:
+            record = self.records[key] = [0, 0.0, 0.0, 0, 0]
+        record[0] += calls
+        record[1] += wall
+        record[2] += cpu
+        #NumPy counts (e.g. mask.sum()) are stored as plain ints so the trace stays JSON-serializable
+        record[3] += int(nbytes)
+        record[4] += int(items)
+
+    def rows(self):
+        return [dict(zip(FIELDS, (name, clip, camera, *record)))
+                for (name, clip, camera), record in self.records.items()]
+
+    # Per-phase totals over all clips and cameras, slowest first
+    def summary(self):
+        totals = {}
+        for row in self.rows():
+            total = totals.setdefault(row['phase'], dict(row, clip=None, camera=None, calls=0, wall_s=0.0,
+                                                         cpu_s=0.0, bytes=0, items=0))
+            for field in ('calls', 'wall_s', 'cpu_s', 'bytes', 'items'):
+                total[field] += row[field]
+        return sorted(totals.values(), key=lambda row: -row['wall_s'])
+
+    def print_summary(self, file=None):
+        file = file or sys.stdout
+        rows = self.summary()
+        elapsed = time.perf_counter() - self.started
+        print('%-20s %8s %10s %10s %6s %12s %10s' % ('phase', 'calls', 'wall (s)', 'cpu (s)', 'wall%', 'bytes', 'items'),
+              file=file)
+        for row in rows:
+            print('%-20s %8d %10.3f %10.3f %5.1f%% %12d %10d'
+                  % (row['phase'], row['calls'], row['wall_s'], row['cpu_s'], 100 * row['wall_s'] / max(elapsed, 1e-12),
+                     row['bytes'], row['items']), file=file)
+        print('%-20s %8s %10.3f' % ('(run)', '', elapsed), file=file)
+
+    def write_trace(self, path):
+        rows = self.rows()
+        if path.endswith('.csv'):
+            with open(path, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(rows)
+        else:
+            with open(path, 'w') as f:
+                json.dump({'elapsed_s': time.perf_counter() - self.started, 'phases': rows}, f, indent=1)
+
+    # End of run: summary table, and the trace file if one was asked for
+    def finish(self):
+        if not self.enabled:
+            return
+        self.print_summary()
+        if self.trace_path:
+            self.write_trace(self.trace_path)
+            print('Profile trace written to', self.trace_path)
+
+
+PROFILER = Profiler()
+
+
+# Current resident memory of this process in MB, or None where it can't be read
+#
+# Uses psutil when installed, else /proc/self/statm (Linux).
+def resident_memory_mb():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 2**20
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Remove `--profile [trace.json|trace.csv]` from argv and enable PROFILER if present; returns argv
+def parse_profile_args(argv):
+    if '--profile' not in argv:
+        return argv
+    pos = argv.index('--profile')
+    trace_path = None
+    if pos + 1 < len(argv) and argv[pos + 1].endswith(('.json', '.csv')):
+        trace_path = argv[pos + 1]
+        del argv[pos + 1]
+    del argv[pos]
+    PROFILER.enable(trace_path)
+    return argv
@@ -0,0 +1,99 @@
+import numpy as np
+
+#Upper bound on the number of frames projected in one pass (keeps the (C, chunk, J, 3) temporaries small)
+DEFAULT_CHUNK_FRAMES = 4096
+
+
+# Stack per-camera K (3x3) and RT (3x4) into projection matrices P = K @ RT of shape (C, 3, 4)
+def stack_projection_matrices(K_list, RT_list):
+    K = np.asarray(K_list, dtype=np.float64).reshape(-1, 3, 3)
+    RT = np.asarray(RT_list, dtype=np.float64).reshape(-1, 3, 4)
+    if K.shape[0] != RT.shape[0]:
+        raise ValueError('Got %d intrinsic but %d extrinsic matrices' % (K.shape[0], RT.shape[0]))
+    return K @ RT
+
+
+def _n_cameras(P):
+    return P.n_cameras if hasattr(P, 'window') else P.shape[0]
+
+
+def _check_positions(positions_3d):
+    positions_3d = np.asarray(positions_3d, dtype=np.float64)
+    if positions_3d.ndim != 3 or positions_3d.shape[2] != 3:
+        raise ValueError('positions_3d must have shape (F, J, 3), got %s' % (positions_3d.shape,))
+    return positions_3d
+
+
+# Static (C, 3, 4) projection matrices as an array, per-frame ones as (C, F, 3, 4) or CameraRuns
+def _check_matrices(P):
+    if hasattr(P, 'window'):
+        return P.values[P.offsets[:-1]] if P.static else P
+    P = np.asarray(P, dtype=np.float64)
+    return P.reshape(-1, 3, 4) if P.ndim < 4 else P
+
+
+# Yield (start, stop, proj_homo) per frame chunk, proj_homo = P @ [X; 1] with shape (C, chunk, J, 3)
+#
+# Instead of building homogeneous coordinates, the 3x4 P is split into its
+# 3x3 linear part and translation column, so each chunk is a single einsum.
+# Per-frame matrices (animated cameras) are sliced, or decoded from their runs,
+# one chunk at a time; `track_rows` maps each position frame to its track frame.
+def _projected_chunks(positions_3d, P, chunk_frames, track_rows=None):
+    chunk_frames = max(1, int(chunk_frames))
+    for start in range(0, positions_3d.shape[0], chunk_frames):
+        stop = min(start + chunk_frames, positions_3d.shape[0])
+        if isinstance(P, np.ndarray) and P.ndim == 3:
+            proj_homo = np.einsum('cij,fkj->cfki', P[:, :, :3], positions_3d[start:stop], optimize=True)
+            proj_homo += P[:, None, None, :, 3]
+        else:
+            if track_rows is not None:
+                P_chunk = P.take(track_rows[start:stop])
+            else:
+                P_chunk = P.window(start, stop) if hasattr(P, 'window') else P[:, start:stop]
+            proj_homo = np.einsum('cfij,fkj->cfki', P_chunk[..., :3], positions_3d[start:stop], optimize=True)
+            proj_homo += P_chunk[:, :, None, :, 3]
+        yield start, stop, proj_homo
+
+
+# Project (F, J, 3) world positions with P matrices -> (C, F, J, 2) pixel positions
+#
+# P is (C, 3, 4) for fixed cameras, or per frame as a (C, F, 3, 4) array or
+# camera_arrays.CameraRuns. With `track_rows` (F,) frame f is projected with
+# track frame track_rows[f] of the runs, decoded one chunk at a time. Frames
+# are processed in chunks of `chunk_frames` to bound peak memory.
+def project_points(positions_3d, P, chunk_frames=DEFAULT_CHUNK_FRAMES, out=None, track_rows=None):
+    positions_3d = _check_positions(positions_3d)
+    P = _check_matrices(P)
+    if track_rows is not None and len(track_rows) != positions_3d.shape[0]:
+        raise ValueError('Got %d track rows for %d frames' % (len(track_rows), positions_3d.shape[0]))
+    if out is None:
+        out = np.empty((_n_cameras(P),) + positions_3d.shape[:2] + (2,), dtype=np.float64)
+
+    for start, stop, proj_homo in _projected_chunks(positions_3d, P, chunk_frames, track_rows):
+        np.divide(proj_homo[..., :2], proj_homo[..., 2:3], out=out[:, start:stop])
+
+    return out
+
+
+# (C, F, J) bool mask of joints inside each camera's view, from P = K @ RT and the render size
+#
+# Same test as bpy_extras.object_utils.world_to_camera_view per joint:
+# 0 <= x <= 1, 0 <= y <= 1 in normalized view coordinates and depth z > 0.
+# With the computer-vision RT from camParams the third homogeneous coordinate
+# is that depth, and the normalized view box is [0, res_x] x [0, res_y] in pixels
+# (y flipped, which does not change the bounds check).
+def in_view_mask(positions_3d, P, resolution, chunk_frames=DEFAULT_CHUNK_FRAMES, out=None):
+    positions_3d = _check_positions(positions_3d)
+    P = _check_matrices(P)
+    res_x, res_y = resolution
+    if out is None:
+        out = np.empty((_n_cameras(P),) + positions_3d.shape[:2], dtype=bool)
+
+    for start, stop, proj_homo in _projected_chunks(positions_3d, P, chunk_frames):
+        z = proj_homo[..., 2]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            u = proj_homo[..., 0] / z
+            v = proj_homo[..., 1] / z
+        out[:, start:stop] = (z > 0) & (u >= 0) & (u <= res_x) & (v >= 0) & (v <= res_y)
+
+    return out
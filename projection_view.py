@@ -0,0 +1,125 @@
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+from projection import stack_projection_matrices, project_points
+from camera_arrays import CameraRuns
+from dataset_store import open_output
+from frame_selection import load_frames
+
+#Frames projected (and cached) together
+DEFAULT_BLOCK_FRAMES = 1024
+
+#Projected blocks kept per view, in bytes
+DEFAULT_CACHE_BYTES = 256 * 2**20
+
+
+# Projection matrices of a subject's cameras (matrices_{subject}.npz from camParams.py)
+#
+# Fixed cameras give (C, 3, 4); moving cameras (camParams.py --animated) give
+# their CameraRuns plus the track row of every entry of `frames` (scene frame
+# numbers), so the per-frame P can be decoded one block at a time.
+def load_camera_projection(matrices_path, frames=None):
+    cam_params = np.load(matrices_path, allow_pickle=False)
+    P_runs = CameraRuns.from_arrays(cam_params, 'P')
+    if P_runs is None:
+        return stack_projection_matrices(cam_params['K'], cam_params['RT']), None
+    if P_runs.static:
+        return P_runs.values[P_runs.offsets[:-1]], None
+    if frames is None:
+        raise ValueError('%s has animated cameras: the scene frames to project are needed' % matrices_path)
+    # Track frame 0 is the scene's frame_start
+    return P_runs, np.asarray(frames, dtype=np.int64) - int(cam_params['track_frame_start'])
+
+
+# 2D keypoints of a clip computed on read from its 3D positions and the camera matrices.
+#
+# Reads like the 2D_positions outputs (view['Cam_0'] is (F, J, 2)) and adds
+# window(camera, start, stop). Frames are projected for all cameras in blocks
+# of `block_frames`; projected blocks are memoized and the least recently used
+# ones evicted once they pass `cache_bytes`. `positions_3d` may be a memmap
+# (store outputs), in which case only the frames a block needs are read.
+class ProjectionView:
+
+    def __init__(self, positions_3d, P, track_rows=None, block_frames=DEFAULT_BLOCK_FRAMES,
+                 cache_bytes=DEFAULT_CACHE_BYTES):
+        self.positions_3d = positions_3d
+        self.P = P
+        self.track_rows = track_rows
+        self.block_frames = max(1, int(block_frames))
+        self.cache_bytes = int(cache_bytes)
+        self.cached_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def n_cameras(self):
+        return self.P.n_cameras if self.track_rows is not None else len(self.P)
+
+    @property
+    def n_frames(self):
+        return len(self.positions_3d)
+
+    def keys(self):
+        return ['Cam_%d' % c for c in range(self.n_cameras)]
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    # (C, B, J, 2) projection of block b
+    def _block(self, b):
+        with self._lock:
+            if b in self._blocks:
+                self._blocks.move_to_end(b)
+                self.hits += 1
+                return self._blocks[b]
+            self.misses += 1
+        start, stop = b * self.block_frames, min((b + 1) * self.block_frames, self.n_frames)
+        track_rows = None if self.track_rows is None else self.track_rows[start:stop]
+        block = project_points(self.positions_3d[start:stop], self.P, track_rows=track_rows)
+        with self._lock:
+            if b not in self._blocks:
+                self._blocks[b] = block
+                self.cached_bytes += block.nbytes
+            while self.cached_bytes > self.cache_bytes and len(self._blocks) > 1:
+                self.cached_bytes -= self._blocks.popitem(last=False)[1].nbytes
+        return block
+
+    # Frames [start, stop) of one camera -> (stop - start, J, 2)
+    def window(self, camera, start, stop):
+        start, stop, _ = slice(start, stop).indices(self.n_frames)
+        step = self.block_frames
+        parts = [self._block(b)[camera, max(start - b * step, 0):stop - b * step]
+                 for b in range(start // step, (max(start, stop - 1)) // step + 1)]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return self.window(int(name[len('Cam_'):]), 0, self.n_frames)
+
+    # Everything at once, as 2D_extraction.py materializes it -> (C, F, J, 2)
+    def materialize(self):
+        return project_points(self.positions_3d, self.P, track_rows=self.track_rows)
+
+    def __repr__(self):
+        return 'ProjectionView(%d cameras, %d frames, %d blocks cached)' % (self.n_cameras, self.n_frames,
+                                                                            len(self._blocks))
+
+
+# ProjectionView of one action of a subject directory (../../BlendMimic3D/<subject>)
+#
+# Uses the D3_Positions output (its store when present) and
+# Cameras/matrices_<subject>.npz; rows are the 3D rows, listed in frames.npy.
+def open_projection(subject_dir, action, **options):
+    subject = os.path.basename(os.path.normpath(subject_dir))
+    d3_dir = os.path.join(subject_dir, 'D3_Positions', action)
+    positions_3d = open_output(os.path.join(d3_dir, action + '.npz'))['positions_3d']
+    frames = load_frames(d3_dir)
+    if frames is None:
+        frames = np.arange(1, len(positions_3d) + 1)
+    P, track_rows = load_camera_projection(os.path.join(subject_dir, 'Cameras', f'matrices_{subject}.npz'), frames)
+    return ProjectionView(positions_3d, P, track_rows, **options)
@@ -0,0 +1,261 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from dataset_store import STORE_EXT, array_shape, open_output
+from frame_selection import load_frames
+from projection_view import open_projection
+from visibility_codec import VISIBILITY_NAME, open_visibility
+
+#Decoded clips kept in memory by default
+DEFAULT_CACHE_CLIPS = 16
+
+
+# Per-clip output paths of one subject, as the extraction stages write them
+def clip_paths(subject_dir, action):
+    return {'3d': os.path.join(subject_dir, 'D3_Positions', action, action + '.npz'),
+            '2d': os.path.join(subject_dir, 'D2_Positions', action, '2D_positions.npz'),
+            'occlusion': os.path.join(subject_dir, 'Occlusions', action, 'occluded_kpt.npz')}
+
+
+def output_exists(npz_path):
+    return os.path.exists(npz_path) or os.path.isdir(os.path.splitext(npz_path)[0] + STORE_EXT)
+
+
+# An occlusion output may be occluded_kpt.npz or the packed visibility.npz
+def source_exists(source, npz_path):
+    if source == 'occlusion' and output_exists(os.path.join(os.path.dirname(npz_path), VISIBILITY_NAME)):
+        return True
+    return output_exists(npz_path)
+
+
+def _open_source(source, npz_path):
+    if source == 'occlusion':
+        return open_visibility(os.path.dirname(npz_path))
+    return open_output(npz_path)
+
+
+# Cameras of a 2D/occlusion output: its Cam_0, Cam_1, ... keys
+def _n_cameras(data):
+    n = 0
+    while 'Cam_%d' % n in data:
+        n += 1
+    return n
+
+
+# One (subject, action) of the output tree and the rows of each output that line up.
+#
+# The stages may have run with different frame selections, so rows are matched
+# on the frame numbers in each output's frames.npy; an output without one is
+# taken to hold the same frames as the 3D positions. Without a '2d' path the
+# 2D positions are projected on read from the 3D rows (projection_view.py).
+class Clip:
+
+    def __init__(self, subject, action, paths, subject_dir=None):
+        self.subject = subject
+        self.action = action
+        self.paths = paths
+        self.subject_dir = subject_dir
+
+        self.n_cameras = None
+        frames = {}
+        for source, path in paths.items():
+            data = _open_source(source, path)
+            if source == '3d':
+                n_rows, self.n_joints = array_shape(data, 'positions_3d')[:2]
+            else:
+                self.n_cameras = _n_cameras(data)
+                n_rows = array_shape(data, 'Cam_0')[0]
+            frames[source] = load_frames(os.path.dirname(path))
+            if frames[source] is None:
+                frames[source] = np.arange(1, n_rows + 1) if source == '3d' else frames['3d'][:n_rows]
+
+        self.frames = frames['3d']
+        for source in paths:
+            self.frames = np.intersect1d(self.frames, frames[source])
+        self.rows = {source: np.searchsorted(frames[source], self.frames) for source in paths}
+        if '2d' not in paths:
+            self.rows['2d'] = self.rows['3d']
+            if self.n_cameras is None:
+                self.n_cameras = len(np.load(os.path.join(subject_dir, 'Cameras', f'matrices_{subject}.npz'))['K'])
+
+    @property
+    def n_frames(self):
+        return len(self.frames)
+
+    # Decoded, aligned arrays: positions_3d (F, J, 3), positions_2d (C, F, J, 2) and,
+    # with an 'occlusion' path, visibility (C, F, J)
+    def load(self, dtype=np.float32):
+        d3 = open_output(self.paths['3d'])
+        d2 = open_output(self.paths['2d']) if '2d' in self.paths else open_projection(self.subject_dir, self.action)
+        rows_2d = self.rows['2d']
+        arrays = {'positions_3d': np.asarray(d3['positions_3d'], dtype=dtype)[self.rows['3d']],
+                  'positions_2d': np.stack([np.asarray(d2['Cam_%d' % c], dtype=dtype)[rows_2d]
+                                            for c in range(self.n_cameras)])}
+        if 'occlusion' in self.paths:
+            occlusion = _open_source('occlusion', self.paths['occlusion'])
+            rows_occlusion = self.rows['occlusion']
+            arrays['visibility'] = np.stack([np.asarray(occlusion['Cam_%d' % c], dtype=dtype)[rows_occlusion]
+                                             for c in range(self.n_cameras)])
+        return arrays
+
+    def __repr__(self):
+        return 'Clip(%s/%s, %d frames, %d cameras)' % (self.subject, self.action, self.n_frames, self.n_cameras)
+
+
+# Every clip under `root` (the BlendMimic3D directory) with 3D and occlusion outputs
+#
+# `subjects` restricts the scan (all subject directories by default). The 2D
+# positions are read from D2_Positions when materialized, otherwise (or always
+# with `derive_2d=True`) projected from the 3D positions and the subject's
+# camera matrices. Actions missing an output are listed in the returned `skipped`.
+def index_clips(root, subjects=None, derive_2d=False):
+    if subjects is None:
+        subjects = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name, 'D3_Positions')))
+    clips, skipped = [], []
+    for subject in subjects:
+        d3_dir = os.path.join(root, subject, 'D3_Positions')
+        for action in sorted(os.listdir(d3_dir)):
+            if not os.path.isdir(os.path.join(d3_dir, action)):
+                continue
+            subject_dir = os.path.join(root, subject)
+            paths = clip_paths(subject_dir, action)
+            can_derive = os.path.exists(os.path.join(subject_dir, 'Cameras', f'matrices_{subject}.npz'))
+            if can_derive and (derive_2d or not output_exists(paths['2d'])):
+                del paths['2d']
+            if all(source_exists(source, path) for source, path in paths.items()):
+                clips.append(Clip(subject, action, paths, subject_dir))
+            else:
+                skipped.append((subject, action))
+    return clips, skipped
+
+
+# Aligned (3D, 2D, visibility) windows of `window` frames over the whole output tree.
+#
+# The tree is indexed once; sample i is one (clip, camera, start) window, read
+# from decoded clips kept in a bounded LRU cache (`cache_clips` clips), so a
+# clip's files are decoded once however many windows it serves. With
+# `pad=True` there is a window centred on every `stride`-th frame, edges
+# repeated (VideoPose3D-style receptive fields); otherwise only full windows.
+# `batches()` collates windows into contiguous (B, W, ...) arrays on background
+# threads, keeping up to `prefetch` batches ready ahead of the consumer.
+class SequenceLoader:
+
+    def __init__(self, root, window=243, subjects=None, cameras=None, stride=1, pad=True,
+                 cache_clips=DEFAULT_CACHE_CLIPS, dtype=np.float32, derive_2d=False):
+        self.window = int(window)
+        self.pad = pad
+        self.dtype = dtype
+        self.cache_clips = max(1, int(cache_clips))
+        self.clips, self.skipped = index_clips(root, subjects, derive_2d)
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+        half = self.window // 2
+        samples = []
+        for k, clip in enumerate(self.clips):
+            if pad:
+                starts = np.arange(0, clip.n_frames, stride) - half
+            else:
+                starts = np.arange(0, clip.n_frames - self.window + 1, stride)
+            for c in (range(clip.n_cameras) if cameras is None else cameras):
+                samples.append(np.stack([np.full(len(starts), k), np.full(len(starts), c), starts], axis=1))
+        #(clip, camera, start) per sample
+        self.samples = np.concatenate(samples) if samples else np.empty((0, 3), dtype=np.int64)
+
+    def __len__(self):
+        return len(self.samples)
+
+    # Decoded arrays of clip k, through the LRU cache (decoded once even with several threads asking)
+    def clip_arrays(self, k):
+        with self._lock:
+            if k in self._cache:
+                self._cache.move_to_end(k)
+                self.hits += 1
+                return self._cache[k]
+            event = self._loading.get(k)
+            if event is None:
+                event = self._loading[k] = threading.Event()
+                owner = True
+                self.misses += 1
+            else:
+                owner = False
+        if not owner:
+            event.wait()
+            return self.clip_arrays(k)
+        try:
+            arrays = self.clips[k].load(self.dtype)
+            with self._lock:
+                self._cache[k] = arrays
+                if len(self._cache) > self.cache_clips:
+                    self._cache.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._loading[k]
+            event.set()
+        return arrays
+
+    def _rows(self, k, start):
+        rows = np.arange(start, start + self.window)
+        if self.pad:
+            rows = np.clip(rows, 0, self.clips[k].n_frames - 1)
+        return rows
+
+    # Sample i: positions_3d (W, J, 3), positions_2d (W, J, 2), visibility (W, J)
+    def __getitem__(self, i):
+        k, c, start = (int(v) for v in self.samples[i])
+        arrays = self.clip_arrays(k)
+        rows = self._rows(k, start)
+        return {'positions_3d': arrays['positions_3d'][rows], 'positions_2d': arrays['positions_2d'][c, rows],
+                'visibility': arrays['visibility'][c, rows]}
+
+    # Samples `indices` as one batch of contiguous arrays, plus their (clip, camera, start)
+    def collate(self, indices):
+        n_joints = self.clips[int(self.samples[indices[0], 0])].n_joints
+        batch = {'positions_3d': np.empty((len(indices), self.window, n_joints, 3), dtype=self.dtype),
+                 'positions_2d': np.empty((len(indices), self.window, n_joints, 2), dtype=self.dtype),
+                 'visibility': np.empty((len(indices), self.window, n_joints), dtype=self.dtype)}
+        for b, i in enumerate(indices):
+            k, c, start = (int(v) for v in self.samples[i])
+            arrays = self.clip_arrays(k)
+            rows = self._rows(k, start)
+            np.take(arrays['positions_3d'], rows, axis=0, out=batch['positions_3d'][b])
+            np.take(arrays['positions_2d'][c], rows, axis=0, out=batch['positions_2d'][b])
+            np.take(arrays['visibility'][c], rows, axis=0, out=batch['visibility'][b])
+        batch['samples'] = self.samples[indices]
+        return batch
+
+    # Batches over all samples (one epoch), collated by `workers` threads
+    #
+    # With `shuffle`, clips are visited in random order and windows are shuffled
+    # within groups of clips that fit the cache, so decoded clips are reused
+    # instead of thrashing the LRU.
+    def batches(self, batch_size, shuffle=True, seed=None, workers=2, prefetch=4, drop_last=False):
+        order = np.arange(len(self.samples))
+        if shuffle:
+            rng = np.random.default_rng(seed)
+            clip_order = rng.permutation(len(self.clips))
+            groups = [clip_order[g:g + self.cache_clips] for g in range(0, len(clip_order), self.cache_clips)]
+            order = np.concatenate([rng.permutation(np.flatnonzero(np.isin(self.samples[:, 0], group)))
+                                    for group in groups]) if groups else order
+        stop = len(order) - len(order) % batch_size if drop_last else len(order)
+        chunks = [order[s:s + batch_size] for s in range(0, stop, batch_size)]
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            pending = OrderedDict()
+            next_chunk = 0
+            while pending or next_chunk < len(chunks):
+                while next_chunk < len(chunks) and len(pending) < max(1, prefetch):
+                    pending[next_chunk] = pool.submit(self.collate, chunks[next_chunk])
+                    next_chunk += 1
+                _, future = pending.popitem(last=False)
+                #result() re-raises a collation error in the consumer
+                yield future.result()
+
+    def __repr__(self):
+        return 'SequenceLoader(%d clips, %d samples, window %d)' % (len(self.clips), len(self.samples), self.window)
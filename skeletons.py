@@ -0,0 +1,163 @@
+import os
+import re
+import json
+
+#Rig bone names are '<prefix><bone>'; '{id}' in the prefix is the --joint-id of the rig
+MIXAMO_PREFIX = 'mixamorig{id}:'
+
+#Joint-name prefixes marking the side of a joint (Mixamo, SMPL and H3.6M spellings)
+SIDE_RE = {'left': re.compile(r'^(Left|left_|L(?=[A-Z]))'), 'right': re.compile(r'^(Right|right_|R(?=[A-Z]))')}
+
+#Skeleton every stage uses when --skeleton is not given
+DEFAULT_SKELETON = 'mixamo17'
+
+#Joint layout written next to the 3D outputs
+SKELETON_FILE = 'skeleton.json'
+
+
+# Output joints of a dataset skeleton and the rig bone each one is read from.
+#
+# `joints` is the ordered list of output joint names and `bones` the matching
+# rig bone names (without prefix); the same bone may feed several joints.
+# `parents` gives each joint's parent index (-1 for the root) when known. A
+# skeleton with `joints=None` is dense: every pose bone of the rig, in rig order.
+class Skeleton:
+
+    def __init__(self, name, joints=None, bones=None, parents=None, prefix=MIXAMO_PREFIX):
+        self.name = name
+        self.joints = None if joints is None else list(joints)
+        self.bones = self.joints if bones is None else list(bones)
+        self.parents = None if parents is None else list(parents)
+        self.prefix = prefix
+        if self.joints is not None and len(self.bones) != len(self.joints):
+            raise ValueError('Skeleton %s: %d joints but %d bones' % (name, len(self.joints), len(self.bones)))
+        if self.parents is not None and len(self.parents) != len(self.joints):
+            raise ValueError('Skeleton %s: %d joints but %d parents' % (name, len(self.joints), len(self.parents)))
+
+    @property
+    def dense(self):
+        return self.joints is None
+
+    def __len__(self):
+        if self.dense:
+            raise TypeError('Skeleton %s is dense: its size depends on the rig' % self.name)
+        return len(self.joints)
+
+    # Full rig bone names, in output order (all of `rig_bones` for a dense skeleton)
+    def bone_names(self, joint_id='', rig_bones=None):
+        if self.dense:
+            if rig_bones is None:
+                raise ValueError('Skeleton %s is dense: pass the rig bone names' % self.name)
+            return list(rig_bones)
+        prefix = self.prefix.format(id=joint_id)
+        return [prefix + bone for bone in self.bones]
+
+    # Output joint names for a rig (the bone names themselves for a dense skeleton)
+    def joint_names(self, rig_bones=None):
+        return list(rig_bones) if self.dense else list(self.joints)
+
+    # (left, right) joint indices by name ('Left...', 'left_...', 'L<Upper>...'), for flip augmentation
+    def symmetry(self, rig_bones=None):
+        names = [name.rsplit(':', 1)[-1] for name in self.joint_names(rig_bones)]
+        left = [j for j, name in enumerate(names) if SIDE_RE['left'].match(name)]
+        right = [j for j, name in enumerate(names) if SIDE_RE['right'].match(name)]
+        return left, right
+
+    def __repr__(self):
+        return 'Skeleton(%r, %s joints)' % (self.name, 'dense' if self.dense else len(self.joints))
+
+
+#The 17 joints the extraction scripts always exported (order kept)
+MIXAMO_17 = ['Hips', 'LeftUpLeg', 'LeftLeg', 'LeftFoot', 'RightUpLeg', 'RightLeg', 'RightFoot',
+             'Spine1', 'Neck', 'Head', 'HeadTop_End', 'RightArm', 'RightForeArm', 'RightHand',
+             'LeftArm', 'LeftForeArm', 'LeftHand']
+
+#Human3.6M 32-joint layout (VideoPose3D order and parents) read from a Mixamo rig
+H36M_32_JOINTS = ['Hip', 'RHip', 'RKnee', 'RFoot', 'RToe', 'RToeSite', 'LHip', 'LKnee', 'LFoot', 'LToe', 'LToeSite',
+                  'Spine', 'Thorax', 'Neck', 'Head', 'HeadSite',
+                  'LShoulderRoot', 'LShoulder', 'LElbow', 'LWrist', 'LHand', 'LHandSite', 'LThumb', 'LThumbSite',
+                  'RShoulderRoot', 'RShoulder', 'RElbow', 'RWrist', 'RHand', 'RHandSite', 'RThumb', 'RThumbSite']
+H36M_32_BONES = ['Hips', 'RightUpLeg', 'RightLeg', 'RightFoot', 'RightToeBase', 'RightToe_End',
+                 'LeftUpLeg', 'LeftLeg', 'LeftFoot', 'LeftToeBase', 'LeftToe_End',
+                 'Spine', 'Spine2', 'Neck', 'Head', 'HeadTop_End',
+                 'LeftShoulder', 'LeftArm', 'LeftForeArm', 'LeftHand', 'LeftHandMiddle1', 'LeftHandMiddle4',
+                 'LeftHandThumb1', 'LeftHandThumb4',
+                 'RightShoulder', 'RightArm', 'RightForeArm', 'RightHand', 'RightHandMiddle1', 'RightHandMiddle4',
+                 'RightHandThumb1', 'RightHandThumb4']
+H36M_32_PARENTS = [-1, 0, 1, 2, 3, 4, 0, 6, 7, 8, 9, 0, 11, 12, 13, 14, 12,
+                   16, 17, 18, 19, 20, 19, 22, 12, 24, 25, 26, 27, 28, 27, 30]
+
+#SMPL 24-joint layout read from a Mixamo rig
+SMPL_24_JOINTS = ['pelvis', 'left_hip', 'right_hip', 'spine1', 'left_knee', 'right_knee', 'spine2',
+                  'left_ankle', 'right_ankle', 'spine3', 'left_foot', 'right_foot', 'neck', 'left_collar',
+                  'right_collar', 'head', 'left_shoulder', 'right_shoulder', 'left_elbow', 'right_elbow',
+                  'left_wrist', 'right_wrist', 'left_hand', 'right_hand']
+SMPL_24_BONES = ['Hips', 'LeftUpLeg', 'RightUpLeg', 'Spine', 'LeftLeg', 'RightLeg', 'Spine1',
+                 'LeftFoot', 'RightFoot', 'Spine2', 'LeftToeBase', 'RightToeBase', 'Neck', 'LeftShoulder',
+                 'RightShoulder', 'Head', 'LeftArm', 'RightArm', 'LeftForeArm', 'RightForeArm',
+                 'LeftHand', 'RightHand', 'LeftHandMiddle1', 'RightHandMiddle1']
+SMPL_24_PARENTS = [-1, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 9, 9, 12, 13, 14, 16, 17, 18, 19, 20, 21]
+
+SKELETONS = {
+    'mixamo17': Skeleton('mixamo17', MIXAMO_17),
+    'h36m32': Skeleton('h36m32', H36M_32_JOINTS, H36M_32_BONES, H36M_32_PARENTS),
+    'smpl24': Skeleton('smpl24', SMPL_24_JOINTS, SMPL_24_BONES, SMPL_24_PARENTS),
+    #Dense export: every pose bone of the rig
+    'all': Skeleton('all'),
+}
+
+
+# Skeleton from a JSON/YAML file
+#
+# Either a plain list of bone names, or a mapping with 'joints' (list of names,
+# or of {'name', 'bone', 'parent'} entries) and optional 'name' and 'prefix'.
+# YAML needs PyYAML.
+def load_skeleton_file(path):
+    with open(path) as f:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError('Reading %s needs PyYAML (pip install pyyaml), or use a .json file' % path)
+            spec = yaml.safe_load(f)
+        else:
+            spec = json.load(f)
+
+    if isinstance(spec, list):
+        spec = {'joints': spec}
+    name = spec.get('name', os.path.splitext(os.path.basename(path))[0])
+    entries = spec['joints']
+    if all(isinstance(entry, str) for entry in entries):
+        joints, bones, parents = entries, entries, spec.get('parents')
+    else:
+        joints = [entry['name'] for entry in entries]
+        bones = [entry.get('bone', entry['name']) for entry in entries]
+        parents = None
+        if any('parent' in entry for entry in entries):
+            parents = [-1 if entry.get('parent') is None else
+                       (joints.index(entry['parent']) if isinstance(entry['parent'], str) else int(entry['parent']))
+                       for entry in entries]
+    return Skeleton(name, joints, bones, parents, prefix=spec.get('prefix', MIXAMO_PREFIX))
+
+
+# Write <out_dir>/skeleton.json: skeleton name, output joint names, rig bones and parents
+#
+# `bone_names` are the full rig bone names actually sampled (the rig's own bones
+# for a dense skeleton). Returns the file written.
+def save_skeleton(out_dir, skeleton, bone_names):
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, SKELETON_FILE)
+    with open(path, 'w') as f:
+        json.dump({'name': skeleton.name, 'joints': skeleton.joint_names(bone_names), 'bones': list(bone_names),
+                   'parents': skeleton.parents}, f, indent=1)
+    return path
+
+
+# Registered skeleton by name, or one loaded from a .json/.yaml path
+def get_skeleton(name_or_path=DEFAULT_SKELETON):
+    if name_or_path in SKELETONS:
+        return SKELETONS[name_or_path]
+    if os.path.exists(name_or_path):
+        return load_skeleton_file(name_or_path)
+    raise KeyError('Unknown skeleton %r; registered: %s (or a .json/.yaml file)'
+                   % (name_or_path, ', '.join(sorted(SKELETONS))))
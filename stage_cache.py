@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import numpy as np
+
+#Bytes read per hashing step
+HASH_BLOCK = 1 << 20
+
+#A manifest lock older than this (s) was left by a crashed process and is broken
+LOCK_STALE_SECONDS = 60
+
+
+# Exclusive lock on a manifest shared by several processes or nodes (`with ManifestLock(path):`)
+#
+# Taken by hard-linking a private temp file to <manifest>.lock, like
+# job_queue.Lease, so it also holds on NFS. It is only held for the
+# read-merge-replace of one save, so a lock past LOCK_STALE_SECONDS is stale.
+class ManifestLock:
+
+    def __init__(self, manifest_path, poll=0.05):
+        self.path = manifest_path + '.lock'
+        self.poll = poll
+
+    def __enter__(self):
+        tmp_path = '%s.%s.tmp' % (self.path, uuid.uuid4().hex)
+        with open(tmp_path, 'w') as f:
+            f.write('%d\n' % os.getpid())
+        try:
+            while True:
+                try:
+                    os.link(tmp_path, self.path)
+                    return self
+                except OSError:
+                    if os.stat(tmp_path).st_nlink == 2:
+                        return self
+                try:
+                    if time.time() - os.path.getmtime(self.path) > LOCK_STALE_SECONDS:
+                        os.remove(self.path)
+                except OSError:
+                    pass
+                time.sleep(self.poll)
+        finally:
+            os.remove(tmp_path)
+
+    def __exit__(self, *exc):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# Content-addressed skip-if-unchanged cache for one extraction stage.
+#
+# The manifest (a JSON file next to the stage outputs) maps each clip to the
+# key it was produced with and the files it produced. A clip is current when
+# its key is unchanged and all of its outputs still exist. File digests are
+# memoized by (size, mtime) so unchanged inputs are not re-hashed every run.
+# Several processes may share a manifest (batch or queue workers): save() merges
+# the clips recorded here into the manifest on disk under a ManifestLock.
+class StageCache:
+
+    def __init__(self, manifest_path, stage, force=False):
+        self.manifest_path = manifest_path
+        self.stage = stage
+        self.force = force
+        self.hits = 0
+        self.misses = 0
+        self.manifest = {'clips': {}, 'digests': {}}
+        #Clips recorded by this process, written over whatever the manifest on disk holds
+        self.recorded = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+
+    # sha256 of a file's contents, reusing the stored digest when size and mtime match
+    def file_digest(self, path):
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        known = self.manifest['digests'].get(path)
+        if known is not None and known[0] == stamp:
+            return known[1]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        self.manifest['digests'][path] = [stamp, digest]
+        return digest
+
+    # Combined digest of the code that produces the outputs (scripts and helper modules)
+    def code_digest(self, *paths):
+        return hashlib.sha256(''.join(self.file_digest(p) for p in paths).encode()).hexdigest()
+
+    # Key for a clip from named parts (strings, numbers, lists or NumPy arrays)
+    def key(self, **parts):
+        h = hashlib.sha256(self.stage.encode())
+        for name in sorted(parts):
+            value = parts[name]
+            h.update(name.encode())
+            if isinstance(value, np.ndarray):
+                h.update(str(value.dtype).encode() + str(value.shape).encode())
+                h.update(np.ascontiguousarray(value).tobytes())
+            else:
+                h.update(json.dumps(value, sort_keys=True, default=str).encode())
+        return h.hexdigest()
+
+    # True (and counted as a hit) when `clip` was already produced with `key`
+    def is_current(self, clip, key):
+        entry = self.manifest['clips'].get(clip)
+        current = (not self.force and entry is not None and entry['key'] == key
+                   and all(os.path.exists(path) for path in entry['outputs']))
+        if current:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return current
+
+    # Record a finished clip and persist the manifest right away
+    def record(self, clip, key, outputs):
+        self.recorded[clip] = {'key': key, 'outputs': [os.path.abspath(p) for p in outputs]}
+        self.manifest['clips'][clip] = self.recorded[clip]
+        self.save()
+
+    # Re-read the manifest, merge in the clips recorded here and replace it, all under the lock
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.manifest_path))
+        os.makedirs(directory, exist_ok=True)
+        with ManifestLock(self.manifest_path):
+            manifest = {'clips': {}, 'digests': {}}
+            if os.path.exists(self.manifest_path):
+                with open(self.manifest_path) as f:
+                    manifest = json.load(f)
+            manifest['clips'].update(self.recorded)
+            manifest['digests'].update(self.manifest['digests'])
+            self.manifest = manifest
+            tmp_path = '%s.%s.tmp' % (self.manifest_path, uuid.uuid4().hex)
+            with open(tmp_path, 'w') as f:
+                json.dump(self.manifest, f, indent=1)
+            os.replace(tmp_path, self.manifest_path)
+
+    def summary(self):
+        total = self.hits + self.misses
+        print('[%s cache] %d clip(s): %d up to date, %d recomputed%s'
+              % (self.stage, total, self.hits, self.misses, ' (--force)' if self.force else ''))
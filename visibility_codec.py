@@ -0,0 +1,197 @@
+# Compact visibility outputs: bit-packed joint masks plus hidden-interval runs
+#
+# occlusion.py writes visibility as one float64 (F, J) array per camera
+# (1 = visible, 0 = out of view or occluded). visibility.npz holds the same
+# information as:
+#   bits            (C, F, ceil(J / 8)) uint8, one bit per joint (1 = visible)
+#   n_joints        number of joints
+#   hidden_starts,  first / one-past-last row of every interval in which a joint
+#   hidden_stops    is hidden, grouped per (camera, joint)
+#   hidden_offsets  (C * J + 1) start of each (camera, joint) group in the above
+#
+# Usage (convert existing outputs; plain Python):
+#   python visibility_codec.py ../../BlendMimic3D/S1/Occlusions [--remove-float]
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from dataset_store import STORE_EXT, array_shape, open_output, save_output
+from frame_selection import load_frames
+
+VISIBILITY_NAME = 'visibility.npz'
+FLOAT_NAME = 'occluded_kpt.npz'
+
+#Visibility outputs occlusion.py and fused_extraction.py accept for --visibility
+VISIBILITY_FORMATS = ('float', 'packed', 'both')
+
+
+# Hidden intervals of a (C, F, J) bool visibility mask -> (starts, stops, offsets)
+def hidden_runs(visible):
+    C, F, J = visible.shape
+    hidden = np.zeros((C, J, F + 2), dtype=np.int8)
+    hidden[:, :, 1:-1] = ~visible.transpose(0, 2, 1)
+    edges = np.diff(hidden, axis=2)
+    c, j, starts = np.nonzero(edges == 1)
+    stops = np.nonzero(edges == -1)[2]
+    counts = np.bincount(c * J + j, minlength=C * J)
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    return starts.astype(np.int32), stops.astype(np.int32), offsets
+
+
+# Arrays of a visibility.npz for (C, F, J) visibility (bool, or float with 0 = hidden)
+def encode_visibility(visibility, runs=True):
+    visible = np.asarray(visibility) != 0
+    arrays = {'bits': np.packbits(visible, axis=2, bitorder='little'), 'n_joints': np.int64(visible.shape[2])}
+    if runs:
+        arrays['hidden_starts'], arrays['hidden_stops'], arrays['hidden_offsets'] = hidden_runs(visible)
+    return arrays
+
+
+# Write <clip_dir>/visibility.npz (or its store, by `fmt`); returns the files written
+def save_visibility(clip_dir, visibility, fmt='npz', runs=True):
+    return save_output(os.path.join(clip_dir, VISIBILITY_NAME), fmt, **encode_visibility(visibility, runs))
+
+
+# Write a clip's (C, F, J) visibility as occluded_kpt.npz ('float'), visibility.npz ('packed') or both
+#
+# `fmt` is the dataset_store output format of either file; returns the files written.
+def save_occlusion_outputs(clip_dir, visibility, fmt='npz', visibility_fmt='float'):
+    if visibility_fmt not in VISIBILITY_FORMATS:
+        raise ValueError('Unknown visibility format %r, expected one of %s' % (visibility_fmt, ', '.join(VISIBILITY_FORMATS)))
+    written = []
+    if visibility_fmt in ('float', 'both'):
+        written += save_output(os.path.join(clip_dir, FLOAT_NAME), fmt,
+                               **{f'Cam_{idx}': visibility[idx] for idx in range(len(visibility))})
+    if visibility_fmt in ('packed', 'both'):
+        written += save_visibility(clip_dir, visibility, fmt)
+    return written
+
+
+# Lazy reader of a visibility.npz (or its store).
+#
+# Reads like occluded_kpt.npz (reader['Cam_0'] is the (F, J) float array) and
+# unpacks only the rows asked for. Rows are the clip's output rows; `frames`
+# holds their scene frame numbers when the directory has a frames.npy.
+class VisibilityReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.data = open_output(path)
+        #0-d in a .npz, a 1-element memmap in a store
+        self.n_joints = int(np.asarray(self.data['n_joints']).reshape(-1)[0])
+        self.n_cameras, self.n_frames = array_shape(self.data, 'bits')[:2]
+        self.frames = load_frames(os.path.dirname(path))
+        self._bits = None
+        self._runs = None
+
+    # Bit rows, loaded on first use (a memmap for store outputs)
+    @property
+    def bits(self):
+        if self._bits is None:
+            self._bits = self.data['bits']
+        return self._bits
+
+    def keys(self):
+        return ['Cam_%d' % c for c in range(self.n_cameras)]
+
+    def __contains__(self, name):
+        return name in self.keys()
+
+    # Shape of reader[name], as ArrayStore.shape
+    def shape(self, name):
+        return (self.n_frames, self.n_joints)
+
+    # (stop - start, J) bool mask of camera `camera`, True = visible
+    def mask(self, camera, start=0, stop=None):
+        start, stop, _ = slice(start, stop).indices(self.n_frames)
+        return np.unpackbits(self.bits[camera, start:stop], axis=1, count=self.n_joints,
+                             bitorder='little').astype(bool)
+
+    # Rows [start, stop) of camera `camera` as 1.0 (visible) / 0.0 (hidden), like occluded_kpt.npz
+    def window(self, camera, start=0, stop=None, dtype=np.float64):
+        return self.mask(camera, start, stop).astype(dtype)
+
+    def __getitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        return self.window(int(name[len('Cam_'):]))
+
+    def _hidden_runs(self):
+        if self._runs is None:
+            if 'hidden_offsets' in self.data:
+                self._runs = (self.data['hidden_starts'], self.data['hidden_stops'], self.data['hidden_offsets'])
+            else:
+                self._runs = hidden_runs(np.stack([self.mask(c) for c in range(self.n_cameras)]))
+        return self._runs
+
+    # (starts, stops) of the row intervals in which `joint` is hidden from `camera`
+    def hidden_intervals(self, camera, joint):
+        starts, stops, offsets = self._hidden_runs()
+        group = camera * self.n_joints + joint
+        lo, hi = offsets[group], offsets[group + 1]
+        return np.asarray(starts[lo:hi]), np.asarray(stops[lo:hi])
+
+    # Rows in which `joint` is hidden from `camera`
+    def hidden_frames(self, camera, joint):
+        starts, stops = self.hidden_intervals(camera, joint)
+        if not len(starts):
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([np.arange(a, b) for a, b in zip(starts, stops)])
+
+    # (C, J) fraction of rows in which each joint is hidden, from the runs alone
+    def hidden_fraction(self):
+        starts, stops, offsets = self._hidden_runs()
+        lengths = np.asarray(stops, dtype=np.int64) - starts
+        totals = np.add.reduceat(np.concatenate([lengths, [0]]), offsets[:-1]) * (np.diff(offsets) > 0)
+        return totals.reshape(self.n_cameras, self.n_joints) / max(self.n_frames, 1)
+
+    # Rows of camera `camera` with at least `min_hidden` hidden joints (occlusion-stratified sampling)
+    def frames_with_hidden(self, camera, min_hidden=1):
+        counts = np.zeros(self.n_frames + 1, dtype=np.int64)
+        for joint in range(self.n_joints):
+            starts, stops = self.hidden_intervals(camera, joint)
+            np.add.at(counts, starts, 1)
+            np.add.at(counts, stops, -1)
+        return np.flatnonzero(np.cumsum(counts[:-1]) >= min_hidden)
+
+    def __repr__(self):
+        return 'VisibilityReader(%d cameras, %d frames, %d joints)' % (self.n_cameras, self.n_frames, self.n_joints)
+
+
+# Visibility of an Occlusions/<action> directory: the packed output if there is one, else occluded_kpt
+def open_visibility(clip_dir):
+    path = os.path.join(clip_dir, VISIBILITY_NAME)
+    if os.path.exists(path) or os.path.isdir(os.path.splitext(path)[0] + STORE_EXT):
+        return VisibilityReader(path)
+    return open_output(os.path.join(clip_dir, FLOAT_NAME))
+
+
+# Camera count of a float occluded_kpt output
+def _n_cameras(data):
+    n = 0
+    while 'Cam_%d' % n in data:
+        n += 1
+    return n
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python visibility_codec.py <Occlusions dir> [--remove-float]')
+        sys.exit(1)
+    occlusion_dir = sys.argv[1]
+    remove_float = '--remove-float' in sys.argv
+    before = after = 0
+    for action in sorted(os.listdir(occlusion_dir)):
+        float_path = os.path.join(occlusion_dir, action, FLOAT_NAME)
+        if not os.path.exists(float_path):
+            continue
+        data = np.load(float_path)
+        visibility = np.stack([data['Cam_%d' % c] for c in range(_n_cameras(data))])
+        written = save_visibility(os.path.join(occlusion_dir, action), visibility)
+        before += os.path.getsize(float_path)
+        after += sum(os.path.getsize(path) for path in written)
+        if remove_float:
+            os.remove(float_path)
+        print(action, visibility.shape)
+    print('occluded_kpt.npz: %d bytes -> visibility.npz: %d bytes (%.1fx)' % (before, after, before / max(after, 1)))